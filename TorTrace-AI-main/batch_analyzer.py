@@ -1,4 +1,6 @@
 import os
+import sys
+import argparse
 import json
 import subprocess
 from datetime import datetime
@@ -6,12 +8,19 @@ import csv
 import time
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traffic_analysis'))
+from perf_metrics import aggregate_metrics, write_prometheus
+from pcap_reader import is_capture_file, capture_stem
+
 
 PCAP_DIR = 'data/pcap_files'
 RESULTS_DIR = 'data/batch_results'
 ALERT_LOG = 'data/alert_log.json'
 PERF_METRICS = 'data/perf_metrics.json'
+PERF_METRICS_PROM = 'data/perf_metrics.prom'
 ALERT_THRESHOLD = 50.0  # Confidence % for triggering alert
+ANALYZER_ATTEMPTS = 3  # Runs of the PCAP analyzer; each retry resumes from its checkpoint
 ANALYZER_SCRIPT = 'traffic_analysis/pcap_analyzer.py'
 CORRELATOR_SCRIPT = 'correlation/timing_correlator.py'
 FINGERPRINTER_SCRIPT = 'ml_models/website_fingerprinter.py'
@@ -39,6 +48,15 @@ def wait_for_file(filepath, timeout=10):
     return False
 
 
+def load_analyzer_metrics(analysis_file):
+    """Per-stage analyzer metrics stored in an analysis JSON (None if absent)."""
+    try:
+        with open(analysis_file, 'r') as f:
+            return json.load(f).get('metrics')
+    except (OSError, ValueError):
+        return None
+
+
 def check_tor_flows(analysis_file):
     try:
         with open(analysis_file, 'r') as f:
@@ -81,13 +99,22 @@ def log_alerts(pcap_name, guard_results, alert_log=ALERT_LOG):
     return triggered
 
 
-def analyze_pcap(pcap_file):
+def analyze_pcap(pcap_file, workers=1, store=None):
     try:
-        base_name = os.path.splitext(os.path.basename(pcap_file))[0]
+        base_name = capture_stem(pcap_file)
         print(f"\nAnalyzing {pcap_file} ...")
         analyzer_out = os.path.join(RESULTS_DIR, f'{base_name}_analysis.json')
-        cmd_analyzer = ['python3', ANALYZER_SCRIPT, '--pcap', pcap_file, '--out', analyzer_out]
-        out, err, code = run_command(cmd_analyzer)
+        checkpoint = os.path.join(RESULTS_DIR, f'{base_name}_analysis.ckpt')
+        cmd_analyzer = ['python3', ANALYZER_SCRIPT, '--pcap', pcap_file, '--out', analyzer_out,
+                        '--checkpoint', checkpoint]
+        if store:
+            cmd_analyzer += ['--store', store]
+        for attempt in range(1, ANALYZER_ATTEMPTS + 1):
+            out, err, code = run_command(cmd_analyzer)
+            if code == 0 or not os.path.exists(checkpoint):
+                break
+            print(f"PCAP analyzer interrupted (attempt {attempt}/{ANALYZER_ATTEMPTS}), "
+                  f"resuming from {checkpoint}")
         if code != 0:
             print(f"PCAP analyzer failed:\nSTDOUT:\n{out}\nSTDERR:\n{err}")
             return None
@@ -95,6 +122,7 @@ def analyze_pcap(pcap_file):
             print(f"Error: Analysis file not created: {analyzer_out}")
             return None
         print(f"PCAP analysis done, results saved to {analyzer_out}")
+        metrics = load_analyzer_metrics(analyzer_out)
 
         has_tor_flows = check_tor_flows(analyzer_out)
         if not has_tor_flows:
@@ -105,11 +133,18 @@ def analyze_pcap(pcap_file):
                 'timing': None,
                 'fingerprint': None,
                 'gnn': None,
-                'has_tor_flows': False
+                'has_tor_flows': False,
+                'metrics': metrics
             }
 
         correlator_out = os.path.join(RESULTS_DIR, f'{base_name}_timing.json')
-        cmd_corr = ['python3', CORRELATOR_SCRIPT, '--input', analyzer_out, '--output', correlator_out]
+        if store:
+            # The analyzer already added this capture's patterns to the store; correlate the
+            # new ones against every overlapping stored flow
+            cmd_corr = ['python3', CORRELATOR_SCRIPT, '--store', store, '--output', correlator_out]
+        else:
+            cmd_corr = ['python3', CORRELATOR_SCRIPT, '--input', analyzer_out, '--output', correlator_out]
+        cmd_corr += ['--workers', str(workers)]
         out, err, code = run_command(cmd_corr)
         if code != 0:
             print(f"Timing correlator failed:\nSTDOUT:\n{out}\nSTDERR:\n{err}")
@@ -147,7 +182,8 @@ def analyze_pcap(pcap_file):
             'timing': correlator_out if os.path.exists(correlator_out) else None,
             'fingerprint': fingerprint_out if os.path.exists(fingerprint_out) else None,
             'gnn': gnn_out,
-            'has_tor_flows': True
+            'has_tor_flows': True,
+            'metrics': metrics
         }
     except Exception as e:
         print(f"Error processing {pcap_file}: {e}")
@@ -184,7 +220,15 @@ def aggregate_results(results_list):
 
 
 def main():
-    pcaps = [os.path.join(PCAP_DIR, f) for f in os.listdir(PCAP_DIR) if f.endswith('.pcap')]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for the timing correlator of each PCAP')
+    parser.add_argument('--store', metavar='DB',
+                        help='Persistent pattern store shared by every PCAP for cross-capture correlation')
+    args = parser.parse_args()
+
+    # .pcap, .pcapng and .cap, optionally archived as .gz/.xz/.zst
+    pcaps = sorted(os.path.join(PCAP_DIR, f) for f in os.listdir(PCAP_DIR) if is_capture_file(f))
     print(f"Found {len(pcaps)} PCAP files to analyze.")
 
     all_results = []
@@ -197,7 +241,7 @@ def main():
 
     for pcap in pcaps:
         start = time.time()
-        result = analyze_pcap(pcap)
+        result = analyze_pcap(pcap, args.workers, args.store)
         duration = time.time() - start
 
         if result:
@@ -205,7 +249,8 @@ def main():
             analysis_times.append({
                 "pcap": os.path.basename(pcap),
                 "duration_sec": round(duration, 2),
-                "success": bool(result.get('has_tor_flows'))
+                "success": bool(result.get('has_tor_flows')),
+                "analyzer": result.get('metrics')
             })
             if result.get('has_tor_flows'):
                 successful_count += 1
@@ -234,7 +279,9 @@ def main():
     if all_results:
         aggregate_results(all_results)
 
-    # Save performance metrics as JSON
+    # Save performance metrics as JSON, with the analyzer's per-stage
+    # timers and counters summed over every PCAP
+    analyzer_totals = aggregate_metrics(entry.get('analyzer') for entry in analysis_times)
     with open(PERF_METRICS, 'w') as f:
         json.dump({
             "per_file": analysis_times,
@@ -242,9 +289,15 @@ def main():
             "total_pcaps": len(pcaps),
             "successful": successful_count,
             "no_tor_flows": zero_flow_count,
-            "failed": failed_count
+            "failed": failed_count,
+            "analyzer": analyzer_totals
         }, f, indent=2)
+    write_prometheus(analyzer_totals, PERF_METRICS_PROM)
     print(f"\nPerformance metrics saved to {PERF_METRICS}")
+    if analyzer_totals['runs']:
+        print(f"Analyzer: {analyzer_totals['packets_per_sec']:.0f} packets/sec, "
+              f"{analyzer_totals['flows_per_sec']:.1f} flows/sec, "
+              f"relay hit ratio {analyzer_totals['relay_hit_ratio']:.2%}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Candidate Pair Index
+
+Pre-filter for entry/exit correlation. Two flows of the same circuit are
+active at the same time and carry similar amounts of traffic, so most
+pairs can be ruled out before any correlation is computed:
+
+    time      the flows' [start_time, end_time] intervals overlap, allowing
+              time_slack seconds for clock skew between vantage points
+    duration  the longer flow lasts at most duration_ratio times the
+              shorter one (plus time_slack)
+    volume    the larger flow carries at most volume_ratio times the bytes
+              of the smaller one
+
+Exit flows are kept in coarse log-scale volume buckets (one per factor of
+volume_ratio), each sorted by start time. Entries are swept in the same
+order: a block of entries from one bucket, consecutive in start time, can
+only pair with the exits of the neighbouring buckets whose start times
+fall in one window, found with two binary searches per bucket. The window
+is bounded by the block's interval and the longest exit duration the
+duration filter still allows. Each block comes with the exact filter as a
+boolean mask, so scorers compute dense tiles over the window and discard
+the masked pairs; the work grows with the number of plausible pairs
+instead of E x X.
+
+A filter is skipped when a pattern lacks its fields (e.g. reports written
+before patterns carried start_time/end_time).
+"""
+
+import numpy as np
+
+TIME_SLACK = 5.0  # Seconds of clock skew tolerated between captures
+DURATION_RATIO = 4.0  # Longest to shortest flow duration of a plausible pair
+VOLUME_RATIO = 4.0  # Largest to smallest byte count of a plausible pair
+BLOCK_SIZE = 256  # Entries per block of the sweep
+
+
+def _column(patterns, key):
+    """float64 array of a pattern field, or None if any pattern lacks it."""
+    values = [p.get(key) for p in patterns]
+    if not values or any(v is None for v in values):
+        return None
+    return np.asarray(values, dtype=np.float64)
+
+
+class CandidateIndex:
+    """
+    Time/volume index over exit patterns.
+
+    Usage:
+        index = CandidateIndex(exit_patterns)
+        for rows, cols, mask in index.blocks(entry_patterns):
+            ...  # score entries rows against exits cols where mask is set
+        index.scored_pairs  # plausible pairs yielded so far
+    """
+
+    def __init__(self, patterns, time_slack=TIME_SLACK, duration_ratio=DURATION_RATIO,
+                 volume_ratio=VOLUME_RATIO):
+        """
+        Args:
+            patterns: Exit pattern dicts ('start_time', 'end_time',
+                'total_bytes')
+            time_slack: Seconds of clock skew tolerated
+            duration_ratio: Largest ratio of flow durations kept
+            volume_ratio: Largest ratio of byte counts kept
+        """
+        self.size = len(patterns)
+        self.time_slack = time_slack
+        self.duration_ratio = duration_ratio
+        self.volume_ratio = volume_ratio
+        self.scored_pairs = 0
+        self.starts = _column(patterns, 'start_time')
+        self.ends = _column(patterns, 'end_time')
+        if self.starts is None or self.ends is None:
+            self.starts = self.ends = None
+        self.volumes = _column(patterns, 'total_bytes')
+        self.buckets = {}
+        bucket_ids = self._bucket_ids(self.volumes, self.size)
+        for bucket in np.unique(bucket_ids).tolist():
+            members = self._sweep_order(np.flatnonzero(bucket_ids == bucket), self.starts)
+            self.buckets[bucket] = (members, None if self.starts is None else self.starts[members])
+
+    def _bucket_ids(self, volumes, count):
+        """Volume bucket of each pattern (all 0 when volumes are unknown)."""
+        if volumes is None:
+            return np.zeros(count, dtype=np.int64)
+        return np.floor(np.log(np.maximum(volumes, 1)) / np.log(self.volume_ratio)).astype(np.int64)
+
+    @staticmethod
+    def _sweep_order(members, starts):
+        return members if starts is None else members[np.argsort(starts[members], kind='stable')]
+
+    def _entry_columns(self, patterns):
+        """(starts, ends, volumes) of entry patterns; None for filters that are off."""
+        starts = ends = volumes = None
+        if self.starts is not None:
+            starts = _column(patterns, 'start_time')
+            ends = _column(patterns, 'end_time')
+            if starts is None or ends is None:
+                starts = ends = None
+        if self.volumes is not None:
+            volumes = _column(patterns, 'total_bytes')
+        return starts, ends, volumes
+
+    def pair_filter(self, patterns):
+        """
+        Plausibility test for entry patterns against the index.
+
+        Returns:
+            callable: plausible(rows, cols) -> bool array, for broadcastable
+                arrays of entry and exit indices
+        """
+        starts, ends, volumes = self._entry_columns(patterns)
+        slack = self.time_slack
+
+        def plausible(rows, cols):
+            rows, cols = np.broadcast_arrays(rows, cols)
+            mask = np.ones(rows.shape, dtype=bool)
+            if starts is not None:
+                entry_starts, entry_ends = starts[rows], ends[rows]
+                exit_starts, exit_ends = self.starts[cols], self.ends[cols]
+                mask &= (exit_ends >= entry_starts - slack) & (exit_starts <= entry_ends + slack)
+                shorter = np.minimum(entry_ends - entry_starts, exit_ends - exit_starts)
+                longer = np.maximum(entry_ends - entry_starts, exit_ends - exit_starts)
+                mask &= longer <= (shorter + slack) * self.duration_ratio
+            if volumes is not None:
+                entry_volumes = np.maximum(volumes[rows], 1)
+                exit_volumes = np.maximum(self.volumes[cols], 1)
+                mask &= (np.maximum(entry_volumes, exit_volumes) <=
+                         np.minimum(entry_volumes, exit_volumes) * self.volume_ratio)
+            return mask
+
+        return plausible
+
+    def blocks(self, patterns, block_size=BLOCK_SIZE):
+        """
+        Sweep entry patterns against the index.
+
+        Every entry is in exactly one block. scored_pairs is increased by
+        the plausible pairs of each block as it is yielded.
+
+        Args:
+            patterns: Entry pattern dicts
+            block_size: Entries per block
+
+        Yields:
+            tuple: (entry indices, exit indices, mask) where the exit
+                indices are sorted and mask[i, j] is True if entry
+                rows[i] and exit cols[j] are a plausible pair
+        """
+        starts, ends, volumes = self._entry_columns(patterns)
+        plausible = self.pair_filter(patterns)
+        bucket_ids = self._bucket_ids(volumes, len(patterns))
+        slack = self.time_slack
+
+        for bucket in np.unique(bucket_ids).tolist():
+            entries = self._sweep_order(np.flatnonzero(bucket_ids == bucket), starts)
+            neighbours = [self.buckets[b] for b in (bucket - 1, bucket, bucket + 1)
+                          if volumes is not None and b in self.buckets]
+            if volumes is None:
+                neighbours = list(self.buckets.values())
+            for first in range(0, len(entries), block_size):
+                rows = entries[first:first + block_size]
+                ranges = []
+                for members, member_starts in neighbours:
+                    if starts is not None:
+                        # Exits still running at the earliest entry start
+                        # (given the longest duration allowed) up to the
+                        # latest entry end
+                        longest = (float((ends[rows] - starts[rows]).max()) + slack) * self.duration_ratio
+                        lo = np.searchsorted(member_starts, starts[rows].min() - slack - longest, side='left')
+                        hi = np.searchsorted(member_starts, ends[rows].max() + slack, side='right')
+                        members = members[lo:hi]
+                    ranges.append(members)
+                cols = np.sort(np.concatenate(ranges)) if ranges else np.zeros(0, dtype=np.int64)
+                mask = plausible(rows[:, None], cols[None, :])
+                self.scored_pairs += int(mask.sum())
+                yield rows, cols, mask
+
+    def pairs(self, patterns):
+        """
+        All plausible (entry, exit) pairs.
+
+        Returns:
+            tuple: (entry indices, exit indices) int64 arrays, sorted by
+                entry and then exit
+        """
+        rows, cols = [], []
+        for block_rows, block_cols, mask in self.blocks(patterns):
+            i, j = np.nonzero(mask)
+            rows.append(block_rows[i])
+            cols.append(block_cols[j])
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        order = np.lexsort((cols, rows))
+        return rows[order], cols[order]
+
+    def candidates(self, pattern):
+        """Sorted indices of the exit patterns that could match pattern."""
+        return self.pairs([pattern])[1]
+
+
+class NewPairBlocks:
+    """
+    Restriction of pair blocks to pairs with at least one new flow, for
+    incremental correlation: pairs of two flows that were both correlated
+    before are never scored again. Blocks of only old entries keep only
+    the new exits, so their tiles shrink to the new columns.
+
+    Usage:
+        restricted = NewPairBlocks(index.blocks(entries), new_entries, new_exits)
+        for rows, cols, mask in restricted:
+            ...
+        restricted.scored_pairs  # pairs yielded so far
+    """
+
+    def __init__(self, blocks, new_entries, new_exits):
+        """
+        Args:
+            blocks: Iterable of (entry indices, sorted exit indices, mask
+                or None) blocks
+            new_entries: bool per entry, True for flows not yet correlated
+            new_exits: bool per exit, True for flows not yet correlated
+        """
+        self.source = blocks
+        self.new_entries = new_entries
+        self.new_exits = new_exits
+        self.scored_pairs = 0
+
+    def __iter__(self):
+        for rows, cols, mask in self.source:
+            if mask is None:
+                mask = np.ones((len(rows), len(cols)), dtype=bool)
+            if not self.new_entries[rows].any():
+                keep = self.new_exits[cols]
+                cols, mask = cols[keep], mask[:, keep]
+            mask = mask & (self.new_entries[rows][:, None] | self.new_exits[cols][None, :])
+            pairs = int(mask.sum())
+            if pairs == 0:
+                continue
+            self.scored_pairs += pairs
+            yield rows, cols, mask
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Lagged Cross-Correlation
+
+Lag-tolerant matching of flows on time-binned traffic series. Each flow's
+packets (rebuilt from its inter-packet times, starting at 0) are counted
+into fixed-width time bins, either as packets or bytes per bin. Every
+series is centered and scaled to unit norm, so the cross-correlation of
+two series at a lag is the normalized correlation of the overlapping
+traffic shifted by that many bins.
+
+Cross-correlations of all entry x exit pairs are computed with FFTs:
+each series is transformed once, and a block of entries is multiplied
+against all exit spectra and transformed back in one call. The
+transform length covers the series plus the lag window, so the
+correlation is linear (no wrap-around) for every lag searched. A dropped
+or extra packet only changes one bin instead of shifting every later
+inter-packet time.
+"""
+
+import numpy as np
+from scipy import fft
+
+BIN_WIDTH = 1.0  # Seconds per bin of the traffic series
+MAX_LAG = 10.0  # Seconds of exit delay searched in each direction
+MAX_BINS = 1024  # Longest traffic series; later packets are dropped
+MIN_PACKETS = 3  # Flows with fewer packets in the series are never matched
+MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes of temporaries per block of pairs
+SERIES_KINDS = ('count', 'bytes')
+
+
+def packet_times(pattern):
+    """Packet times of a pattern relative to its first packet."""
+    ipt = np.asarray(pattern.get('inter_packet_times', []), dtype=np.float64)
+    return np.concatenate(([0.0], np.cumsum(ipt)))
+
+
+def series_bins(patterns, bin_width=BIN_WIDTH, max_bins=MAX_BINS):
+    """Bins needed to hold the longest pattern, capped at max_bins."""
+    span = max((packet_times(p)[-1] for p in patterns), default=0.0)
+    return int(min(max_bins, np.floor(span / bin_width) + 1))
+
+
+def binned_series(patterns, n_bins, bin_width=BIN_WIDTH, kind='count'):
+    """
+    Traffic series of each pattern.
+
+    Args:
+        patterns: Pattern dicts with 'inter_packet_times' (and
+            'packet_sizes' for kind 'bytes')
+        n_bins: Bins per series
+        bin_width: Seconds per bin
+        kind: 'count' (packets per bin) or 'bytes' (bytes per bin)
+
+    Returns:
+        tuple: ((n, n_bins) float64 series, int64 packets binned per pattern)
+    """
+    if kind not in SERIES_KINDS:
+        raise ValueError(f"Unknown series kind: {kind}")
+    series = np.zeros((len(patterns), n_bins))
+    packets = np.zeros(len(patterns), dtype=np.int64)
+    for i, pattern in enumerate(patterns):
+        bins = (packet_times(pattern) / bin_width).astype(np.int64)
+        if kind == 'bytes':
+            sizes = np.asarray(pattern.get('packet_sizes', []), dtype=np.float64)
+            bins = bins[:len(sizes)]
+            weights = sizes[:len(bins)]
+        else:
+            weights = None
+        keep = bins < n_bins
+        packets[i] = int(keep.sum())
+        series[i] = np.bincount(bins[keep], weights=None if weights is None else weights[keep],
+                                minlength=n_bins)
+    return series, packets
+
+
+def normalize(series):
+    """Center each series and scale it to unit norm (flat series become NaN)."""
+    centered = series - series.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return centered / np.linalg.norm(centered, axis=1, keepdims=True)
+
+
+def best_lag_matches(entry_series, exit_series, max_lag_bins, entry_groups=None, exit_groups=None,
+                     entry_valid=None, exit_valid=None, memory_budget=MEMORY_BUDGET, blocks=None):
+    """
+    Best exit match of every entry series over a lag window.
+
+    The score of a pair is the maximum normalized cross-correlation over
+    exit delays -max_lag_bins..max_lag_bins; ties go to the earliest lag
+    and then the first exit.
+
+    Args:
+        entry_series: (E, n_bins) series from binned_series
+        exit_series: (X, n_bins) series from binned_series
+        max_lag_bins: Largest delay searched, in bins
+        entry_groups: Optional integer label per entry
+        exit_groups: Optional integer label per exit; pairs with equal
+            labels are skipped
+        entry_valid: Optional bool per entry; False rows are never matched
+        exit_valid: Optional bool per exit; False columns are never matched
+        memory_budget: Approximate bytes of temporaries per block
+        blocks: Optional iterable of (entry indices, sorted exit indices,
+            mask) restricting the pairs scored (e.g. CandidateIndex.blocks);
+            every entry must be in at most one block. Default every
+            entry x exit pair
+
+    Returns:
+        tuple: (best exit, score, lag in bins) per entry; the exit is -1
+            and the score -inf where no exit can be scored
+    """
+    n_entries, n_bins = entry_series.shape
+    n_exits = len(exit_series)
+    best = (np.full(n_entries, -1, dtype=np.int64), np.full(n_entries, -np.inf),
+            np.zeros(n_entries, dtype=np.int64))
+    if n_entries == 0 or n_exits == 0:
+        return best
+
+    size, lags = lag_window(n_bins, max_lag_bins)
+    entry_spectra, row_ok = series_spectra(entry_series, size, entry_valid)
+    exit_spectra, column_ok = series_spectra(exit_series, size, exit_valid)
+    entry_spectra = np.conj(entry_spectra)
+
+    if blocks is None:
+        blocks = [(np.arange(n_entries), np.arange(n_exits), None)]
+    for rows, cols, mask in blocks:
+        score_lag_block(entry_spectra, exit_spectra, size, lags, rows, cols, mask, row_ok, column_ok,
+                        entry_groups, exit_groups, memory_budget, best)
+    return best
+
+
+def lag_window(n_bins, max_lag_bins):
+    """
+    Transform length and lags searched for series of n_bins bins.
+
+    Returns:
+        tuple: (FFT length covering the series plus the lag window, int64
+            lags -max_lag_bins..max_lag_bins clipped to the series)
+    """
+    max_lag_bins = int(min(max_lag_bins, n_bins - 1))
+    size = fft.next_fast_len(n_bins + max_lag_bins, real=True)
+    return size, np.arange(-max_lag_bins, max_lag_bins + 1)
+
+
+def series_spectra(series, size, valid=None):
+    """
+    Spectra of the normalized series and whether each series can be matched.
+
+    Returns:
+        tuple: ((n, size // 2 + 1) complex128 rfft of the normalized
+            series, bool per series; flat series and False entries of
+            valid are not matchable)
+    """
+    z = normalize(series)
+    ok = ~np.isnan(z).any(axis=1)
+    if valid is not None:
+        ok &= valid
+    return fft.rfft(np.nan_to_num(z), size, axis=1), ok
+
+
+def score_lag_block(entry_spectra, exit_spectra, size, lags, rows, cols, mask, row_ok, column_ok,
+                    entry_groups, exit_groups, memory_budget, best):
+    """
+    Score entries rows against exits cols and store each entry's best.
+
+    Args:
+        entry_spectra: Conjugated entry spectra from series_spectra
+        exit_spectra: Exit spectra from series_spectra
+        size, lags: From lag_window
+        rows, cols, mask: Block of pairs (see best_lag_matches)
+        row_ok, column_ok: Matchable entries and exits
+        entry_groups, exit_groups: Optional group labels
+        memory_budget: Approximate bytes of temporaries
+        best: (best exit, score, lag) arrays updated in place at rows
+    """
+    best_exit, best_score, best_lag = best
+    # Spectrum product (complex) and inverse transform (real) per pair
+    step = max(1, memory_budget // max(1, len(cols) * size * 24))
+    block_spectra = exit_spectra[cols]
+    for start in range(0, len(rows), step):
+        sub = slice(start, start + step)
+        block = rows[sub]
+        # sum_t entry[t] * exit[t + lag]: positive lags mean the exit is later
+        xcorr = fft.irfft(entry_spectra[block, None, :] * block_spectra[None, :, :], size, axis=2)
+        xcorr = xcorr[:, :, lags % size]
+        lag_index = xcorr.argmax(axis=2)
+        scores = np.take_along_axis(xcorr, lag_index[:, :, None], axis=2)[:, :, 0]
+        valid = row_ok[block][:, None] & column_ok[cols][None, :]
+        if entry_groups is not None and exit_groups is not None:
+            valid &= entry_groups[block][:, None] != exit_groups[cols][None, :]
+        if mask is not None:
+            valid &= mask[sub]
+        scores = np.where(valid, scores, -np.inf)
+        top = scores.argmax(axis=1)
+        index = np.arange(len(block))
+        found = np.isfinite(scores[index, top])
+        best_exit[block[found]] = cols[top[found]]
+        best_score[block[found]] = scores[index, top][found]
+        best_lag[block[found]] = lags[lag_index[index, top]][found]
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Online Timing Correlator
+
+Sliding-window correlation of live traffic. Every active flow keeps a
+rate series of fixed-width time bins (packets or bytes per bin, on the
+capture clock) in a ring buffer of its last window + max_lag bins, held
+as running sums: the cumulative sum of its bin values and of their
+squares, the value of bin b at position b % ring. Each entry x exit pair
+keeps one sum of products per exit delay (0..max_lag bins) over the
+window, updated when a bin closes: the products of the bin entering the
+window are added and those of the bin leaving it subtracted. Only flows
+with traffic in those bins contribute, so a bin costs (busy entries x
+busy exits) updates instead of a pass over every pair.
+
+A pair's statistics cover the last window bins, from the first bin both
+flows cover. Its count n, sums and sums of squares come from the two
+flows' running sums at the ends of that range; with the sum of products
+they give the co-moments
+    C_xy = S_xy - S_x S_y / n,  C_xx = S_xx - S_x^2 / n,  C_yy likewise
+and the Pearson coefficient C_xy / sqrt(C_xx C_yy), at any time and
+without rescanning history. The running sums are rebased once per turn
+of the ring, so they stay the size of a window's traffic.
+
+After each bin, the pairs whose sums of products grew (an entry busy in
+the last max_lag + 1 bins, an exit busy in this one) are checked: once a
+pair has min_bins bins of evidence and its coefficient exceeds both the
+threshold and the critical value of a significance test at that many
+bins, the entry's best such exit is emitted. An entry is reported again
+only when a different exit beats the coefficient of the last report, so
+a guard candidate appears within a bin of the evidence being there
+rather than after the capture is analyzed.
+
+State is held only for active flows. A flow is evicted when it ends
+(end_flow, e.g. from the FlowTable's on_flow callback) or after
+flow_timeout seconds without packets. Memory is bounded by the flows
+alive at once: 2 x (window + max_lag + 2) floats per flow for the ring
+and entries x exits x (max_lag + 1) floats for the sums of products,
+however long the flows last. A run of empty bins as long as the ring
+(a quiet capture) is skipped in one step.
+"""
+
+import logging
+
+import numpy as np
+
+from pearson_matrix import critical_correlation, SIGNIFICANCE_LEVEL
+from lag_correlation import BIN_WIDTH, SERIES_KINDS
+
+logger = logging.getLogger(__name__)
+
+ONLINE_MAX_LAG = 2.0  # Seconds of exit delay tracked
+MIN_BINS = 20  # Bins of joint coverage before a pair can be reported
+CORRELATION_THRESHOLD = 0.8  # Coefficient a reported pair must exceed
+ONLINE_WINDOW = 300.0  # Seconds of traffic a pair's coefficient covers
+FLOW_TIMEOUT = 30.0  # Seconds without packets before a flow's state is evicted
+INITIAL_SLOTS = 64  # Flows per side before the state arrays grow
+
+
+class _Side:
+    """Per-flow state of the entry or the exit flows, by slot."""
+
+    def __init__(self, slots, ring):
+        self.slot_of = {}
+        self.info = [None] * slots
+        self.used = np.zeros(slots, dtype=bool)
+        self.pending = np.zeros(slots)  # Value of the bin being filled
+        self.first_bin = np.zeros(slots, dtype=np.int64)
+        self.last_time = np.zeros(slots)
+        # Running sums of bin values and squares of the last ring bins, bin b at b % ring
+        self.sums = np.zeros((slots, ring))
+        self.squares = np.zeros((slots, ring))
+
+    def grow(self, slots):
+        """Enlarge to slots flows."""
+        extra = slots - len(self.used)
+        self.info += [None] * extra
+        self.used = np.concatenate((self.used, np.zeros(extra, dtype=bool)))
+        self.pending = np.concatenate((self.pending, np.zeros(extra)))
+        self.first_bin = np.concatenate((self.first_bin, np.zeros(extra, dtype=np.int64)))
+        self.last_time = np.concatenate((self.last_time, np.zeros(extra)))
+        self.sums = np.pad(self.sums, ((0, extra), (0, 0)))
+        self.squares = np.pad(self.squares, ((0, extra), (0, 0)))
+
+    def running(self, table, slots, bins):
+        """
+        Running sums (table: sums or squares) of slots up to bins, which
+        must be within the ring; constant before a flow starts.
+        """
+        return table[slots, bins % table.shape[1]]
+
+    def values(self, slots, b):
+        """Bin values of slots in closed bin b (0 before a flow starts)."""
+        return self.running(self.sums, slots, b) - self.running(self.sums, slots, b - 1)
+
+
+class OnlineCorrelator:
+    """
+    Incremental entry/exit correlation over live packets.
+
+    Usage:
+        online = OnlineCorrelator(on_match=print)
+        online.add_packet(flow_id, timestamp, size, is_exit, relay_ip, nickname)
+        ...
+        online.end_flow(flow_id)  # when the flow table expires the flow
+    """
+
+    def __init__(self, bin_width=BIN_WIDTH, max_lag=ONLINE_MAX_LAG, min_bins=MIN_BINS,
+                 threshold=CORRELATION_THRESHOLD, series='count', window=ONLINE_WINDOW,
+                 flow_timeout=FLOW_TIMEOUT, alpha=SIGNIFICANCE_LEVEL, on_match=None):
+        """
+        Args:
+            bin_width: Seconds per bin
+            max_lag: Seconds of exit delay tracked (exit after entry)
+            min_bins: Bins of joint coverage needed before reporting a pair
+            threshold: Coefficient a reported pair must exceed
+            series: 'count' (packets per bin) or 'bytes' (bytes per bin)
+            window: Seconds of traffic each coefficient covers (at least
+                min_bins bins)
+            flow_timeout: Seconds without packets before a flow is evicted
+            alpha: Significance level of the coefficient test
+            on_match: Optional callback receiving each match dict
+        """
+        if series not in SERIES_KINDS:
+            raise ValueError(f"Unknown series kind: {series}")
+        self.bin_width = bin_width
+        self.lags = int(round(max_lag / bin_width)) + 1
+        self.min_bins = max(min_bins, 3)
+        self.window = int(round(window / bin_width))
+        if self.window < self.min_bins:
+            raise ValueError(f"window must cover at least min_bins ({self.min_bins}) bins")
+        # Oldest bin read: the window's first bin, minus the largest lag, minus one
+        self.ring = self.window + self.lags + 1
+        self.threshold = threshold
+        self.series = series
+        self.flow_timeout = flow_timeout
+        self.alpha = alpha
+        self.on_match = on_match
+        self.current_bin = None
+        self.entries = _Side(INITIAL_SLOTS, self.ring)
+        self.exits = _Side(INITIAL_SLOTS, self.ring)
+        # Sum of x * y per pair and lag over the window
+        self.products = np.zeros((INITIAL_SLOTS, INITIAL_SLOTS, self.lags))
+        self.reported = {}  # Entry flow id -> (exit flow id, coefficient) last reported
+        self.matches_emitted = 0
+        self.flows_evicted = 0
+
+    def add_packet(self, flow_id, timestamp, size, is_exit, relay_ip=None, nickname=None):
+        """
+        Count one packet of a Tor flow, closing every bin before it.
+
+        Packets older than the open bin are counted in the open bin. A gap
+        of empty bins at least as long as the ring is skipped in one step.
+
+        Returns:
+            list: Match dicts emitted by the bins closed
+        """
+        packet_bin = int(np.floor(timestamp / self.bin_width))
+        matches = []
+        if self.current_bin is None:
+            self.current_bin = packet_bin
+        while self.current_bin < packet_bin:
+            matches += self._close_bin()
+            if packet_bin - self.current_bin >= self.ring:
+                self._skip_bins(packet_bin)
+        side = self.exits if is_exit else self.entries
+        slot = side.slot_of.get(flow_id)
+        if slot is None:
+            slot = self._open_flow(side, flow_id, is_exit, relay_ip, nickname)
+        side.pending[slot] += 1 if self.series == 'count' else size
+        side.last_time[slot] = max(side.last_time[slot], timestamp)
+        return matches
+
+    def end_flow(self, flow_id):
+        """Evict a flow that has ended (its reported matches stay reported)."""
+        for side, is_exit in ((self.entries, False), (self.exits, True)):
+            slot = side.slot_of.get(flow_id)
+            if slot is not None:
+                self._evict(side, slot, is_exit)
+
+    def active_flows(self):
+        """(entry flows, exit flows) currently tracked."""
+        return len(self.entries.slot_of), len(self.exits.slot_of)
+
+    def pair_correlations(self, rows, cols, lag):
+        """
+        Coefficients of entry slots rows x exit slots cols at one lag, over
+        the last window bins closed.
+
+        Returns:
+            tuple: ((len(rows), len(cols)) coefficients, NaN where undefined
+                or fewer than 3 bins, (len(rows), len(cols)) bin counts)
+        """
+        entries, exits = self.entries, self.exits
+        last = self.current_bin - 1
+        rows, cols = rows[:, None], cols[None, :]
+        # Entry bin b - lag is paired with exit bin b, from the first b both cover in the window
+        start = np.maximum(np.maximum(entries.first_bin[rows] + lag, exits.first_bin[cols]), last - self.window + 1)
+        n = (last - start + 1).astype(np.float64)
+        sum_x = entries.running(entries.sums, rows, last - lag) - entries.running(entries.sums, rows, start - lag - 1)
+        sum_xx = (entries.running(entries.squares, rows, last - lag) -
+                  entries.running(entries.squares, rows, start - lag - 1))
+        sum_y = exits.running(exits.sums, cols, last) - exits.running(exits.sums, cols, start - 1)
+        sum_yy = exits.running(exits.squares, cols, last) - exits.running(exits.squares, cols, start - 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            c_xy = self.products[rows, cols, lag] - sum_x * sum_y / n
+            c_xx = sum_xx - sum_x * sum_x / n
+            c_yy = sum_yy - sum_y * sum_y / n
+            r = np.clip(c_xy / np.sqrt(c_xx * c_yy), -1.0, 1.0)
+        r[(n < 3) | ~(c_xx > 0) | ~(c_yy > 0)] = np.nan
+        return r, np.maximum(n, 0)
+
+    def correlations(self):
+        """
+        Current coefficient of every tracked pair at its best lag.
+
+        Returns:
+            tuple: (entry flow ids, exit flow ids, (entries, exits)
+                coefficients with NaN where undefined, lag in seconds, bins)
+        """
+        rows = np.flatnonzero(self.entries.used)
+        cols = np.flatnonzero(self.exits.used)
+        r, lag, n = self._best_lag(rows, cols)
+        return ([self.entries.info[i]['flow_id'] for i in rows], [self.exits.info[j]['flow_id'] for j in cols],
+                r, lag * self.bin_width, n)
+
+    def _best_lag(self, rows, cols):
+        """Coefficient, lag index and bins of each pair at its best lag."""
+        stats = [self.pair_correlations(rows, cols, lag) for lag in range(self.lags)]
+        r = np.stack([s[0] for s in stats])
+        n = np.stack([s[1] for s in stats])
+        lag = np.argmax(np.where(np.isnan(r), -np.inf, r), axis=0)
+        take = lambda values: np.take_along_axis(values, lag[None], axis=0)[0]
+        return take(r), lag, take(n)
+
+    def _open_flow(self, side, flow_id, is_exit, relay_ip, nickname):
+        free = np.flatnonzero(~side.used)
+        if len(free) == 0:
+            self._grow(side, is_exit)
+            free = np.flatnonzero(~side.used)
+        slot = int(free[0])
+        side.slot_of[flow_id] = slot
+        side.info[slot] = {'flow_id': flow_id, 'tor_relay': relay_ip, 'relay_nickname': nickname}
+        side.used[slot] = True
+        side.pending[slot] = 0
+        side.sums[slot] = 0
+        side.squares[slot] = 0
+        side.first_bin[slot] = self.current_bin
+        return slot
+
+    def _grow(self, side, is_exit):
+        slots = 2 * len(side.used)
+        side.grow(slots=slots)
+        pad = [(0, 0)] * 3
+        pad[1 if is_exit else 0] = (0, slots - self.products.shape[1 if is_exit else 0])
+        self.products = np.pad(self.products, pad)
+
+    def _evict(self, side, slot, is_exit):
+        info = side.info[slot]
+        del side.slot_of[info['flow_id']]
+        side.info[slot] = None
+        side.used[slot] = False
+        if is_exit:
+            self.products[:, slot] = 0
+        else:
+            self.products[slot] = 0
+            self.reported.pop(info['flow_id'], None)
+        self.flows_evicted += 1
+
+    def _close_bin(self):
+        """Fold the open bin into the window, emit new matches and open the next bin."""
+        t = self.current_bin
+        entries, exits = self.entries, self.exits
+        for side in (entries, exits):
+            slots = np.flatnonzero(side.used)
+            value = side.pending[slots]
+            side.sums[slots, t % self.ring] = side.running(side.sums, slots, t - 1) + value
+            side.squares[slots, t % self.ring] = side.running(side.squares, slots, t - 1) + value ** 2
+            if (t + 1) % self.ring == 0:
+                # Rebase on the oldest bin of the ring (position 0) so the sums stay bounded
+                side.sums[slots] -= side.sums[slots, :1]
+                side.squares[slots] -= side.squares[slots, :1]
+        self.current_bin = t + 1
+
+        # Products of entries busy in bin t - lag with exits busy in bin t enter the window
+        busy_exits = np.flatnonzero(exits.used & (exits.pending > 0))
+        touched = self._add_products(t, busy_exits, exits.pending[busy_exits], 1.0)
+        # and those of exit bin t - window leave it
+        gone = t - self.window
+        leaving = np.flatnonzero(exits.used)
+        y = exits.values(leaving, gone)
+        self._add_products(gone, leaving[y > 0], y[y > 0], -1.0)
+        entries.pending[:] = 0
+        exits.pending[:] = 0
+
+        now = (t + 1) * self.bin_width
+        rows = np.unique(np.concatenate(touched)) if touched else np.zeros(0, dtype=np.int64)
+        matches = self._emit_matches(rows, busy_exits, now)
+        self._evict_idle(now)
+        return matches
+
+    def _add_products(self, b, cols, y, sign):
+        """
+        Add sign * x * y to the sums of products of exit slots cols (values y
+        in bin b) with every entry busy in bin b - lag, for each lag.
+
+        Returns:
+            list: Entry slots updated, per lag with any
+        """
+        touched = []
+        if len(cols) == 0:
+            return touched
+        used = np.flatnonzero(self.entries.used)
+        for lag in range(self.lags):
+            x = self.entries.values(used, b - lag)
+            rows, x = used[x > 0], x[x > 0]
+            if len(rows):
+                self.products[rows[:, None], cols[None, :], lag] += sign * x[:, None] * y[None, :]
+                touched.append(rows)
+        return touched
+
+    def _skip_bins(self, until):
+        """
+        Close the empty bins up to until at once. Every bin of the ring and
+        of the window is then empty, so the running sums are flat and the
+        sums of products are zero.
+        """
+        for side in (self.entries, self.exits):
+            side.sums[:] = 0
+            side.squares[:] = 0
+        self.products[:] = 0
+        self.current_bin = until
+        self._evict_idle(until * self.bin_width)
+
+    def _evict_idle(self, now):
+        for side, is_exit in ((self.entries, False), (self.exits, True)):
+            for slot in np.flatnonzero(side.used & (side.last_time < now - self.flow_timeout)).tolist():
+                self._evict(side, slot, is_exit)
+
+    def _emit_matches(self, rows, cols, now):
+        """Report entry slots rows whose best significant exit among cols is new."""
+        if len(rows) == 0 or len(cols) == 0:
+            return []
+        r, lag, n = self._best_lag(rows, cols)
+        r = np.where((n >= self.min_bins) & (r > self.threshold), r, -np.inf)
+        best = r.argmax(axis=1)
+        index = np.arange(len(rows))
+        matches = []
+        for i in np.flatnonzero(np.isfinite(r[index, best])).tolist():
+            j = int(best[i])
+            bins = int(n[i, j])
+            if r[i, j] <= critical_correlation(bins, self.alpha):
+                continue
+            entry, exit_flow = self.entries.info[rows[i]], self.exits.info[cols[j]]
+            correlation = float(r[i, j])
+            reported, reported_correlation = self.reported.get(entry['flow_id'], (None, -np.inf))
+            if reported == exit_flow['flow_id'] or correlation <= reported_correlation:
+                continue
+            self.reported[entry['flow_id']] = (exit_flow['flow_id'], correlation)
+            match = {
+                'time': now,
+                'guard_relay': entry['tor_relay'],
+                'guard_nickname': entry['relay_nickname'],
+                'flow': entry['flow_id'],
+                'exit_relay': exit_flow['tor_relay'],
+                'exit_flow': exit_flow['flow_id'],
+                'correlation': round(correlation, 6),
+                'lag': round(int(lag[i, j]) * self.bin_width, 6),
+                'bins': bins,
+            }
+            matches.append(match)
+            self.matches_emitted += 1
+            if self.on_match is not None:
+                self.on_match(match)
+        return matches
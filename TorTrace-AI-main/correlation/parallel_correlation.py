@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Parallel Correlation
+
+Multi-core entry x exit scoring. The pair space is cut into tiles (the
+blocks of a candidate index, or fixed entry x exit rectangles when every
+pair is scored) and the tiles are scored by a pool of worker processes.
+
+The matrices the scorers read (packed inter-packet time sequences, or the
+spectra of the binned series) are copied once into
+multiprocessing.shared_memory; workers map them on start-up, so a task is
+only a tile's entry/exit indices and mask, and no pattern dict is ever
+pickled. Results are merged as tiles complete into a running top-k per
+entry (TopKMerge), with at most a few tiles per worker in flight, so
+neither the tiles nor their scores are held all at once.
+
+The results are the same as the single-process scorers
+(pearson_matrix.best_matches, lag_correlation.best_lag_matches): a tile
+keeps each entry's best pairs, and the merge breaks equal scores on the
+lower exit index, as a scan over the exits in order does.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from pearson_matrix import ranked_candidates, MEMORY_BUDGET, MIN_SEQUENCE, SIGNIFICANCE_LEVEL, TIE_TOLERANCE
+from lag_correlation import lag_window, series_spectra, score_lag_block
+
+TILE_ENTRIES = 256  # Entries per tile when every pair is scored
+TILE_EXITS = 4096  # Exits per tile when every pair is scored
+TASKS_PER_WORKER = 2  # Tiles queued per worker
+TIE_CANDIDATES = 8  # Near-best Pearson pairs kept per entry for exact re-scoring
+
+_shared = {}  # Arrays mapped by a worker process
+_segments = []  # Their shared memory, kept open for the worker's lifetime
+
+
+class SharedArrays:
+    """
+    numpy arrays copied into shared memory for worker processes.
+
+    Usage:
+        with SharedArrays({'a': a, 'b': b}) as shared:
+            pool = ProcessPoolExecutor(initializer=attach_arrays, initargs=(shared.spec,))
+    """
+
+    def __init__(self, arrays):
+        """
+        Args:
+            arrays: Dict of name -> array; None values are passed as None
+        """
+        self.spec = {}
+        self.segments = []
+        for name, array in arrays.items():
+            if array is None:
+                self.spec[name] = None
+                continue
+            array = np.ascontiguousarray(array)
+            segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+            self.segments.append(segment)
+            self.spec[name] = (segment.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_arrays(spec):
+    """Worker initializer: map the arrays of a SharedArrays spec."""
+    _shared.clear()
+    for name, entry in spec.items():
+        if entry is None:
+            _shared[name] = None
+            continue
+        segment_name, shape, dtype = entry
+        segment = shared_memory.SharedMemory(name=segment_name)
+        _segments.append(segment)
+        _shared[name] = np.ndarray(shape, np.dtype(dtype), buffer=segment.buf)
+
+
+class TopKMerge:
+    """
+    Running k best exits per entry.
+
+    Candidates are ranked by score (highest first) and then exit index
+    (lowest first); an extra value (e.g. the lag) travels with each one.
+    """
+
+    def __init__(self, n_entries, k=1):
+        self.k = k
+        self.exits = np.full((n_entries, k), -1, dtype=np.int64)
+        self.scores = np.full((n_entries, k), -np.inf)
+        self.extra = np.zeros((n_entries, k))
+
+    def merge(self, rows, exits, scores, extra=None):
+        """Merge candidate (entry, exit, score[, extra]) arrays."""
+        if len(rows) == 0:
+            return
+        if extra is None:
+            extra = np.zeros(len(rows))
+        touched = np.unique(rows)
+        rows = np.concatenate((np.repeat(touched, self.k), rows))
+        exits = np.concatenate((self.exits[touched].ravel(), exits))
+        scores = np.concatenate((self.scores[touched].ravel(), scores))
+        extra = np.concatenate((self.extra[touched].ravel(), extra))
+        order = np.lexsort((exits, -scores, rows))
+        rows, exits, scores, extra = rows[order], exits[order], scores[order], extra[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+        keep = rank < self.k
+        self.exits[rows[keep], rank[keep]] = exits[keep]
+        self.scores[rows[keep], rank[keep]] = scores[keep]
+        self.extra[rows[keep], rank[keep]] = extra[keep]
+
+
+def grid_tiles(n_entries, n_exits, tile_entries=TILE_ENTRIES, tile_exits=TILE_EXITS):
+    """Every entry x exit pair as (entry indices, exit indices, None) tiles."""
+    for first in range(0, n_entries, tile_entries):
+        rows = np.arange(first, min(n_entries, first + tile_entries))
+        for col in range(0, n_exits, tile_exits):
+            yield rows, np.arange(col, min(n_exits, col + tile_exits)), None
+
+
+def _run_tiles(worker, spec, tiles, workers, merge):
+    """Score tiles on a process pool, merging each result as it arrives."""
+    with ProcessPoolExecutor(max_workers=workers, initializer=attach_arrays, initargs=(spec,)) as pool:
+        pending = set()
+        for tile in tiles:
+            pending.add(pool.submit(worker, tile))
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    merge(*future.result())
+        for future in pending:
+            merge(*future.result())
+
+
+def _pearson_tile(tile):
+    shared = _shared
+    rows, cols, values, scores = ranked_candidates(
+        (shared['entry_matrix'], shared['entry_lengths']), (shared['exit_matrix'], shared['exit_lengths']),
+        shared['entry_groups'], shared['exit_groups'], shared['alpha'][0], int(shared['memory_budget'][0]),
+        [tile], int(shared['candidates'][0]), int(shared['min_length'][0]))
+    return rows, cols, scores, values
+
+
+def _lag_tile(tile):
+    shared = _shared
+    rows, cols, mask = tile
+    best = (np.full(len(shared['row_ok']), -1, dtype=np.int64), np.full(len(shared['row_ok']), -np.inf),
+            np.zeros(len(shared['row_ok']), dtype=np.int64))
+    score_lag_block(shared['entry_spectra'], shared['exit_spectra'], int(shared['size'][0]), shared['lags'],
+                    rows, cols, mask, shared['row_ok'], shared['column_ok'], shared['entry_groups'],
+                    shared['exit_groups'], int(shared['memory_budget'][0]), best)
+    found = rows[best[0][rows] >= 0]
+    return found, best[0][found], best[1][found], best[2][found]
+
+
+def parallel_best_matches(entries, exits, entry_groups=None, exit_groups=None, alpha=SIGNIFICANCE_LEVEL,
+                          memory_budget=MEMORY_BUDGET, blocks=None, candidates=1, min_length=MIN_SEQUENCE,
+                          workers=2):
+    """
+    pearson_matrix.best_matches on a pool of worker processes.
+
+    Args:
+        (as best_matches), plus
+        workers: Worker processes; memory_budget is shared between them
+
+    Returns:
+        tuple: (entry, exit, correlation) of each entry's best pair, up to
+            TIE_CANDIDATES - 1 others within TIE_TOLERANCE of it and the
+            rest of its top candidates, sorted by entry and exit
+    """
+    n_entries = len(entries[1])
+    merged = TopKMerge(n_entries, max(TIE_CANDIDATES, candidates))
+    if blocks is None:
+        blocks = grid_tiles(n_entries, len(exits[1]))
+    arrays = {
+        'entry_matrix': entries[0], 'entry_lengths': entries[1],
+        'exit_matrix': exits[0], 'exit_lengths': exits[1],
+        'entry_groups': entry_groups, 'exit_groups': exit_groups,
+        'alpha': np.array([alpha]), 'memory_budget': np.array([max(1, memory_budget // workers)]),
+        'candidates': np.array([candidates]), 'min_length': np.array([min_length]),
+    }
+    with SharedArrays(arrays) as shared:
+        _run_tiles(_pearson_tile, shared.spec, blocks, workers, merged.merge)
+
+    keep = np.isfinite(merged.scores) & ((merged.scores >= merged.scores[:, :1] - TIE_TOLERANCE) |
+                                         (np.arange(merged.k) < candidates))
+    rows, slots = np.nonzero(keep)
+    cols, values = merged.exits[rows, slots], merged.extra[rows, slots]
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], values[order]
+
+
+def parallel_best_lag_matches(entry_series, exit_series, max_lag_bins, entry_groups=None, exit_groups=None,
+                              entry_valid=None, exit_valid=None, memory_budget=MEMORY_BUDGET, blocks=None,
+                              workers=2):
+    """
+    lag_correlation.best_lag_matches on a pool of worker processes.
+
+    The series are transformed once in this process; workers read the
+    spectra from shared memory.
+
+    Args:
+        (as best_lag_matches), plus
+        workers: Worker processes; memory_budget is shared between them
+
+    Returns:
+        tuple: (best exit, score, lag in bins) per entry, as best_lag_matches
+    """
+    n_entries, n_bins = entry_series.shape
+    merged = TopKMerge(n_entries)
+    if n_entries and len(exit_series):
+        size, lags = lag_window(n_bins, max_lag_bins)
+        entry_spectra, row_ok = series_spectra(entry_series, size, entry_valid)
+        exit_spectra, column_ok = series_spectra(exit_series, size, exit_valid)
+        if blocks is None:
+            blocks = grid_tiles(n_entries, len(exit_series))
+        arrays = {
+            'entry_spectra': np.conj(entry_spectra), 'exit_spectra': exit_spectra,
+            'row_ok': row_ok, 'column_ok': column_ok,
+            'entry_groups': entry_groups, 'exit_groups': exit_groups,
+            'size': np.array([size]), 'lags': lags,
+            'memory_budget': np.array([max(1, memory_budget // workers)]),
+        }
+        with SharedArrays(arrays) as shared:
+            _run_tiles(_lag_tile, shared.spec, blocks, workers, merged.merge)
+    return merged.exits[:, 0], merged.scores[:, 0], merged.extra[:, 0].astype(np.int64)
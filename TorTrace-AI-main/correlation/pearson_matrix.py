@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Batched Pearson Correlation
+
+Entry x exit Pearson correlation of inter-packet time sequences with
+matrix products instead of one scipy.stats.pearsonr call per pair.
+
+Sequences are packed into a zero-padded matrix plus a length per row.
+The per-pair function correlates the first min(len_a, len_b) values of
+both sequences, so pairs are grouped by that truncation length L: for
+each L the first L values of every row involved are standardized once
+(centered and scaled to unit norm, as pearsonr does) and one matrix
+product gives all of the group's coefficients. Products are computed in
+row blocks that fit a memory budget, either over every entry x exit pair
+or over the blocks of a candidate pre-filter (CandidateIndex.blocks). The p-value falls as r grows, so the
+significance test is a comparison with the critical coefficient of the
+group; only coefficients within CRITICAL_MARGIN of it get their p-value
+computed, with the same beta-distribution survival function pearsonr uses.
+
+Only each entry's best match is kept. Pairs whose coefficient is within
+TIE_TOLERANCE of an entry's best are returned as candidates, so callers
+can re-score them with the per-pair function and break ties in the same
+order it does. Callers that apply their own test to the candidates (see
+permutation_test) can ask for each entry's top few pairs instead
+(ranked_candidates), ranked by the Fisher z-score atanh(r) sqrt(L - 3)
+so that a high coefficient over a few values does not outrank a
+slightly lower one over many.
+"""
+
+import numpy as np
+from scipy import special
+
+MIN_SEQUENCE = 3  # Shorter sequences are never correlated
+SIGNIFICANCE_LEVEL = 0.05  # Pairs need a p-value below this
+MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes of temporaries per block of coefficients
+TIE_TOLERANCE = 1e-9  # Coefficients this close to the best are re-scored exactly
+CRITICAL_MARGIN = 1e-6  # Coefficients this close to the critical value get an exact p-value
+
+
+def pack_sequences(sequences):
+    """
+    Pack ragged sequences into a zero-padded matrix.
+
+    Args:
+        sequences: Iterable of numeric sequences
+
+    Returns:
+        tuple: (float64 matrix of shape (n, max_len), int64 lengths)
+    """
+    sequences = [np.asarray(s, dtype=np.float64).ravel() for s in sequences]
+    lengths = np.array([len(s) for s in sequences], dtype=np.int64)
+    matrix = np.zeros((len(sequences), int(lengths.max()) if len(lengths) else 0))
+    for i, values in enumerate(sequences):
+        matrix[i, :len(values)] = values
+    return matrix, lengths
+
+
+def standardize(values):
+    """
+    Center each row and scale it to unit norm.
+
+    Follows pearsonr: the norm is taken of the row divided by its largest
+    absolute deviation (to avoid overflow) and rows of identical values,
+    whose correlation is undefined, become NaN.
+
+    Args:
+        values: (n, L) float64 matrix
+
+    Returns:
+        np.ndarray: (n, L) standardized rows
+    """
+    centered = values - values.mean(axis=1, keepdims=True)
+    scale = np.abs(centered).max(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        norm = scale * np.linalg.norm(centered / scale, axis=1, keepdims=True)
+        standardized = centered / norm
+    standardized[(values == values[:, :1]).all(axis=1)] = np.nan
+    return standardized
+
+
+def pearson_pvalues(r, n):
+    """
+    Two-sided p-values of Pearson coefficients r over n samples.
+
+    Under the null hypothesis r follows a beta distribution on (-1, 1)
+    with a = b = n/2 - 1 (the distribution pearsonr uses).
+    """
+    a = n / 2 - 1
+    return 2 * special.betaincc(a, a, (np.abs(r) + 1) / 2)
+
+
+def critical_correlation(n, alpha=SIGNIFICANCE_LEVEL):
+    """Coefficient whose two-sided p-value over n samples is alpha."""
+    a = n / 2 - 1
+    return 2 * special.betainccinv(a, a, alpha / 2) - 1
+
+
+def significant(r, n, alpha=SIGNIFICANCE_LEVEL):
+    """
+    pearson_pvalues(r, n) < alpha for positive coefficients, computing
+    p-values only near the critical coefficient.
+    """
+    critical = critical_correlation(n, alpha)
+    result = r > critical + CRITICAL_MARGIN
+    edge = np.abs(r - critical) <= CRITICAL_MARGIN
+    result[edge] = pearson_pvalues(r[edge], n) < alpha
+    return result
+
+
+def _block_rows(columns, budget):
+    # Coefficients, p-values and masks for a block take about 4 float64 per pair
+    return max(1, budget // max(1, columns * 8 * 4))
+
+
+def best_matches(entries, exits, entry_groups=None, exit_groups=None,
+                 alpha=SIGNIFICANCE_LEVEL, memory_budget=MEMORY_BUDGET, blocks=None,
+                 candidates=1, min_length=MIN_SEQUENCE):
+    """
+    Best significant exit match of every entry sequence.
+
+    A pair is scored like the per-pair function: both sequences truncated
+    to the shorter length, which must be at least MIN_SEQUENCE; pairs with
+    an undefined coefficient, a p-value not below alpha, a coefficient not
+    above zero, or the same group label (e.g. flow id) are skipped.
+
+    Args:
+        entries: (matrix, lengths) from pack_sequences
+        exits: (matrix, lengths) from pack_sequences
+        entry_groups: Optional integer label per entry
+        exit_groups: Optional integer label per exit; pairs with equal
+            labels are skipped
+        alpha: Significance level
+        memory_budget: Approximate bytes of temporaries per block
+        blocks: Optional iterable of (entry indices, exit indices, mask)
+            restricting the pairs scored (e.g. CandidateIndex.blocks);
+            default every entry x exit pair
+        candidates, min_length: As ranked_candidates
+
+    Returns:
+        tuple: (entry, exit, correlation) int64/int64/float64 arrays of the
+            candidate pairs: each entry's highest coefficient and every
+            other pair within TIE_TOLERANCE of it (with candidates > 1, the
+            pairs of ranked_candidates), sorted by entry and exit
+    """
+    return ranked_candidates(entries, exits, entry_groups, exit_groups, alpha, memory_budget, blocks,
+                             candidates, min_length)[:3]
+
+
+def fisher_scores(r, length):
+    """Fisher z-score atanh(r) sqrt(length - 3) of coefficients over length values (finite for r = 1)."""
+    return np.arctanh(np.minimum(r, np.nextafter(1.0, 0.0))) * np.sqrt(max(length - 3, 0))
+
+
+def ranked_candidates(entries, exits, entry_groups=None, exit_groups=None, alpha=SIGNIFICANCE_LEVEL,
+                      memory_budget=MEMORY_BUDGET, blocks=None, candidates=1, min_length=MIN_SEQUENCE):
+    """
+    Each entry's top candidate pairs, as best_matches scores them.
+
+    With candidates == 1 pairs are ranked by coefficient, which gives the
+    candidates of best_matches; with more, by Fisher z-score.
+
+    Args:
+        (entries .. blocks as best_matches)
+        candidates: Pairs kept per entry, highest rank (then lowest exit)
+            first; pairs tied with the best are always kept
+        min_length: Shortest truncation length scored (at least
+            MIN_SEQUENCE)
+
+    Returns:
+        tuple: (entry, exit, correlation, rank score) arrays sorted by
+            entry and exit
+    """
+    entry_lengths = entries[1]
+    if blocks is None:
+        blocks = [(np.arange(len(entry_lengths)), np.arange(len(exits[1])), None)]
+    found = ([], [], [], [])
+    for rows, cols, mask in blocks:
+        _score_block(entries, exits, rows, cols, mask, entry_groups, exit_groups, alpha, memory_budget, found,
+                     candidates, max(min_length, MIN_SEQUENCE))
+    return _near_best(*found, len(entry_lengths), candidates)
+
+
+def _score_block(entries, exits, rows, cols, mask, entry_groups, exit_groups, alpha, memory_budget, found,
+                 candidates=1, min_length=MIN_SEQUENCE):
+    """Append the top candidate pairs of entries rows x exits cols to found."""
+    entry_matrix, entry_lengths = entries
+    exit_matrix, exit_lengths = exits
+    row_lengths = entry_lengths[rows]
+    col_lengths = exit_lengths[cols]
+    lengths = np.union1d(row_lengths, col_lengths)
+    for length in lengths[lengths >= min_length]:
+        # Pairs truncated to this length: one side has exactly it, the
+        # other at least it (the longer side strictly, to count each once)
+        groups = (
+            (np.flatnonzero(row_lengths == length), np.flatnonzero(col_lengths >= length)),
+            (np.flatnonzero(row_lengths > length), np.flatnonzero(col_lengths == length)),
+        )
+        for row_sel, col_sel in groups:
+            if len(row_sel) == 0 or len(col_sel) == 0:
+                continue
+            group_cols = cols[col_sel]
+            exit_z = standardize(exit_matrix[group_cols, :length])
+            step = _block_rows(len(col_sel), memory_budget)
+            for start in range(0, len(row_sel), step):
+                sub = row_sel[start:start + step]
+                block = rows[sub]
+                r = np.clip(standardize(entry_matrix[block, :length]) @ exit_z.T, -1.0, 1.0)
+                with np.errstate(invalid='ignore'):
+                    valid = (r > 0) & significant(r, length, alpha)
+                if entry_groups is not None and exit_groups is not None:
+                    valid &= entry_groups[block][:, None] != exit_groups[group_cols][None, :]
+                if mask is not None:
+                    valid &= mask[np.ix_(sub, col_sel)]
+                r = np.where(valid, r, -np.inf)
+                score = r if candidates == 1 else np.where(valid, fisher_scores(np.maximum(r, 0), length), -np.inf)
+                near = valid & (score >= score.max(axis=1, keepdims=True) - TIE_TOLERANCE)
+                if candidates > 1 and r.shape[1] > candidates:
+                    # The block's top candidates (and ties with the last); trimmed in _near_best
+                    kth = np.partition(score, -candidates, axis=1)[:, -candidates:-candidates + 1]
+                    near |= valid & (score >= kth)
+                elif candidates > 1:
+                    near = valid
+                i, j = np.nonzero(near)
+                found[0].append(block[i])
+                found[1].append(group_cols[j])
+                found[2].append(r[i, j])
+                found[3].append(score[i, j])
+
+
+def _near_best(found_rows, found_cols, found_values, found_scores, n_entries, candidates=1):
+    """Each entry's best score, the pairs within TIE_TOLERANCE of it and its top candidates."""
+    if not found_rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0), np.zeros(0)
+    rows = np.concatenate(found_rows)
+    cols = np.concatenate(found_cols)
+    values = np.concatenate(found_values)
+    scores = np.concatenate(found_scores)
+    best = np.full(n_entries, -np.inf)
+    np.maximum.at(best, rows, scores)
+    keep = scores >= best[rows] - TIE_TOLERANCE
+    if candidates > 1:
+        order = np.lexsort((cols, -scores, rows))
+        rank = np.empty(len(rows), dtype=np.int64)
+        rank[order] = np.arange(len(rows)) - np.searchsorted(rows[order], rows[order], side='left')
+        keep |= rank < candidates
+    rows, cols, values, scores = rows[keep], cols[keep], values[keep], scores[keep]
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], values[order], scores[order]
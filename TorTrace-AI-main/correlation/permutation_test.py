@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Permutation Significance
+
+Empirical significance of Pearson coefficients for the candidate pairs
+of a correlation run. The parametric p-value assumes normally
+distributed values, which inter-packet times (heavy-tailed, bursty) are
+not; a permutation test only assumes that, without a real link, any
+ordering of the exit sequence is as likely as the observed one.
+
+For each pair the exit sequence is shuffled many times and the shuffled
+coefficients form the null distribution: the two-sided p-value is
+(1 + shuffles at least as extreme as |r|) / (1 + shuffles). Pairs are
+grouped by truncation length L, both sides standardized once as in
+pearson_matrix, and every shuffled coefficient of a block of pairs comes
+from one batched product (pairs x shuffles x L), so thousands of
+permutations for thousands of pairs are a few matrix operations.
+
+The shuffles of length L are drawn from a generator seeded with (seed,
+L), so a pair's p-value depends only on its sequences, the seed and the
+number of permutations, not on which other pairs were tested with it.
+The work of a run (permutations x total length of the pairs) is capped
+by a budget: the number of permutations is lowered to fit, and if it
+can no longer resolve a p-value below alpha the pairs keep their
+parametric p-value.
+
+A sequence of L values has only L! orderings, so with fewer than
+1 / alpha of them (L <= 3 at alpha 0.05) even a perfect coefficient
+cannot be significant: such pairs are not worth testing
+(min_permutation_length).
+"""
+
+import logging
+import math
+
+import numpy as np
+
+from pearson_matrix import standardize, pearson_pvalues, MIN_SEQUENCE, MEMORY_BUDGET, SIGNIFICANCE_LEVEL
+
+logger = logging.getLogger(__name__)
+
+PERMUTATIONS = 999  # Shuffles per pair (p-values resolve to 1/1000)
+PERMUTATION_SEED = 0  # Seed of the shuffles
+PERMUTATION_BUDGET = 2 * 10 ** 9  # Multiply-adds (shuffles x sequence length) per run
+PERMUTATION_CANDIDATES = 8  # Best pairs per entry tested
+SIGNIFICANCE_MODES = ('parametric', 'permutation')
+
+
+def min_permutation_length(alpha=SIGNIFICANCE_LEVEL):
+    """Shortest sequence length whose permutation p-value can fall below alpha."""
+    length = MIN_SEQUENCE
+    while math.factorial(length) * alpha <= 1:
+        length += 1
+    return length
+
+
+def budget_permutations(lengths, permutations=PERMUTATIONS, budget=PERMUTATION_BUDGET):
+    """Permutations affordable for pairs of these lengths within budget."""
+    work = int(np.sum(lengths))
+    if work == 0:
+        return permutations
+    return int(min(permutations, budget // work))
+
+
+def permutation_pvalues(entries, exits, rows, cols, permutations=PERMUTATIONS, seed=PERMUTATION_SEED,
+                        budget=PERMUTATION_BUDGET, alpha=SIGNIFICANCE_LEVEL, memory_budget=MEMORY_BUDGET):
+    """
+    Two-sided permutation p-values of entry x exit pairs.
+
+    Pairs are scored like the per-pair function (both sequences truncated
+    to the shorter length); pairs shorter than MIN_SEQUENCE or with an
+    undefined coefficient get p-value 1.
+
+    Args:
+        entries: (matrix, lengths) from pack_sequences
+        exits: (matrix, lengths) from pack_sequences
+        rows: Entry index of each pair
+        cols: Exit index of each pair
+        permutations: Shuffles per pair
+        seed: Seed of the shuffles
+        budget: Largest permutations x total pair length of the run
+        alpha: Significance level the p-values will be compared with; if
+            the budget leaves too few permutations to go below it, the
+            parametric p-values are returned instead
+        memory_budget: Approximate bytes of shuffled sequences per block
+
+    Returns:
+        tuple: (float64 p-value per pair, permutations used, 0 if the
+            parametric p-values were returned)
+    """
+    entry_matrix, entry_lengths = entries
+    exit_matrix, exit_lengths = exits
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    lengths = np.minimum(entry_lengths[rows], exit_lengths[cols])
+    pvalues = np.ones(len(rows))
+    scored = lengths >= MIN_SEQUENCE
+    used = budget_permutations(lengths[scored], permutations, budget)
+    if used < permutations:
+        logger.warning(f"Permutation budget allows {used} of {permutations} permutations "
+                       f"for {int(scored.sum())} pairs")
+    parametric = (used + 1) * alpha <= 1
+    if parametric:
+        logger.warning(f"{used} permutations cannot resolve p < {alpha}; using parametric p-values")
+        used = 0
+
+    for length in np.unique(lengths[scored]).tolist():
+        group = np.flatnonzero(lengths == length)
+        entry_z = standardize(entry_matrix[rows[group], :length])
+        exit_z = standardize(exit_matrix[cols[group], :length])
+        with np.errstate(invalid='ignore'):
+            r = np.clip(np.einsum('ij,ij->i', entry_z, exit_z), -1.0, 1.0)
+        defined = ~np.isnan(r)
+        if parametric:
+            pvalues[group[defined]] = pearson_pvalues(r[defined], length)
+            continue
+        rng = np.random.default_rng([seed, length])
+        shuffles = rng.permuted(np.tile(np.arange(length), (used, 1)), axis=1)
+        extreme = np.zeros(len(group), dtype=np.int64)
+        step = max(1, memory_budget // (used * length * 8 * 2))
+        for start in range(0, len(group), step):
+            block = slice(start, start + step)
+            # (pairs, shuffles, L) shuffled exits times (pairs, L, 1) entries
+            null = np.matmul(exit_z[block][:, shuffles], entry_z[block][:, :, None])[:, :, 0]
+            extreme[block] = (np.abs(null) >= np.abs(r[block])[:, None] - 1e-12).sum(axis=1)
+        pvalues[group[defined]] = (1 + extreme[defined]) / (1 + used)
+    return pvalues, used
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Flow Sketch Index
+
+Approximate nearest-neighbour retrieval of exit flows for correlation at
+scale. Each flow is sketched from the values the exact method correlates:
+its binned traffic series (lag_correlation.binned_series) for 'xcorr',
+the prefix of its inter-packet times (ipt_prefixes) for 'pearson'. The
+vector is centered, scaled to unit norm and reduced to a SimHash sketch:
+the signs of its projections on random hyperplanes, packed into bytes.
+The fraction of differing bits between two sketches estimates the angle
+between the vectors, i.e. their correlation.
+
+The sketch bits are split into bands of bits_per_table bits, and each
+band keys one hash table (exit flows sorted by key; an entry's bucket is
+found with two binary searches). A query collects the exits sharing at
+least one band key with the entry, ranks them by Hamming distance over
+the whole sketch and keeps the top k. Only those pairs are then scored
+exactly, so the cost per entry follows the size of its hash buckets
+rather than the number of exit flows.
+
+Two series with correlation r collide in a band with probability
+(1 - arccos(r) / pi) ** bits_per_table; more tables raise recall, more
+bits per table make buckets smaller. With the defaults (32 tables of 12
+bits) a random pair collides with probability about 0.8%, while pairs
+correlated at 0.8 and 0.9 are found about 88% and 99.6% of the time.
+Pearson matches are reported from a coefficient of 0.6, so inter-packet
+time prefixes use 8-bit keys: pairs at 0.6 are found about 87% of the
+time, for buckets holding about 12% of the exits.
+"""
+
+import numpy as np
+
+from lag_correlation import normalize
+from pearson_matrix import MIN_SEQUENCE
+
+SKETCH_TABLES = 32  # Hash tables (bands of the sketch)
+SKETCH_BITS_PER_TABLE = 12  # Sketch bits per hash table key
+SKETCH_TOP_K = 16  # Exits re-scored exactly per entry
+SKETCH_SEED = 20240601  # Seed of the random hyperplanes
+BLOCK_SIZE = 8  # Entries per block of re-scored pairs (blocks are scored densely)
+SKETCH_PREFIX = 100  # Inter-packet times sketched per flow for 'pearson' (the default sequence length)
+SKETCH_IPT_BITS_PER_TABLE = 8  # Bits per table key for 'pearson', whose threshold is lower
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def ipt_prefixes(patterns, length=SKETCH_PREFIX):
+    """
+    First inter-packet times of each pattern, as vectors to sketch.
+
+    Shorter sequences are padded with their own mean, which centering
+    turns into zeros, so the vectors of two flows compare over the
+    values they both have. Sequences shorter than MIN_SEQUENCE are left
+    flat and never retrieved.
+
+    Returns:
+        np.ndarray: (n, length) float64 prefixes
+    """
+    prefixes = np.zeros((len(patterns), length))
+    for i, pattern in enumerate(patterns):
+        values = np.asarray(pattern.get('inter_packet_times', []), dtype=np.float64)[:length]
+        if len(values) >= MIN_SEQUENCE:
+            prefixes[i] = values.mean()
+            prefixes[i, :len(values)] = values
+    return prefixes
+
+
+class SketchIndex:
+    """
+    SimHash LSH index over exit traffic series (or inter-packet time prefixes).
+
+    Usage:
+        index = SketchIndex(exit_series)
+        for rows, cols, mask in index.blocks(entry_series, k=16):
+            ...  # score entries rows against exits cols where mask is set
+        index.scored_pairs  # pairs yielded so far
+    """
+
+    def __init__(self, series, tables=SKETCH_TABLES, bits_per_table=SKETCH_BITS_PER_TABLE,
+                 seed=SKETCH_SEED):
+        """
+        Args:
+            series: (X, n_bins) exit traffic series
+            tables: Hash tables
+            bits_per_table: Bits per table key (at most 62)
+            seed: Seed of the random hyperplanes (entries and exits must
+                be sketched with the same one)
+        """
+        if not 1 <= bits_per_table <= 62:
+            raise ValueError("bits_per_table must be between 1 and 62")
+        self.tables = tables
+        self.bits_per_table = bits_per_table
+        self.scored_pairs = 0
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((series.shape[1], tables * bits_per_table))
+        self.sketches, self.keys = self.sketch(series)
+        self.valid = ~np.isnan(normalize(series)).any(axis=1)
+        # Per table: valid exits sorted by key, and their keys
+        self.members = []
+        self.sorted_keys = []
+        valid_exits = np.flatnonzero(self.valid)
+        for table in range(tables):
+            order = valid_exits[np.argsort(self.keys[valid_exits, table], kind='stable')]
+            self.members.append(order)
+            self.sorted_keys.append(self.keys[order, table])
+
+    def sketch(self, series):
+        """
+        SimHash sketches and per-table keys of traffic series.
+
+        Returns:
+            tuple: ((n, bytes) uint8 packed sketch bits, (n, tables) int64
+                table keys)
+        """
+        bits = np.nan_to_num(normalize(series)) @ self.planes > 0
+        banded = bits.reshape(len(series), self.tables, self.bits_per_table)
+        keys = (banded * (np.int64(1) << np.arange(self.bits_per_table, dtype=np.int64))).sum(axis=2)
+        return np.packbits(bits, axis=1), keys
+
+    def query(self, series, k=SKETCH_TOP_K, plausible=None, exclude=None):
+        """
+        Top-k exits by sketch similarity for each entry series.
+
+        Args:
+            series: (E, n_bins) entry traffic series
+            k: Exits kept per entry
+            plausible: Optional filter(rows, cols) -> bool applied to the
+                colliding pairs before ranking
+            exclude: Optional filter(rows, cols) -> bool of pairs never
+                returned (e.g. the same flow)
+
+        Returns:
+            tuple: (entry indices, exit indices) int64 arrays, sorted by
+                entry and then exit
+        """
+        sketches, keys = self.sketch(series)
+        valid = ~np.isnan(normalize(series)).any(axis=1)
+        rows, cols = [], []
+        for table in range(self.tables):
+            # Run of exits with the same key as each valid entry
+            starts = np.searchsorted(self.sorted_keys[table], keys[:, table], side='left')
+            counts = np.searchsorted(self.sorted_keys[table], keys[:, table], side='right') - starts
+            counts[~valid] = 0
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            positions = np.arange(total) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+            rows.append(np.repeat(np.arange(len(series)), counts))
+            cols.append(self.members[table][positions])
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        n_exits = len(self.sketches)
+        pair_ids = np.unique(np.concatenate(rows) * n_exits + np.concatenate(cols))
+        rows, cols = pair_ids // n_exits, pair_ids % n_exits
+        keep = np.ones(len(rows), dtype=bool)
+        if plausible is not None:
+            keep &= plausible(rows, cols)
+        if exclude is not None:
+            keep &= ~exclude(rows, cols)
+        rows, cols = rows[keep], cols[keep]
+        # Rank each entry's candidates by Hamming distance, closest first
+        distance = _POPCOUNT[sketches[rows] ^ self.sketches[cols]].sum(axis=1, dtype=np.int64)
+        order = np.lexsort((cols, distance, rows))
+        rows, cols = rows[order], cols[order]
+        first = np.searchsorted(rows, rows, side='left')
+        top = np.arange(len(rows)) - first < k
+        rows, cols = rows[top], cols[top]
+        order = np.lexsort((cols, rows))
+        return rows[order], cols[order]
+
+    def blocks(self, series, k=SKETCH_TOP_K, plausible=None, exclude=None, block_size=BLOCK_SIZE):
+        """
+        query() results as (entry indices, sorted exit indices, mask) blocks
+        for the exact scorers. Every entry is in at most one block, and
+        scored_pairs is increased by the pairs of each block.
+        """
+        rows, cols = self.query(series, k, plausible, exclude)
+        entries = np.unique(rows)
+        for first in range(0, len(entries), block_size):
+            block = entries[first:first + block_size]
+            lo = np.searchsorted(rows, block[0], side='left')
+            hi = np.searchsorted(rows, block[-1], side='right')
+            block_cols, col_index = np.unique(cols[lo:hi], return_inverse=True)
+            mask = np.zeros((len(block), len(block_cols)), dtype=bool)
+            mask[np.searchsorted(block, rows[lo:hi]), col_index] = True
+            self.scored_pairs += int(hi - lo)
+            yield block, block_cols, mask
@@ -13,6 +13,21 @@ from datetime import datetime
 import sqlite3
 import logging
 import argparse
+import os
+import sys
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from flow_columns import load_timing_patterns, PATTERN_SEQUENCE_LENGTH
+from pattern_store import PatternStore, STORE_PATH
+from pearson_matrix import pack_sequences, best_matches, MEMORY_BUDGET, SIGNIFICANCE_LEVEL
+from lag_correlation import (binned_series, series_bins, best_lag_matches,
+                             BIN_WIDTH, MAX_BINS, MAX_LAG, MIN_PACKETS, SERIES_KINDS)
+from candidate_index import CandidateIndex, NewPairBlocks, TIME_SLACK, VOLUME_RATIO
+from sketch_index import SketchIndex, ipt_prefixes, SKETCH_TOP_K, SKETCH_IPT_BITS_PER_TABLE
+from parallel_correlation import parallel_best_matches, parallel_best_lag_matches
+from permutation_test import (permutation_pvalues, min_permutation_length, PERMUTATIONS, PERMUTATION_SEED,
+                              PERMUTATION_BUDGET, PERMUTATION_CANDIDATES, SIGNIFICANCE_MODES)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,6 +35,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Report name of each correlation method
+CORRELATION_METHODS = {
+    'pearson': 'Statistical Timing Correlation',
+    'xcorr': 'Lagged Cross-Correlation',
+}
+
 class TimingCorrelator:
     """
     Traffic timing correlation analyzer.
@@ -37,22 +58,23 @@ class TimingCorrelator:
             db_path: Path to Tor relay database
         """
         self.db_path = db_path
+        self.pair_stats = None  # Pairs scored by the last correlation run
         logger.info("Timing Correlator initialized")
     
-    def load_traffic_patterns(self, json_file):
+    def load_traffic_patterns(self, json_file, sequence_length=PATTERN_SEQUENCE_LENGTH):
         """
-        Load analyzed traffic patterns from JSON file.
+        Load analyzed traffic patterns from JSON file or columnar dataset.
 
         Args:
-            json_file: Path to traffic analysis JSON file
+            json_file: Path to traffic analysis JSON file, or a columnar
+                flow dataset directory
+            sequence_length: Inter-packet times kept per pattern (None for
+                all that are stored)
 
         Returns:
             list: Traffic pattern dictionaries
         """
-        with open(json_file, 'r') as f:
-            data = json.load(f)
-        
-        patterns = data['timing_patterns']
+        patterns = load_timing_patterns(json_file, sequence_length)
         logger.info(f"Loaded {len(patterns)} traffic patterns")
         return patterns
     
@@ -84,22 +106,51 @@ class TimingCorrelator:
         except:
             return 0.0, 1.0
     
-    def find_guard_node_candidates(self, patterns, correlation_threshold=0.6):
+    def find_guard_node_candidates(self, patterns, correlation_threshold=0.6, memory_budget=MEMORY_BUDGET,
+                                   method='pearson', bin_width=BIN_WIDTH, max_lag=MAX_LAG, series='count',
+                                   prune=True, time_slack=TIME_SLACK, volume_ratio=VOLUME_RATIO,
+                                   sketch=False, top_k=SKETCH_TOP_K, workers=1, significance='parametric',
+                                   permutations=PERMUTATIONS, seed=PERMUTATION_SEED,
+                                   permutation_budget=PERMUTATION_BUDGET):
         """
         Identify probable guard nodes through timing correlation.
 
         Args:
             patterns: List of traffic patterns
             correlation_threshold: Minimum correlation coefficient
+            memory_budget: Approximate bytes of temporaries per block of
+                the correlation matrix
+            method: 'pearson' (inter-packet times at zero lag) or 'xcorr'
+                (lagged cross-correlation of binned traffic series)
+            bin_width: Seconds per bin ('xcorr')
+            max_lag: Seconds of exit delay searched each way ('xcorr')
+            series: 'count' or 'bytes' per bin ('xcorr')
+            prune: Only score pairs that overlap in time and have similar
+                duration and volume (see CandidateIndex); the counts are
+                left in self.pair_stats
+            time_slack: Seconds of clock skew tolerated when pruning
+            volume_ratio: Largest byte-count ratio of a pair kept when pruning
+            sketch: Only score each entry's top_k exits by SimHash sketch
+                similarity (see SketchIndex) of what the method correlates:
+                inter-packet time prefixes ('pearson') or binned traffic
+                series ('xcorr'); approximate, but sublinear in the number
+                of exits
+            top_k: Exits scored per entry with sketch
+            workers: Processes scoring tiles of pairs in parallel (see
+                parallel_correlation); 1 scores in this process
+            significance: 'parametric' (Pearson p-value) or 'permutation'
+                (empirical p-value of each entry's top candidate pairs, see
+                permutation_test; 'pearson' only)
+            permutations: Shuffles per pair ('permutation')
+            seed: Seed of the shuffles ('permutation')
+            permutation_budget: Largest permutations x total sequence
+                length tested per run ('permutation')
 
         Returns:
             dict: Guard node candidates with confidence scores
         """
         logger.info(f"Analyzing {len(patterns)} traffic patterns")
         
-        guard_candidates = {}
-        correlations_found = 0
-        
         # Separate patterns by relay type
         entry_patterns = [p for p in patterns if not p.get('is_exit', False)]
         exit_patterns = [p for p in patterns if p.get('is_exit', False)]
@@ -110,21 +161,115 @@ class TimingCorrelator:
             exit_patterns = patterns
             entry_patterns = patterns
         
-        # Correlate entry with exit patterns
-        for entry in entry_patterns:
-            best_correlation = 0
-            best_match = None
-            
-            for exit_p in exit_patterns:
-                if entry['flow_id'] == exit_p['flow_id']:
-                    continue
-                
-                corr, p_val = self.correlate_timing(entry, exit_p)
-                
-                if corr > best_correlation and p_val < 0.05:
-                    best_correlation = corr
-                    best_match = exit_p
-            
+        matches = self.find_matches(entry_patterns, exit_patterns, memory_budget, method, bin_width, max_lag,
+                                    series, prune, time_slack, volume_ratio, sketch, top_k, workers,
+                                    significance=significance, permutations=permutations, seed=seed,
+                                    permutation_budget=permutation_budget)
+        return self.rank_guard_candidates(matches, correlation_threshold)
+    
+    def find_matches(self, entry_patterns, exit_patterns, memory_budget=MEMORY_BUDGET, method='pearson',
+                     bin_width=BIN_WIDTH, max_lag=MAX_LAG, series='count', prune=True, time_slack=TIME_SLACK,
+                     volume_ratio=VOLUME_RATIO, sketch=False, top_k=SKETCH_TOP_K, workers=1,
+                     significance='parametric', permutations=PERMUTATIONS, seed=PERMUTATION_SEED,
+                     permutation_budget=PERMUTATION_BUDGET, n_bins=None, new_entries=None, new_exits=None):
+        """
+        Best exit match of each entry pattern.
+
+        Args:
+            entry_patterns: Entry traffic patterns
+            exit_patterns: Exit traffic patterns
+            (memory_budget .. permutation_budget as find_guard_node_candidates)
+            n_bins: Bins per traffic series ('xcorr'); default
+                enough for the longest of these patterns, up to MAX_BINS
+            new_entries: Optional bool per entry pattern; with new_exits,
+                only pairs with at least one new pattern are scored (see
+                correlate_store)
+            new_exits: Optional bool per exit pattern
+
+        Returns:
+            list: (entry, exit, correlation, details) of each entry with a
+                positive best correlation among the pairs scored
+        """
+        if significance not in SIGNIFICANCE_MODES:
+            raise ValueError(f"Unknown significance mode: {significance}")
+        if significance == 'permutation' and method != 'pearson':
+            raise ValueError("Permutation significance is only available for the pearson method")
+        
+        # Pairs of the same flow are never matched
+        flow_labels = {}
+        entry_groups = np.array([flow_labels.setdefault(p['flow_id'], len(flow_labels)) for p in entry_patterns])
+        exit_groups = np.array([flow_labels.setdefault(p['flow_id'], len(flow_labels)) for p in exit_patterns])
+        incremental = new_entries is not None and new_exits is not None
+        if n_bins is None and method == 'xcorr':
+            n_bins = series_bins(entry_patterns + exit_patterns, bin_width)
+        
+        index = None
+        blocks = None
+        if prune:
+            index = CandidateIndex(exit_patterns, time_slack=time_slack, volume_ratio=volume_ratio)
+            blocks = index.blocks(entry_patterns)
+        if sketch:
+            plausible = index.pair_filter(entry_patterns) if index else None
+            if incremental:
+                plausible = self._new_pair_filter(plausible, new_entries, new_exits)
+            if method == 'pearson':
+                index = SketchIndex(ipt_prefixes(exit_patterns), bits_per_table=SKETCH_IPT_BITS_PER_TABLE)
+                entry_vectors = ipt_prefixes(entry_patterns)
+            else:
+                index = SketchIndex(binned_series(exit_patterns, n_bins, bin_width, series)[0])
+                entry_vectors = binned_series(entry_patterns, n_bins, bin_width, series)[0]
+            blocks = index.blocks(entry_vectors, top_k, plausible,
+                                  lambda rows, cols: entry_groups[rows] == exit_groups[cols])
+        if incremental:
+            if blocks is None:
+                blocks = [(np.arange(len(entry_patterns)), np.arange(len(exit_patterns)), None)]
+            index = blocks = NewPairBlocks(blocks, new_entries, new_exits)
+        
+        if method == 'pearson':
+            permutation = (dict(permutations=permutations, seed=seed, budget=permutation_budget)
+                           if significance == 'permutation' else None)
+            matches = self._pearson_matches(entry_patterns, exit_patterns, entry_groups, exit_groups,
+                                            memory_budget, blocks, workers, permutation)
+        elif method == 'xcorr':
+            matches = self._lag_matches(entry_patterns, exit_patterns, entry_groups, exit_groups,
+                                        memory_budget, n_bins, bin_width, max_lag, series, blocks, workers)
+        else:
+            raise ValueError(f"Unknown correlation method: {method}")
+        
+        total_pairs = len(entry_patterns) * len(exit_patterns)
+        scored_pairs = total_pairs if index is None else index.scored_pairs
+        self.pair_stats = {
+            'total_pairs': total_pairs,
+            'scored_pairs': scored_pairs,
+            'prune_ratio': round(1 - scored_pairs / total_pairs, 6) if total_pairs else 0.0,
+        }
+        logger.info(f"Scored {scored_pairs} of {total_pairs} pairs "
+                    f"(prune ratio {self.pair_stats['prune_ratio']:.2%})")
+        return matches
+    
+    @staticmethod
+    def _new_pair_filter(plausible, new_entries, new_exits):
+        """plausible(rows, cols) further limited to pairs with a new pattern."""
+        def new_pair(rows, cols):
+            keep = new_entries[rows] | new_exits[cols]
+            return keep if plausible is None else keep & plausible(rows, cols)
+        return new_pair
+    
+    def rank_guard_candidates(self, matches, correlation_threshold=0.6):
+        """
+        Group matches above the threshold by guard relay and score them.
+
+        Args:
+            matches: (entry, exit, correlation, details) tuples
+            correlation_threshold: Minimum correlation coefficient
+
+        Returns:
+            dict: Guard node candidates with confidence scores, highest first
+        """
+        guard_candidates = {}
+        correlations_found = 0
+        
+        for entry, best_match, best_correlation, details in matches:
             if best_correlation > correlation_threshold and best_match:
                 guard_relay = entry.get('tor_relay', 'unknown')
                 
@@ -140,7 +285,9 @@ class TimingCorrelator:
                 guard_candidates[guard_relay]['matches'].append({
                     'correlation': best_correlation,
                     'exit_relay': best_match.get('tor_relay', 'unknown'),
-                    'flow': entry['flow_id']
+                    'flow': entry['flow_id'],
+                    'exit_flow': best_match['flow_id'],
+                    **details
                 })
                 correlations_found += 1
         
@@ -163,21 +310,183 @@ class TimingCorrelator:
         
         return dict(sorted_candidates)
     
-    def generate_attribution_report(self, guard_candidates, output_file):
+    def correlate_store(self, store, correlation_threshold=0.6, sequence_length=PATTERN_SEQUENCE_LENGTH,
+                        method='pearson', time_slack=TIME_SLACK, **options):
+        """
+        Incrementally correlate the patterns of a PatternStore.
+
+        Patterns added since the last run with this method are correlated
+        against the stored patterns of the overlapping time window (their
+        span plus time_slack); pairs of two previously correlated patterns
+        are not scored again. Each entry's best match is merged into the
+        store, and the guard candidates are ranked over all stored matches,
+        so they cover every capture written to the store.
+
+        The stored matches only stay comparable while the method's
+        options (bin width, sequence length, ...) are unchanged; traffic
+        series always have MAX_BINS bins, so that their scores do not
+        depend on the window.
+
+        Args:
+            store: PatternStore
+            correlation_threshold: Minimum correlation coefficient
+            sequence_length: Inter-packet times kept per pattern
+            method: Correlation method
+            time_slack: Seconds of clock skew tolerated
+            options: Other find_matches options except n_bins
+
+        Returns:
+            dict: Guard node candidates with confidence scores
+        """
+        since = store.watermark(method)
+        last_id = store.last_id()
+        new_patterns = store.patterns(since=since, sequence_length=sequence_length)
+        self.pair_stats = {'total_pairs': 0, 'scored_pairs': 0, 'prune_ratio': 0.0}
+        logger.info(f"{len(new_patterns)} new patterns since the last {method} run")
+        
+        if new_patterns:
+            window = store.patterns(start=min(p['start_time'] for p in new_patterns) - time_slack,
+                                    end=max(p['end_time'] for p in new_patterns) + time_slack,
+                                    sequence_length=sequence_length)
+            entry_patterns = [p for p in window if not p.get('is_exit', False)]
+            exit_patterns = [p for p in window if p.get('is_exit', False)]
+            if not exit_patterns:
+                exit_patterns = entry_patterns = window
+            logger.info(f"Window of {len(window)} stored patterns: {len(entry_patterns)} entry, "
+                        f"{len(exit_patterns)} exit")
+            matches = self.find_matches(
+                entry_patterns, exit_patterns, method=method, time_slack=time_slack, n_bins=MAX_BINS,
+                new_entries=np.array([p['pattern_id'] > since for p in entry_patterns], dtype=bool),
+                new_exits=np.array([p['pattern_id'] > since for p in exit_patterns], dtype=bool), **options)
+            updated = store.update_matches(method, matches)
+            logger.info(f"Updated the best match of {updated} entry patterns")
+        store.set_watermark(method, last_id)
+        
+        return self.rank_guard_candidates(store.matches(method), correlation_threshold)
+    
+    def _pearson_matches(self, entry_patterns, exit_patterns, entry_groups, exit_groups, memory_budget,
+                         blocks=None, workers=1, permutation=None):
+        """
+        Best zero-lag Pearson match of each entry.
+
+        The entry x exit correlation matrix is computed in blocks with
+        pearson_matrix.best_matches; each entry's best pair (and any pair
+        tied with it) is then re-scored with correlate_timing, so the
+        matches are the ones a pairwise scan would pick.
+
+        With permutation (permutation_pvalues options), the parametric
+        test is replaced: each entry's PERMUTATION_CANDIDATES highest
+        positive pairs (long enough to be significant) are all tested at
+        once, and the entry's best pair with a permutation p-value below
+        SIGNIFICANCE_LEVEL is kept.
+
+        Returns:
+            list: (entry, exit, correlation, {}) per entry with a
+                significant positive correlation ({'p_value': p} with
+                permutation)
+        """
+        entries = pack_sequences(p.get('inter_packet_times', []) for p in entry_patterns)
+        exits = pack_sequences(p.get('inter_packet_times', []) for p in exit_patterns)
+        scorer = best_matches if workers <= 1 else partial(parallel_best_matches, workers=workers)
+        if permutation is not None:
+            return self._permutation_matches(entry_patterns, exit_patterns, entries, exits, entry_groups,
+                                             exit_groups, memory_budget, blocks, scorer, permutation)
+        rows, cols, _ = scorer(entries, exits, entry_groups, exit_groups, SIGNIFICANCE_LEVEL, memory_budget, blocks)
+        candidates = {}
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            candidates.setdefault(row, []).append(col)
+        
+        matches = []
+        for row, cols in candidates.items():
+            entry = entry_patterns[row]
+            best_correlation = 0
+            best_match = None
+            
+            for col in cols:
+                exit_p = exit_patterns[col]
+                corr, p_val = self.correlate_timing(entry, exit_p)
+                
+                if corr > best_correlation and p_val < SIGNIFICANCE_LEVEL:
+                    best_correlation = corr
+                    best_match = exit_p
+            
+            if best_match:
+                matches.append((entry, best_match, best_correlation, {}))
+        return matches
+    
+    def _permutation_matches(self, entry_patterns, exit_patterns, entries, exits, entry_groups, exit_groups,
+                             memory_budget, blocks, scorer, permutation):
+        """
+        Best pair of each entry by permutation significance.
+
+        Returns:
+            list: (entry, exit, correlation, {'p_value': p}) per entry with a
+                pair whose permutation p-value is below SIGNIFICANCE_LEVEL
+        """
+        # alpha 1 keeps every positive coefficient: the permutation test is the only gate
+        rows, cols, values = scorer(entries, exits, entry_groups, exit_groups, 1.0, memory_budget, blocks,
+                                    candidates=PERMUTATION_CANDIDATES,
+                                    min_length=min_permutation_length(SIGNIFICANCE_LEVEL))
+        pvalues, used = permutation_pvalues(entries, exits, rows, cols, alpha=SIGNIFICANCE_LEVEL,
+                                            memory_budget=memory_budget, **permutation)
+        significant = pvalues < SIGNIFICANCE_LEVEL
+        logger.info(f"Permutation-tested {len(rows)} candidate pairs with {used} permutations: "
+                    f"{int(significant.sum())} significant")
+        
+        rows, cols, values, pvalues = rows[significant], cols[significant], values[significant], pvalues[significant]
+        order = np.lexsort((cols, -values, rows))
+        first = order[np.r_[True, rows[order][1:] != rows[order][:-1]]] if len(order) else order
+        
+        matches = []
+        for i in first.tolist():
+            entry, best_match = entry_patterns[rows[i]], exit_patterns[cols[i]]
+            corr, _ = self.correlate_timing(entry, best_match)
+            matches.append((entry, best_match, corr, {'p_value': round(float(pvalues[i]), 6)}))
+        return matches
+    
+    def _lag_matches(self, entry_patterns, exit_patterns, entry_groups, exit_groups, memory_budget,
+                     n_bins, bin_width, max_lag, series, blocks=None, workers=1):
+        """
+        Best lagged cross-correlation match of each entry.
+
+        Returns:
+            list: (entry, exit, score, {'lag': seconds}) per entry with a
+                positive score. Series start at each flow's first packet,
+                so the lag is the offset left after aligning those; a
+                positive lag means the exit traffic trails the entry traffic
+        """
+        entry_series, entry_packets = binned_series(entry_patterns, n_bins, bin_width, series)
+        exit_series, exit_packets = binned_series(exit_patterns, n_bins, bin_width, series)
+        logger.info(f"Cross-correlating {series} series of {n_bins} x {bin_width}s bins, "
+                    f"lags up to {max_lag}s")
+        scorer = best_lag_matches if workers <= 1 else partial(parallel_best_lag_matches, workers=workers)
+        best_exit, best_score, best_lag = scorer(
+            entry_series, exit_series, int(round(max_lag / bin_width)), entry_groups, exit_groups,
+            entry_packets >= MIN_PACKETS, exit_packets >= MIN_PACKETS, memory_budget, blocks)
+        
+        matches = []
+        for row in np.flatnonzero(best_score > 0).tolist():
+            matches.append((entry_patterns[row], exit_patterns[best_exit[row]], float(best_score[row]),
+                            {'lag': round(float(best_lag[row] * bin_width), 6)}))
+        return matches
+    
+    def generate_attribution_report(self, guard_candidates, output_file, method='pearson'):
         """
         Generate detailed attribution report.
 
         Args:
             guard_candidates: Dictionary of guard node candidates
             output_file: Output JSON file path
+            method: Correlation method the candidates were found with
 
         Returns:
             dict: Report data
         """
         report = {
             'analysis_time': datetime.now().isoformat(),
-            'analysis_method': 'Statistical Timing Correlation',
+            'analysis_method': CORRELATION_METHODS[method],
             'total_candidates': len(guard_candidates),
+            'pair_stats': self.pair_stats,
             'guard_nodes': []
         }
         
@@ -222,16 +531,61 @@ class TimingCorrelator:
             print(f"   Matches: {len(data['matches'])}")
             
             if data['matches']:
-                print(f"   Top match: {data['matches'][0]['exit_relay']} "
-                      f"(correlation: {data['matches'][0]['correlation']:.3f})")
+                top = data['matches'][0]
+                lag = f", lag: {top['lag']:+.2f}s" if 'lag' in top else ""
+                print(f"   Top match: {top['exit_relay']} "
+                      f"(correlation: {top['correlation']:.3f}{lag})")
 
 def main():
     """Main execution routine."""
     parser = argparse.ArgumentParser()
-    parser.add_argument('--input', required=True, help='Input JSON file with traffic patterns')
+    parser.add_argument('--input', help='Input JSON file (or columnar flow dataset) with traffic patterns')
     parser.add_argument('--output', required=True, help='Output JSON file for attribution report')
     parser.add_argument('--db', default='../data/tor_relays.db', help='Path to Tor relay database')
+    parser.add_argument('--sequence-length', type=int, default=PATTERN_SEQUENCE_LENGTH,
+                        help='Inter-packet times correlated per flow (0 for all stored)')
+    parser.add_argument('--memory-mb', type=int, default=MEMORY_BUDGET // (1024 * 1024),
+                        help='Memory budget in MB for each block of the correlation matrix')
+    parser.add_argument('--method', choices=sorted(CORRELATION_METHODS), default='pearson',
+                        help='pearson: inter-packet times at zero lag; '
+                             'xcorr: FFT cross-correlation of binned traffic over a lag window')
+    parser.add_argument('--bin-width', type=float, default=BIN_WIDTH,
+                        help='Seconds per traffic bin (xcorr)')
+    parser.add_argument('--max-lag', type=float, default=MAX_LAG,
+                        help='Seconds of exit delay searched in each direction (xcorr)')
+    parser.add_argument('--series', choices=SERIES_KINDS, default='count',
+                        help='Packets or bytes per bin (xcorr)')
+    parser.add_argument('--no-prune', action='store_true',
+                        help='Score every entry/exit pair instead of only those overlapping in time '
+                             'with similar duration and volume')
+    parser.add_argument('--time-slack', type=float, default=TIME_SLACK,
+                        help='Seconds of clock skew tolerated when pruning pairs')
+    parser.add_argument('--volume-ratio', type=float, default=VOLUME_RATIO,
+                        help='Largest byte-count ratio of a pair kept when pruning')
+    parser.add_argument('--sketch', action='store_true',
+                        help='Approximate search: score only the --top-k exits per entry found through '
+                             'an LSH index of SimHash sketches (of inter-packet times for pearson, '
+                             'binned traffic series for xcorr)')
+    parser.add_argument('--top-k', type=int, default=SKETCH_TOP_K,
+                        help='Exits scored exactly per entry with --sketch')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes scoring entry/exit pairs (1: single process)')
+    parser.add_argument('--significance', choices=SIGNIFICANCE_MODES, default='parametric',
+                        help='parametric: Pearson p-value; permutation: empirical p-value of each entry\'s '
+                             'best pair from shuffled exit sequences (pearson only)')
+    parser.add_argument('--permutations', type=int, default=PERMUTATIONS,
+                        help='Shuffles per pair with --significance permutation')
+    parser.add_argument('--seed', type=int, default=PERMUTATION_SEED,
+                        help='Seed of the shuffles with --significance permutation')
+    parser.add_argument('--permutation-budget', type=float, default=PERMUTATION_BUDGET,
+                        help='Largest permutations x total sequence length tested per run; '
+                             'fewer permutations are used above it')
+    parser.add_argument('--store', metavar='DB', nargs='?', const=STORE_PATH,
+                        help='Add --input (if given) to a persistent pattern store and correlate only the '
+                             f'patterns new to the store against their time window (default {STORE_PATH})')
     args = parser.parse_args()
+    if not args.input and not args.store:
+        parser.error('--input is required without --store')
 
     print("=" * 70)
     print("BIMBO: Timing Correlation Engine")
@@ -239,12 +593,29 @@ def main():
 
     correlator = TimingCorrelator(db_path=args.db)
 
-    patterns = correlator.load_traffic_patterns(args.input)
-    guard_candidates = correlator.find_guard_node_candidates(patterns)
+    options = dict(memory_budget=args.memory_mb * 1024 * 1024, method=args.method,
+                   bin_width=args.bin_width, max_lag=args.max_lag, series=args.series,
+                   prune=not args.no_prune, time_slack=args.time_slack, volume_ratio=args.volume_ratio,
+                   sketch=args.sketch, top_k=args.top_k, workers=args.workers,
+                   significance=args.significance, permutations=args.permutations, seed=args.seed,
+                   permutation_budget=int(args.permutation_budget))
+    if args.store:
+        with PatternStore(args.store) as store:
+            if args.input:
+                # Stored whole; the sequence length is applied when reading back
+                store.add_patterns(correlator.load_traffic_patterns(args.input, None), source=args.input)
+            guard_candidates = correlator.correlate_store(store, sequence_length=args.sequence_length or None,
+                                                          **options)
+    else:
+        patterns = correlator.load_traffic_patterns(args.input, args.sequence_length or None)
+        guard_candidates = correlator.find_guard_node_candidates(patterns, **options)
+    stats = correlator.pair_stats
+    print(f"\nScored {stats['scored_pairs']:,} of {stats['total_pairs']:,} entry/exit pairs "
+          f"({stats['prune_ratio']:.1%} pruned)")
     correlator.display_results(guard_candidates)
 
     if guard_candidates:
-        correlator.generate_attribution_report(guard_candidates, args.output)
+        correlator.generate_attribution_report(guard_candidates, args.output, args.method)
 
         print("\n" + "=" * 70)
         print("Correlation analysis complete")
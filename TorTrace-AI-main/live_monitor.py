@@ -1,12 +1,27 @@
 import os
+import sys
+import json
 import time
+import argparse
+import queue
+import threading
 import subprocess
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traffic_analysis'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'correlation'))
+
 PCAP_DIR = 'data/pcap_files'
 CAPTURE_INTERFACE = 'eth0'
 CAPTURE_DURATION = 60      # Capture window in seconds (e.g. 60s = 1 min)
 BATCH_SCRIPT = 'batch_analyzer.py'
+DB_PATH = 'data/tor_relays.db'
+LIVE_FLOWS_FILE = 'data/live_flows.jsonl'
+LIVE_CANDIDATES_FILE = 'data/live_candidates.jsonl'
+IDLE_TIMEOUT = 15          # Finalize a streamed flow after 15s without packets
+ACTIVE_TIMEOUT = 120       # ... or once it has been open for 2 minutes
+EXPIRE_INTERVAL = 1.0      # While no packets arrive, check for expired flows every second
 
 def capture_live_pcap():
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -25,18 +40,141 @@ def capture_live_pcap():
     print('[+] Capture complete')
     return pcap_file
 
-def run_batch_analysis():
+def run_batch_analysis(store_path=None):
     print('[+] Running batch analysis for all PCAPs...')
-    subprocess.run(['python3', BATCH_SCRIPT])
+    subprocess.run(['python3', BATCH_SCRIPT] + (['--store', store_path] if store_path else []))
     print('[+] Batch analysis complete')
 
+def stream_live_flows(idle_timeout, active_timeout, flows_file, store_path=None, correlate=False,
+                      candidates_file=LIVE_CANDIDATES_FILE):
+    """
+    Analyze tcpdump's output as it arrives, writing each finished Tor flow as
+    a JSON line (and its timing pattern to the pattern store, if given).
+
+    With correlate, entry and exit flows are also correlated online while
+    they are still open (see correlation/online_correlator.py), and each
+    guard candidate is written to candidates_file as soon as it is found.
+
+    Packets are read on a separate thread and folded in as they arrive, in
+    batches of whatever is queued. When none arrive for EXPIRE_INTERVAL
+    seconds, flows are expired against the wall clock, so a flow is still
+    written after its idle timeout on a quiet link.
+    """
+    from flow_table import FlowTable, CLASSIFY_BATCH
+    from pcap_analyzer import TorTrafficAnalyzer, FEATURE_KEYS
+    from pcap_reader import iter_packets
+    from pattern_store import PatternStore
+
+    analyzer = TorTrafficAnalyzer(db_path=DB_PATH)
+    tcpdump_cmd = ['sudo', 'tcpdump', '-i', CAPTURE_INTERFACE, '-U', '-w', '-', 'tcp']
+    print(f'[+] Streaming live traffic from {CAPTURE_INTERFACE} '
+          f'(idle timeout {idle_timeout}s, active timeout {active_timeout}s)')
+    proc = subprocess.Popen(tcpdump_cmd, stdout=subprocess.PIPE)
+    os.makedirs(os.path.dirname(flows_file) or '.', exist_ok=True)
+    store = PatternStore(store_path) if store_path else None
+    online = None
+    on_packet = None
+    if correlate:
+        from online_correlator import OnlineCorrelator
+
+        candidates_out = open(candidates_file, 'a')
+
+        def write_candidate(match):
+            candidates_out.write(json.dumps(match) + '\n')
+            candidates_out.flush()
+            print(f"[CANDIDATE] guard {match['guard_nickname']} ({match['guard_relay']}) "
+                  f"<- exit {match['exit_relay']}: correlation {match['correlation']:.3f} "
+                  f"at lag {match['lag']:g}s over {match['bins']} bins")
+
+        online = OnlineCorrelator(on_match=write_candidate)
+
+        def feed_online(flow_id, flow, timestamp, size):
+            relay = flow['tor_relay']
+            online.add_packet(flow_id, timestamp, size, relay['is_exit'], flow['tor_relay_ip'], relay['nickname'])
+
+        on_packet = feed_online
+
+    with open(flows_file, 'a') as out:
+        def write_flow(flow_id, flow):
+            if online:
+                online.end_flow(flow_id)
+            record = analyzer.extract_timing_patterns(flow)
+            if store:
+                store.add_patterns([record], source=f'live:{CAPTURE_INTERFACE}')
+            record['features'] = {key: flow[key] for key in FEATURE_KEYS}
+            out.write(json.dumps(record) + '\n')
+            out.flush()
+            print(f"[FLOW] {flow_id} via {flow['tor_relay']['nickname']}: "
+                  f"{flow['packet_count']} packets, {flow['total_bytes']} bytes")
+
+        table = FlowTable(analyzer, idle_timeout=idle_timeout, active_timeout=active_timeout,
+                          on_flow=write_flow, on_packet=on_packet)
+        packets = queue.Queue()
+        end_of_capture = object()
+
+        def read_packets():
+            try:
+                for record in iter_packets(proc.stdout):
+                    packets.put(record)
+            finally:
+                packets.put(end_of_capture)
+
+        threading.Thread(target=read_packets, daemon=True).start()
+        try:
+            while True:
+                try:
+                    batch = [packets.get(timeout=EXPIRE_INTERVAL)]
+                except queue.Empty:
+                    # Nothing is queued, so the wall clock is past every packet seen
+                    table.expire(time.time())
+                    continue
+                while len(batch) < CLASSIFY_BATCH and batch[-1] is not end_of_capture:
+                    try:
+                        batch.append(packets.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is end_of_capture:
+                    table.consume(batch[:-1])
+                    break
+                table.consume(batch)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            table.flush()
+            proc.terminate()
+            if store:
+                store.close()
+            if online:
+                candidates_out.close()
+    print(f'[+] {table.flows_emitted} Tor flows written to {flows_file}')
+    if online:
+        print(f'[+] {online.matches_emitted} guard candidates written to {candidates_file}')
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stream', action='store_true',
+                        help='Analyze packets continuously instead of capturing 60s pcap batches')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT)
+    parser.add_argument('--active-timeout', type=float, default=ACTIVE_TIMEOUT)
+    parser.add_argument('--flows-out', default=LIVE_FLOWS_FILE, help='JSON lines file for streamed flows')
+    parser.add_argument('--correlate', action='store_true',
+                        help='With --stream, correlate entry/exit flows online and report guard candidates live')
+    parser.add_argument('--candidates-out', default=LIVE_CANDIDATES_FILE,
+                        help='JSON lines file for guard candidates found with --correlate')
+    parser.add_argument('--store', metavar='DB',
+                        help='Also add streamed (or batch-analyzed) timing patterns to a persistent pattern store')
+    args = parser.parse_args()
+
     print('[MONITOR] Live traffic capture and automated analysis')
     print('Press Ctrl+C to stop.\n')
+    if args.stream:
+        stream_live_flows(args.idle_timeout, args.active_timeout, args.flows_out, args.store,
+                          args.correlate, args.candidates_out)
+        return
     os.makedirs(PCAP_DIR, exist_ok=True)
     while True:
         pcap = capture_live_pcap()
-        run_batch_analysis()
+        run_batch_analysis(args.store)
         print('[MONITOR] Sleeping for 5 seconds before next capture...\n')
         time.sleep(5)
 
@@ -8,12 +8,17 @@ using graph-based machine learning techniques.
 """
 
 import networkx as nx
-import sqlite3
 import json
 import numpy as np
 from datetime import datetime
 import logging
 import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from relay_index import load_relay_index
+from flow_columns import load_timing_patterns
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +26,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+GRAPH_RELAY_LIMIT = 500  # Relays (in database order) modelled as graph nodes
+
 
 class TorNetworkGNN:
     """
@@ -52,23 +59,15 @@ class TorNetworkGNN:
         """Build graph representation of Tor network topology."""
         logger.info("Building Tor network graph")
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT fingerprint, address, nickname, bandwidth, 
-                   is_guard, is_exit, is_fast, is_stable
-            FROM relays
-            LIMIT 500
-        ''')
-        
-        relays = cursor.fetchall()
-        conn.close()
+        relays = load_relay_index(self.db_path).records[:GRAPH_RELAY_LIMIT]
         
         self.graph = nx.DiGraph()
         
         for relay in relays:
-            fingerprint, address, nickname, bandwidth, is_guard, is_exit, is_fast, is_stable = relay
+            fingerprint, address, nickname, bandwidth, is_guard, is_exit, is_fast, is_stable = (
+                relay[field] for field in ('fingerprint', 'address', 'nickname', 'bandwidth',
+                                           'is_guard', 'is_exit', 'is_fast', 'is_stable')
+            )
             
             self.graph.add_node(address, 
                                fingerprint=fingerprint,
@@ -321,7 +320,7 @@ def calculate_confidence_score(gnn_score, timing_match=False, fingerprint_match=
 def main():
     """Main execution routine."""
     parser = argparse.ArgumentParser()
-    parser.add_argument('--input', required=True, help='Input JSON file with traffic patterns')
+    parser.add_argument('--input', required=True, help='Input JSON file (or columnar flow dataset) with traffic patterns')
     parser.add_argument('--output', required=True, help='Output JSON file for GNN report')
     parser.add_argument('--db', default='../data/tor_relays.db', help='Path to Tor relay database')
     args = parser.parse_args()
@@ -332,10 +331,7 @@ def main():
 
     gnn = TorNetworkGNN(db_path=args.db)
 
-    with open(args.input, 'r') as f:
-        data = json.load(f)
-
-    patterns = data.get('timing_patterns', [])
+    patterns = load_timing_patterns(args.input)
     logger.info(f"Loaded {len(patterns)} traffic patterns")
 
     predictions = gnn.predict_guard_nodes(patterns, top_k=10)
@@ -13,6 +13,11 @@ import numpy as np
 import json
 import logging
 import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from flow_columns import load_timing_patterns, PATTERN_SEQUENCE_LENGTH
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,6 +25,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+INFERENCE_BATCH_SIZE = 64  # Flows per forward pass
+TOP_K = 3  # Most probable websites reported per flow
+
 
 class WebsiteFingerprintCNN(nn.Module):
     """
@@ -105,14 +113,15 @@ class WebsiteFingerprinter:
     based on packet timing and size sequences.
     """
     
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, sequence_length=PATTERN_SEQUENCE_LENGTH):
         """
         Initialize fingerprinter.
         
         Args:
             model_path: Path to pre-trained model weights (optional)
+            sequence_length: Packets per model input sequence
         """
-        self.sequence_length = 100
+        self.sequence_length = sequence_length
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         logger.info(f"Using device: {self.device}")
         
@@ -142,24 +151,33 @@ class WebsiteFingerprinter:
         Returns:
             Preprocessed tensor of shape (1, 2, sequence_length)
         """
-        directions = pattern.get('directions', [])[:self.sequence_length]
-        sizes = pattern.get('packet_sizes', [])[:self.sequence_length]
-        
-        # Pad sequences to fixed length
-        while len(directions) < self.sequence_length:
-            directions.append(0)
-            sizes.append(0)
+        return self.preprocess_batch([pattern])
+    
+    def preprocess_batch(self, patterns):
+        """
+        Convert traffic patterns to one model input tensor.
         
-        # Normalize packet sizes
-        sizes = np.array(sizes, dtype=np.float32)
-        if sizes.max() > 0:
-            sizes = sizes / sizes.max()
+        Sequences are truncated or zero-padded to sequence_length and
+        packet sizes are scaled by each flow's largest packet.
         
-        directions = np.array(directions, dtype=np.float32)
+        Args:
+            patterns: Traffic pattern dictionaries
+            
+        Returns:
+            Tensor of shape (len(patterns), 2, sequence_length)
+        """
+        features = np.zeros((len(patterns), 2, self.sequence_length), dtype=np.float32)
+        for i, pattern in enumerate(patterns):
+            directions = pattern.get('directions', [])[:self.sequence_length]
+            sizes = pattern.get('packet_sizes', [])[:self.sequence_length]
+            features[i, 0, :len(directions)] = directions
+            features[i, 1, :len(sizes)] = sizes
         
-        features = np.stack([directions, sizes])
+        # Normalize packet sizes
+        largest = features[:, 1].max(axis=1, keepdims=True) if len(patterns) else 0
+        np.divide(features[:, 1], largest, out=features[:, 1], where=largest > 0)
         
-        return torch.FloatTensor(features).unsqueeze(0)
+        return torch.from_numpy(features)
     
     def predict_website(self, traffic_pattern):
         """
@@ -171,50 +189,77 @@ class WebsiteFingerprinter:
         Returns:
             tuple: (predicted_website, confidence_score)
         """
-        self.model.eval()
+        return self.predict_batch([traffic_pattern], top_k=1)[0][0]
+    
+    def predict_batch(self, patterns, batch_size=INFERENCE_BATCH_SIZE, top_k=TOP_K):
+        """
+        Predict the most probable websites of many traffic patterns.
         
-        with torch.no_grad():
-            features = self.preprocess_traffic(traffic_pattern).to(self.device)
-            
-            outputs = self.model(features)
-            probabilities = torch.softmax(outputs, dim=1)
-            
-            confidence, predicted = torch.max(probabilities, 1)
-            
-            website_id = predicted.item()
-            confidence_score = confidence.item()
-            
-            website = self.website_db.get(website_id, "Unknown")
+        All patterns are preprocessed into one tensor, which is run
+        through the model in mini-batches of batch_size flows.
+        
+        Args:
+            patterns: Traffic pattern dictionaries
+            batch_size: Flows per forward pass
+            top_k: Websites returned per pattern
             
-            return website, confidence_score
+        Returns:
+            list: Per pattern, top_k (website, probability) tuples, most
+                probable first
+        """
+        self.model.eval()
+        features = self.preprocess_batch(patterns)
+        top_k = min(top_k, self.model.fc2.out_features)
+        
+        predictions = []
+        with torch.inference_mode():
+            for start in range(0, len(patterns), batch_size):
+                batch = features[start:start + batch_size].to(self.device)
+                
+                outputs = self.model(batch)
+                probabilities = torch.softmax(outputs, dim=1)
+                
+                confidence, predicted = torch.topk(probabilities, top_k, dim=1)
+                
+                for website_ids, scores in zip(predicted.tolist(), confidence.tolist()):
+                    predictions.append([(self.website_db.get(website_id, "Unknown"), score)
+                                        for website_id, score in zip(website_ids, scores)])
+        
+        return predictions
     
-    def analyze_traffic_patterns(self, patterns_file):
+    def analyze_traffic_patterns(self, patterns_file, max_flows=None, batch_size=INFERENCE_BATCH_SIZE,
+                                 top_k=TOP_K):
         """
         Analyze traffic patterns from file.
         
         Args:
-            patterns_file: Path to traffic patterns JSON
+            patterns_file: Path to traffic patterns JSON (or columnar flow dataset)
+            max_flows: Flows analyzed (the first ones in the file); None for all
+            batch_size: Flows per forward pass
+            top_k: Most probable websites reported per flow
             
         Returns:
             list: Website identification results
         """
         logger.info("Starting deep learning website fingerprinting analysis")
         
-        with open(patterns_file, 'r') as f:
-            data = json.load(f)
-        
-        patterns = data.get('timing_patterns', [])
+        patterns = load_timing_patterns(patterns_file, self.sequence_length)
         logger.info(f"Loaded {len(patterns)} traffic patterns")
+        if max_flows is not None and len(patterns) > max_flows:
+            logger.info(f"Analyzing the first {max_flows} of {len(patterns)} flows")
+            patterns = patterns[:max_flows]
         
         results = []
         
-        for i, pattern in enumerate(patterns[:20]):
-            website, confidence = self.predict_website(pattern)
+        predictions = self.predict_batch(patterns, batch_size, top_k)
+        for i, (pattern, top) in enumerate(zip(patterns, predictions)):
+            website, confidence = top[0]
             
             results.append({
                 'flow_id': pattern.get('flow_id', f'flow_{i}'),
                 'predicted_website': website,
                 'confidence': float(confidence),
+                'top_predictions': [{'website': name, 'probability': float(score)} for name, score in top],
                 'tor_relay': pattern.get('tor_relay', 'unknown'),
                 'relay_nickname': pattern.get('relay_nickname', 'unknown')
             })
@@ -262,17 +307,25 @@ class WebsiteFingerprinter:
 def main():
     """Main execution routine."""
     parser = argparse.ArgumentParser()
-    parser.add_argument('--input', required=True, help='Input JSON file with traffic patterns')
+    parser.add_argument('--input', required=True, help='Input JSON file (or columnar flow dataset) with traffic patterns')
     parser.add_argument('--output', required=True, help='Output JSON file for fingerprint report')
+    parser.add_argument('--sequence-length', type=int, default=PATTERN_SEQUENCE_LENGTH,
+                        help='Packets per model input sequence')
+    parser.add_argument('--max-flows', type=int, default=None,
+                        help='Analyze only the first N flows (default all)')
+    parser.add_argument('--batch-size', type=int, default=INFERENCE_BATCH_SIZE,
+                        help='Flows per forward pass of the model')
+    parser.add_argument('--top-k', type=int, default=TOP_K,
+                        help='Most probable websites reported per flow')
     args = parser.parse_args()
 
     print("=" * 70)
     print("BIMBO: Deep Learning Website Fingerprinting")
     print("=" * 70)
 
-    fingerprinter = WebsiteFingerprinter()
+    fingerprinter = WebsiteFingerprinter(sequence_length=args.sequence_length)
 
-    results = fingerprinter.analyze_traffic_patterns(args.input)
+    results = fingerprinter.analyze_traffic_patterns(args.input, args.max_flows, args.batch_size, args.top_k)
 
     if results:
         fingerprinter.generate_fingerprint_report(results, args.output)
@@ -8,7 +8,6 @@ import os
 import json
 from datetime import datetime
 from pathlib import Path
-import sqlite3
 import sys
 
 # Add utils to path for GeoLocator
@@ -19,11 +18,17 @@ try:
 except ImportError:
     GeoLocator = None
 
+try:
+    from relay_index import load_relay_index
+except ImportError:
+    load_relay_index = None
+
 class PCAPAnalysisHandler:
     """Handles PCAP file uploads and analysis"""
     
-    def __init__(self, results_dir='data/batch_results'):
+    def __init__(self, results_dir='data/batch_results', relay_db='data/tor_relays.db'):
         self.results_dir = results_dir
+        self.relay_db = relay_db
         self.geo_locator = GeoLocator() if GeoLocator else None
         Path(self.results_dir).mkdir(parents=True, exist_ok=True)
     
@@ -135,23 +140,19 @@ class PCAPAnalysisHandler:
                     'reason': 'Tor typically uses TCP connections'
                 })
             
-            # Load Tor relay database for cross-reference
-            try:
-                conn = sqlite3.connect('data/tor_relays.db')
-                cursor = conn.cursor()
-                cursor.execute("SELECT address FROM relays LIMIT 100")
-                known_tor_ips = [row[0] for row in cursor.fetchall()]
-                conn.close()
-                
-                for flow in analysis['flows']:
-                    if flow['dst_ip'] in known_tor_ips or flow['src_ip'] in known_tor_ips:
+            # Cross-reference flows against the shared Tor relay index
+            relay_index = self._get_relay_index()
+            if relay_index is not None and analysis['flows']:
+                flows_checked = analysis['flows']
+                relay_hits = (relay_index.match_addresses([f['dst_ip'] for f in flows_checked]) |
+                              relay_index.match_addresses([f['src_ip'] for f in flows_checked]))
+                for flow, is_relay in zip(flows_checked, relay_hits):
+                    if is_relay:
                         analysis['potential_tor_indicators'].append({
                             'flow': f"{flow['src_ip']}:{flow['src_port']}",
                             'confidence': 0.95,
                             'reason': 'IP matches known Tor relay'
                         })
-            except:
-                pass
             
             # Save results
             output_file = os.path.join(
@@ -176,6 +177,15 @@ class PCAPAnalysisHandler:
         except Exception as e:
             return self._error_response(f"Analysis failed: {str(e)}")
     
+    def _get_relay_index(self):
+        """Shared Tor relay index, or None if the relay database is unavailable"""
+        if load_relay_index is None:
+            return None
+        try:
+            return load_relay_index(self.relay_db)
+        except Exception:
+            return None
+    
     def _error_response(self, error_msg):
         """Return error response"""
         return {
@@ -0,0 +1,138 @@
+"""
+Benchmark analysis of pcapng and compressed captures against raw pcap.
+
+Converts a classic pcap into pcapng (nanosecond timestamps) and writes
+gzip, xz and, if the zstandard package is installed, zstd copies of both
+into a temporary directory. Each variant is analyzed with the fast decoder
+(streaming decompression, no temp files), the flows are checked against
+the raw pcap and the throughput relative to raw pcap is printed. Run from
+the project root:
+
+    python3 scripts/benchmark_capture_formats.py --pcap data/pcap_files/synthetic_tor_test.pcap
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import logging
+import lzma
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'traffic_analysis'))
+
+from pcap_analyzer import TorTrafficAnalyzer
+from pcap_reader import PCAP_MAGICS, read_pcap_header
+
+
+def write_pcapng(pcap_file, pcapng_file, ts_resolution=9):
+    """
+    Rewrite a classic pcap as pcapng: one section, one interface with
+    10**-ts_resolution second timestamps, one Enhanced Packet Block per record.
+    """
+    with open(pcap_file, 'rb') as src, open(pcapng_file, 'wb') as dst:
+        byte_order, ts_units, snaplen, linktype = read_pcap_header(src)
+        units = 10 ** ts_resolution
+        dst.write(struct.pack('<III', 0x0A0D0D0A, 28, 0x1A2B3C4D) +
+                  struct.pack('<HHq', 1, 0, -1) + struct.pack('<I', 28))
+        options = struct.pack('<HHB3x', 9, 1, ts_resolution) + struct.pack('<HH', 0, 0)
+        idb_len = 20 + len(options)
+        dst.write(struct.pack('<IIHHI', 1, idb_len, linktype, 0, snaplen) + options +
+                  struct.pack('<I', idb_len))
+        record_hdr = struct.Struct(byte_order + 'IIII')
+        while True:
+            header = src.read(16)
+            if len(header) < 16:
+                break
+            sec, frac, caplen, origlen = record_hdr.unpack(header)
+            data = src.read(caplen)
+            ticks = (sec * ts_units + frac) * units // ts_units
+            pad = b'\x00' * (-caplen % 4)
+            block_len = 32 + caplen + len(pad)
+            dst.write(struct.pack('<IIIIIII', 6, block_len, 0, ticks >> 32, ticks & 0xFFFFFFFF,
+                                  caplen, origlen) + data + pad + struct.pack('<I', block_len))
+
+
+def compress(path, compression):
+    """Write path.<ext> compressed with gzip, xz or zstd; None if unavailable."""
+    if compression == 'gzip':
+        target, opener = path + '.gz', gzip.open
+    elif compression == 'xz':
+        target, opener = path + '.xz', lzma.open
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        target = path + '.zst'
+        with open(path, 'rb') as src, open(target, 'wb') as dst:
+            zstandard.ZstdCompressor().copy_stream(src, dst)
+        return target
+    with open(path, 'rb') as src, opener(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    return target
+
+
+def time_analysis(analyzer, pcap_file, repeat):
+    best = None
+    results = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = analyzer.analyze_pcap(pcap_file, decoder='fast')
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap', required=True, help='Classic pcap to convert and benchmark')
+    parser.add_argument('--db', default='data/tor_relays.db', help='Path to Tor relay database')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant (best time is kept)')
+    args = parser.parse_args()
+
+    with open(args.pcap, 'rb') as f:
+        if f.read(4) not in PCAP_MAGICS:
+            parser.error(f"{args.pcap} is not a classic pcap")
+
+    logging.disable(logging.INFO)
+    analyzer = TorTrafficAnalyzer(db_path=args.db)
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, os.path.basename(args.pcap))
+        shutil.copyfile(args.pcap, raw)
+        pcapng = os.path.splitext(raw)[0] + '.pcapng'
+        write_pcapng(raw, pcapng)
+        variants = [raw, pcapng]
+        for compression in ('gzip', 'xz', 'zstd'):
+            targets = [compress(path, compression) for path in (raw, pcapng)]
+            if None in targets:
+                print(f"Skipping {compression}: zstandard package not installed")
+            else:
+                variants.extend(targets)
+
+        print(f"{'Variant':32s} {'MB':>8s} {'Seconds':>9s} {'Pkt/s':>10s} {'vs raw':>7s}  Match")
+        print("-" * 78)
+        raw_time, raw_results = time_analysis(analyzer, raw, args.repeat)
+        mismatches = 0
+        for path in variants:
+            elapsed, results = (raw_time, raw_results) if path == raw else \
+                time_analysis(analyzer, path, args.repeat)
+            match = results is not None and all(
+                results[key] == raw_results[key] for key in ('flows', 'total_packets', 'non_tor_packets'))
+            mismatches += not match
+            packets = results['total_packets'] if results else 0
+            print(f"{os.path.basename(path)[:32]:32s} {os.path.getsize(path) / 1e6:8.1f} {elapsed:9.3f} "
+                  f"{packets / elapsed:10,.0f} {raw_time / elapsed:6.2f}x  {'yes' if match else 'NO'}")
+    if mismatches:
+        print(f"{mismatches} variant(s) produced different flows")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark batched website fingerprinting inference.
+
+Runs WebsiteFingerprinter.predict_batch on the same flows with batch
+sizes from 1 to 512, checks that every batch size predicts the same
+websites, and prints flows per second (on the CPU unless --device says
+otherwise). Flows come from a timing pattern file or are synthetic. Run
+from the project root:
+
+    python3 scripts/benchmark_fingerprinter.py --synthetic 4096
+    python3 scripts/benchmark_fingerprinter.py --input data/results/analysis_timing.json
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ml_models'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+
+from website_fingerprinter import WebsiteFingerprinter
+from flow_columns import load_timing_patterns, PATTERN_SEQUENCE_LENGTH
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+
+
+def synthetic_patterns(n_flows, sequence_length, seed=0):
+    """Flows of random direction and packet size sequences."""
+    rng = np.random.default_rng(seed)
+    patterns = []
+    for i in range(n_flows):
+        length = int(rng.integers(1, sequence_length + 1))
+        patterns.append({
+            'flow_id': f'flow_{i}',
+            'directions': rng.choice([-1, 1], length).tolist(),
+            'packet_sizes': rng.integers(40, 1500, length).tolist(),
+        })
+    return patterns
+
+
+def time_inference(fingerprinter, patterns, batch_size, repeat):
+    best = None
+    predictions = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        predictions = fingerprinter.predict_batch(patterns, batch_size=batch_size, top_k=1)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, predictions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', help='Timing pattern JSON (or columnar flow dataset) to classify')
+    parser.add_argument('--synthetic', type=int, default=2048, help='Synthetic flows when no --input is given')
+    parser.add_argument('--sequence-length', type=int, default=PATTERN_SEQUENCE_LENGTH,
+                        help='Packets per model input sequence')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES, help='Batch sizes to time')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per batch size (best time is kept)')
+    parser.add_argument('--device', default='cpu', help='Torch device to run the model on')
+    parser.add_argument('--threads', type=int, help='Torch intra-op threads (default: torch decides)')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    fingerprinter = WebsiteFingerprinter(sequence_length=args.sequence_length)
+    fingerprinter.device = torch.device(args.device)
+    fingerprinter.model.to(fingerprinter.device)
+    if args.input:
+        patterns = load_timing_patterns(args.input, args.sequence_length)
+    else:
+        patterns = synthetic_patterns(args.synthetic, args.sequence_length)
+
+    print(f"{len(patterns)} flows, sequence length {args.sequence_length}, device {args.device}, "
+          f"{torch.get_num_threads()} threads")
+    print(f"{'Batch':>6s} {'Seconds':>9s} {'Flows/s':>10s} {'Speedup':>8s}  Match")
+    print("-" * 44)
+    baseline_time = None
+    baseline = None
+    for batch_size in args.batch_sizes:
+        elapsed, predictions = time_inference(fingerprinter, patterns, batch_size, args.repeat)
+        websites = [top[0][0] for top in predictions]
+        if baseline is None:
+            baseline_time, baseline = elapsed, websites
+        match = websites == baseline
+        rate = len(patterns) / elapsed if elapsed > 0 else float('inf')
+        print(f"{batch_size:6d} {elapsed:9.3f} {rate:10.1f} {baseline_time / elapsed:7.1f}x  "
+              f"{'yes' if match else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark the struct fast-path and columnar decoders against full Scapy
+dissection.
+
+Runs TorTrafficAnalyzer.analyze_pcap with each decoder on every capture in
+a directory, checks that the flow output is identical and prints the
+speedup over Scapy. Run from the project root:
+
+    python3 scripts/benchmark_pcap_decoder.py --pcap-dir data/pcap_files
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'traffic_analysis'))
+
+from pcap_analyzer import TorTrafficAnalyzer
+
+
+def time_analysis(analyzer, pcap_file, decoder, repeat):
+    best = None
+    results = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = analyzer.analyze_pcap(pcap_file, decoder=decoder)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pcap-dir', default='data/pcap_files', help='Directory of captures to benchmark')
+    parser.add_argument('--db', default='data/tor_relays.db', help='Path to Tor relay database')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per decoder (best time is kept)')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    analyzer = TorTrafficAnalyzer(db_path=args.db)
+    pcaps = sorted(glob.glob(os.path.join(args.pcap_dir, '*.pcap')) +
+                   glob.glob(os.path.join(args.pcap_dir, '*.pcapng')))
+
+    print(f"{'Capture':40s} {'Packets':>8s} {'Scapy s':>9s} {'Fast s':>9s} {'Column s':>9s} "
+          f"{'Speedup':>8s}  Match")
+    print("-" * 94)
+    total_scapy = total_fast = total_columnar = 0.0
+    total_packets = 0
+    mismatches = 0
+    for pcap in pcaps:
+        scapy_time, scapy_results = time_analysis(analyzer, pcap, 'scapy', args.repeat)
+        fast_time, fast_results = time_analysis(analyzer, pcap, 'fast', args.repeat)
+        columnar_time, columnar_results = time_analysis(analyzer, pcap, 'columnar', args.repeat)
+        if scapy_results is None or fast_results is None or columnar_results is None:
+            print(f"{os.path.basename(pcap)[:40]:40s} (unreadable)")
+            continue
+        match = all(
+            scapy_results[key] == other[key]
+            for other in (fast_results, columnar_results)
+            for key in ('flows', 'total_packets', 'non_tor_packets')
+        )
+        mismatches += not match
+        packets = fast_results['total_packets']
+        total_packets += packets
+        total_scapy += scapy_time
+        total_fast += fast_time
+        total_columnar += columnar_time
+        speedup = scapy_time / fast_time if fast_time > 0 else float('inf')
+        print(f"{os.path.basename(pcap)[:40]:40s} {packets:8d} {scapy_time:9.3f} {fast_time:9.3f} "
+              f"{columnar_time:9.3f} {speedup:7.1f}x  {'yes' if match else 'NO'}")
+
+    print("-" * 94)
+    if total_fast > 0:
+        print(f"{'Total':40s} {total_packets:8d} {total_scapy:9.3f} {total_fast:9.3f} "
+              f"{total_columnar:9.3f} {total_scapy / total_fast:7.1f}x")
+        print(f"Scapy: {total_packets / total_scapy:,.0f} pkt/s, "
+              f"fast: {total_packets / total_fast:,.0f} pkt/s, "
+              f"columnar: {total_packets / total_columnar:,.0f} pkt/s")
+    if mismatches:
+        print(f"{mismatches} capture(s) produced different flows")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark approximate (sketch index) correlation against exact search.
+
+For each correlation method (both by default), runs
+TimingCorrelator.find_guard_node_candidates once with every entry/exit
+pair scored and once per --top-k with the SimHash LSH sketch index, then
+prints the time, the pairs scored and the recall: the fraction of the
+exact (entry flow, exit flow) matches that the sketch run also reports.
+Without --input, a synthetic capture set is generated with planted
+entry/exit pairs (the exit copy delayed, jittered and missing a packet)
+among unrelated flows. Run from the project root:
+
+    python3 scripts/benchmark_sketch_recall.py --synthetic 3000
+    python3 scripts/benchmark_sketch_recall.py --input data/results/analysis.json --method pearson
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'correlation'))
+
+from timing_correlator import TimingCorrelator, CORRELATION_METHODS
+
+
+def synthetic_patterns(circuits, seed=1, span=3600.0):
+    """
+    Entry/exit pattern pairs of `circuits` circuits plus as many unrelated
+    flows on each side, spread over span seconds.
+    """
+    rng = np.random.default_rng(seed)
+
+    def pattern(flow_id, times, is_exit, relay):
+        sizes = rng.choice([60, 586, 1500], len(times)).tolist()
+        return {
+            'flow_id': flow_id,
+            'start_time': float(times[0]),
+            'end_time': float(times[-1]),
+            'duration': float(times[-1] - times[0]),
+            'total_bytes': int(sum(sizes)),
+            'packet_count': len(times),
+            'inter_packet_times': np.diff(times).tolist(),
+            'packet_sizes': sizes,
+            'tor_relay': relay,
+            'relay_nickname': relay,
+            'is_exit': is_exit,
+        }
+
+    def traffic():
+        # Bursts of packets separated by think times
+        gaps = np.where(rng.random(100) < 0.2, rng.exponential(8.0, 100), rng.exponential(0.3, 100))
+        return rng.uniform(0, span) + np.cumsum(gaps)
+
+    patterns = []
+    for i in range(circuits):
+        times = traffic()
+        exit_times = np.delete(times + 0.4 + rng.normal(0, 0.05, len(times)), rng.integers(1, len(times)))
+        patterns.append(pattern(f"10.0.{i // 250}.{i % 250}->198.51.100.{i % 50}", times, False, f"guard{i % 50}"))
+        patterns.append(pattern(f"203.0.113.{i % 250}->192.0.2.{i // 250}", np.sort(exit_times), True, f"exit{i % 50}"))
+        patterns.append(pattern(f"10.1.{i // 250}.{i % 250}->198.51.100.{i % 50}", traffic(), False, f"guard{i % 50}"))
+        patterns.append(pattern(f"203.0.114.{i % 250}->192.0.2.{i // 250}", traffic(), True, f"exit{i % 50}"))
+    return patterns
+
+
+def matched_pairs(candidates):
+    return Counter((m['flow'], m['exit_flow']) for c in candidates.values() for m in c['matches'])
+
+
+def benchmark_method(correlator, patterns, method, top_k, prune):
+    options = {'method': method, 'prune': prune}
+    start = time.perf_counter()
+    exact = matched_pairs(correlator.find_guard_node_candidates(patterns, **options))
+    exact_time = time.perf_counter() - start
+    exact_pairs = correlator.pair_stats['scored_pairs']
+
+    print(f"\n{len(patterns)} patterns, method {method}, {sum(exact.values())} exact matches")
+    print(f"{'Search':12s} {'Seconds':>9s} {'Pairs scored':>14s} {'Speedup':>8s} {'Recall':>7s}")
+    print("-" * 54)
+    print(f"{'exact':12s} {exact_time:9.2f} {exact_pairs:14,d} {1:7.2f}x {1:7.3f}")
+    for k in top_k:
+        start = time.perf_counter()
+        found = matched_pairs(correlator.find_guard_node_candidates(patterns, sketch=True, top_k=k, **options))
+        elapsed = time.perf_counter() - start
+        recall = sum((found & exact).values()) / sum(exact.values()) if exact else 1.0
+        print(f"{f'sketch k={k}':12s} {elapsed:9.2f} {correlator.pair_stats['scored_pairs']:14,d} "
+              f"{exact_time / elapsed:7.2f}x {recall:7.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', help='Analysis JSON (or columnar flow dataset); default synthetic patterns')
+    parser.add_argument('--synthetic', type=int, default=2000, help='Planted circuits when no --input is given')
+    parser.add_argument('--method', choices=sorted(CORRELATION_METHODS), nargs='+',
+                        default=sorted(CORRELATION_METHODS), help='Correlation methods re-scoring the candidates')
+    parser.add_argument('--top-k', type=int, nargs='+', default=[4, 16, 64], help='Exits re-scored per entry')
+    parser.add_argument('--no-prune', action='store_true', help='Disable the time/volume pre-filter in both runs')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    correlator = TimingCorrelator()
+    if args.input:
+        patterns = correlator.load_traffic_patterns(args.input)
+    else:
+        patterns = synthetic_patterns(args.synthetic)
+    for method in args.method:
+        benchmark_method(correlator, patterns, method, args.top_k, not args.no_prune)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Synthetic captures for the analyzer tests.
+
+Tor connections in both directions (with occasional idle gaps) are mixed
+with other TCP traffic, so flows, relay matching and expiry are all
+exercised. The same records can be written as classic pcap or pcapng.
+"""
+
+import socket
+import sqlite3
+import struct
+
+import numpy as np
+
+from relay_index import RELAY_COLUMNS
+
+RELAYS = [(f'198.51.100.{i}', 9001 + i % 3) for i in range(1, 9)]
+IPV6_RELAYS = [(f'2001:db8::{i}', 9001) for i in range(1, 4)]
+
+
+def tcp_frame(src, dst, sport, dport, flags, payload):
+    """Ethernet frame of an IPv4 or IPv6 (if src contains ':') TCP segment."""
+    segment = struct.pack('>HHIIBBHHH', sport, dport, 1, 0, 5 << 4, flags, 1024, 0, 0) + payload
+    if ':' in src:
+        ip = (struct.pack('>IHBB', 6 << 28, len(segment), 6, 64) +
+              socket.inet_pton(socket.AF_INET6, src) + socket.inet_pton(socket.AF_INET6, dst))
+        return b'\x00' * 12 + b'\x86\xdd' + ip + segment
+    ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(segment), 0, 0, 64, 6, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return b'\x00' * 12 + b'\x08\x00' + ip + segment
+
+
+def capture_records(packets=6000, seed=3, ipv6=False):
+    """(seconds, microseconds, frame) records in time order."""
+    rng = np.random.default_rng(seed)
+    relays = RELAYS + (IPV6_RELAYS if ipv6 else [])
+    records = []
+    t = 1000.0
+    for _ in range(packets):
+        t += rng.exponential(0.01) + (rng.random() < 0.002) * 5.0
+        relay, port = relays[rng.integers(len(relays))]
+        if ':' in relay:
+            client, other = f'2001:db8:1::{rng.integers(1, 30)}', '2001:db8:2::1'
+        else:
+            client, other = f'10.0.0.{rng.integers(1, 30)}', '192.0.2.1'
+        sport = int(40000 + rng.integers(3))
+        payload = rng.bytes(int(rng.choice([0, 40, 512, 1200])))
+        kind = rng.integers(3)
+        if kind == 0:
+            frame = tcp_frame(client, relay, sport, port, 0x18, payload)
+        elif kind == 1:
+            frame = tcp_frame(relay, client, port, sport, 0x18, payload)
+        else:
+            frame = tcp_frame(client, other, sport, 443, 0x18, payload)
+        records.append((int(t), int(t % 1 * 1e6), frame))
+    return records
+
+
+def write_capture(path, records, opener=open):
+    """Write records as a classic microsecond pcap."""
+    with opener(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for sec, usec, frame in records:
+            f.write(struct.pack('<IIII', sec, usec, len(frame), len(frame)) + frame)
+
+
+def _pcapng_block(block_type, body):
+    body += b'\x00' * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+
+def write_pcapng(path, records, opener=open):
+    """
+    Write records as pcapng, alternating between a microsecond interface
+    and a nanosecond one (if_tsresol = 9).
+    """
+    with opener(path, 'wb') as f:
+        f.write(_pcapng_block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1)))
+        f.write(_pcapng_block(1, struct.pack('<HHI', 1, 0, 65535)))
+        f.write(_pcapng_block(1, struct.pack('<HHI', 1, 0, 65535) +
+                              struct.pack('<HHB3x', 9, 1, 9) + struct.pack('<HH', 0, 0)))
+        for i, (sec, usec, frame) in enumerate(records):
+            interface = i % 2
+            ticks = sec * 10 ** 6 + usec if interface == 0 else (sec * 10 ** 6 + usec) * 1000
+            f.write(_pcapng_block(6, struct.pack('<5I', interface, ticks >> 32, ticks & 0xFFFFFFFF,
+                                                 len(frame), len(frame)) + frame))
+
+
+def write_relay_db(path, ipv6=False):
+    """Relay database holding RELAYS (and IPV6_RELAYS)."""
+    relays = RELAYS + (IPV6_RELAYS if ipv6 else [])
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE relays ({', '.join(RELAY_COLUMNS)})")
+    conn.executemany(f"INSERT INTO relays VALUES ({', '.join('?' * len(RELAY_COLUMNS))})",
+                     [(f'FP{i}', f'relay{i}', address, port, 1000, 1, i % 2, 1, 1)
+                      for i, (address, port) in enumerate(relays)])
+    conn.commit()
+    conn.close()
+
+
+def assert_same_analysis(result, expected):
+    """Two analyze_pcap results describe the same packets and flows."""
+    assert result is not None
+    for key in ('total_packets', 'non_tor_packets', 'tor_flows'):
+        assert result[key] == expected[key]
+    assert result['flows'] == expected['flows']
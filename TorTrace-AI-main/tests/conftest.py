@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for package in ('utils', 'traffic_analysis', 'correlation', 'ml_models'):
+    sys.path.insert(0, os.path.join(ROOT, package))
+
+from captures import capture_records, write_capture, write_relay_db  # noqa: E402
+from pcap_analyzer import TorTrafficAnalyzer  # noqa: E402
+
+
+@pytest.fixture
+def analyzer(tmp_path):
+    db_path = str(tmp_path / 'relays.db')
+    write_relay_db(db_path, ipv6=True)
+    return TorTrafficAnalyzer(db_path)
+
+
+@pytest.fixture
+def capture(tmp_path):
+    path = str(tmp_path / 'capture.pcap')
+    write_capture(path, capture_records())
+    return path
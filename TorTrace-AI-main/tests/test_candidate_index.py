@@ -0,0 +1,80 @@
+"""
+CandidateIndex pruning against the plausibility rules checked pair by pair.
+"""
+
+import numpy as np
+import pytest
+
+from candidate_index import CandidateIndex
+from timing_correlator import TimingCorrelator
+
+
+def random_patterns(count, rng):
+    starts = rng.uniform(0, 3600, count)
+    durations = rng.exponential(120, count)
+    volumes = np.exp(rng.uniform(np.log(100), np.log(1e8), count))
+    return [{'start_time': float(s), 'end_time': float(s + d), 'total_bytes': int(v)}
+            for s, d, v in zip(starts, durations, volumes)]
+
+
+def plausible_pairs(entries, exits, slack=5.0, duration_ratio=4.0, volume_ratio=4.0):
+    pairs = set()
+    for i, a in enumerate(entries):
+        for j, b in enumerate(exits):
+            if 'start_time' in a and 'start_time' in b:
+                if b['end_time'] < a['start_time'] - slack or b['start_time'] > a['end_time'] + slack:
+                    continue
+                durations = sorted([a['end_time'] - a['start_time'], b['end_time'] - b['start_time']])
+                if durations[1] > (durations[0] + slack) * duration_ratio:
+                    continue
+            volumes = sorted([max(a['total_bytes'], 1), max(b['total_bytes'], 1)])
+            if volumes[1] > volumes[0] * volume_ratio:
+                continue
+            pairs.add((i, j))
+    return pairs
+
+
+@pytest.mark.parametrize('block_size', [256, 7])
+def test_blocks_yield_exactly_the_plausible_pairs(block_size):
+    rng = np.random.default_rng(2)
+    entries, exits = random_patterns(300, rng), random_patterns(400, rng)
+    index = CandidateIndex(exits)
+    found = []
+    seen_rows = []
+    for rows, cols, mask in index.blocks(entries, block_size=block_size):
+        assert (np.diff(cols) > 0).all()
+        seen_rows.extend(rows.tolist())
+        i, j = np.nonzero(mask)
+        found.extend(zip(rows[i].tolist(), cols[j].tolist()))
+    expected = plausible_pairs(entries, exits)
+    assert sorted(seen_rows) == list(range(len(entries)))
+    assert len(found) == len(set(found)) == index.scored_pairs
+    assert set(found) == expected
+    assert 0 < len(expected) < 0.1 * len(entries) * len(exits)
+
+
+def test_missing_times_disable_the_time_filter():
+    rng = np.random.default_rng(4)
+    entries, exits = random_patterns(50, rng), random_patterns(60, rng)
+    for pattern in entries:
+        del pattern['start_time'], pattern['end_time']
+    rows, cols = CandidateIndex(exits).pairs(entries)
+    assert set(zip(rows.tolist(), cols.tolist())) == plausible_pairs(entries, exits)
+
+
+def test_pruned_matching_ignores_implausible_exits():
+    rng = np.random.default_rng(8)
+    ipt = rng.exponential(0.2, 60)
+    entry = {'flow_id': 'entry', 'inter_packet_times': ipt.tolist(),
+             'start_time': 100.0, 'end_time': 100.0 + ipt.sum(), 'total_bytes': 50000}
+    match = dict(entry, flow_id='match', inter_packet_times=(ipt + rng.normal(0, 0.02, 60)).tolist())
+    # Identical timing, but an hour later: a perfect score that can't be the same circuit
+    later = dict(entry, flow_id='later', start_time=3700.0, end_time=3700.0 + ipt.sum())
+    decoys = [dict(entry, flow_id=f'decoy{k}', inter_packet_times=rng.exponential(0.2, 60).tolist())
+              for k in range(20)]
+    correlator = TimingCorrelator()
+    exits = [later, match] + decoys
+    assert correlator.find_matches([entry], exits, prune=False)[0][1]['flow_id'] == 'later'
+    matches = correlator.find_matches([entry], exits)
+    assert matches[0][1]['flow_id'] == 'match'
+    assert correlator.pair_stats['scored_pairs'] == len(exits) - 1
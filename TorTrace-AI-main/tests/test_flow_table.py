@@ -0,0 +1,80 @@
+"""
+FlowTable expiry (idle and active timeouts in capture time) and
+bidirectional flow keying.
+"""
+
+from captures import RELAYS
+from flow_table import FlowTable, flow_key
+from pcap_reader import PacketRecord
+
+RELAY, OR_PORT = RELAYS[0]
+
+
+def tor_packet(timestamp, client='10.0.0.1', sport=40000, outgoing=True):
+    if outgoing:
+        return PacketRecord(timestamp, 100, client, RELAY, sport, OR_PORT, 0x18, b'x' * 46)
+    return PacketRecord(timestamp, 100, RELAY, client, OR_PORT, sport, 0x18, b'x' * 46)
+
+
+def other_packet(timestamp):
+    return PacketRecord(timestamp, 80, '10.0.0.1', '192.0.2.1', 40000, 443, 0x18, b'')
+
+
+def table_with_log(analyzer, **timeouts):
+    emitted = []
+    table = FlowTable(analyzer, on_flow=lambda flow_id, flow: emitted.append((flow_id, flow)), **timeouts)
+    return table, emitted
+
+
+def test_idle_flow_is_emitted_when_its_connection_resumes(analyzer):
+    table, emitted = table_with_log(analyzer, idle_timeout=5.0)
+    table.consume([tor_packet(0.0), tor_packet(1.0, outgoing=False), tor_packet(7.0)])
+    assert len(emitted) == 1
+    flow_id, flow = emitted[0]
+    assert (flow['packet_count'], flow['start_time'], flow['end_time']) == (2, 0.0, 1.0)
+    assert list(table.flows) == [flow_id]
+    table.flush()
+    assert [flow['start_time'] for _, flow in emitted] == [0.0, 7.0]
+
+
+def test_non_tor_packets_advance_the_expiry_clock(analyzer):
+    table, emitted = table_with_log(analyzer, idle_timeout=5.0)
+    table.consume([tor_packet(0.0)] + [other_packet(t) for t in range(1, 10)])
+    assert len(emitted) == 1 and len(table) == 0
+    assert table.non_tor_packets == 9
+
+
+def test_active_timeout_splits_long_flows(analyzer):
+    table, emitted = table_with_log(analyzer, active_timeout=3.0)
+    table.consume([tor_packet(float(t), outgoing=t % 2 == 0) for t in range(10)])
+    table.flush()
+    assert [flow['start_time'] for _, flow in emitted] == [0.0, 4.0, 8.0]
+    assert sum(flow['packet_count'] for _, flow in emitted) == 10
+    assert all(flow['end_time'] - flow['start_time'] <= 3.0 for _, flow in emitted)
+
+
+def test_active_flows_stay_bounded(analyzer):
+    table, emitted = table_with_log(analyzer, idle_timeout=2.0)
+    # 500 short connections, one after another
+    table.consume([tor_packet(i * 3.0 + j * 0.1, client=f'10.0.{i // 250}.{i % 250}', outgoing=j % 2 == 0)
+                   for i in range(500) for j in range(3)])
+    table.flush()
+    assert len(emitted) == 500
+    assert table.peak_active_flows <= 2
+
+
+def test_both_directions_share_one_flow(analyzer):
+    assert flow_key('10.0.0.1', 40000, RELAY, OR_PORT) == flow_key(RELAY, OR_PORT, '10.0.0.1', 40000)
+    table, emitted = table_with_log(analyzer)
+    # The relay speaks first; directions stay relative to the relay side
+    packets = [tor_packet(0.0, outgoing=False), tor_packet(0.5), tor_packet(1.0), tor_packet(1.5, outgoing=False),
+               tor_packet(2.0, sport=40001)]
+    packets[1] = packets[1]._replace(length=300)
+    table.consume(packets)
+    table.flush()
+    assert len(emitted) == 2
+    flow = emitted[0][1]
+    assert flow['tor_relay_ip'] == RELAY
+    assert (flow['outgoing_packet_count'], flow['incoming_packet_count']) == (2, 2)
+    assert (flow['outgoing_bytes'], flow['incoming_bytes']) == (400, 200)
+    assert list(flow['packets'].direction_array()) == [-1, 1, 1, -1]
@@ -0,0 +1,85 @@
+"""
+FFT lagged cross-correlation against a direct sum over every lag.
+"""
+
+import numpy as np
+import pytest
+
+from lag_correlation import best_lag_matches, normalize
+from parallel_correlation import grid_tiles, parallel_best_lag_matches
+from timing_correlator import TimingCorrelator
+
+
+def direct_best_lag(entry_series, exit_series, max_lag, entry_groups, exit_groups):
+    """Best (exit, score, lag) of each entry from sum_t entry[t] * exit[t + lag]."""
+    entries, exits = normalize(entry_series), normalize(exit_series)
+    n_bins = entry_series.shape[1]
+    best = {}
+    for i, a in enumerate(entries):
+        for j, b in enumerate(exits):
+            if entry_groups[i] == exit_groups[j] or np.isnan(a).any() or np.isnan(b).any():
+                continue
+            for lag in range(-max_lag, max_lag + 1):
+                lo, hi = max(0, -lag), min(n_bins, n_bins - lag)
+                score = a[lo:hi] @ b[lo + lag:hi + lag]
+                if i not in best or score > best[i][1]:
+                    best[i] = (j, score, lag)
+    return best
+
+
+@pytest.mark.parametrize('memory_budget', [1 << 28, 4096])
+def test_best_lag_matches_equal_direct_sum(memory_budget):
+    rng = np.random.default_rng(11)
+    entry_series = rng.poisson(2.0, (12, 40)).astype(float)
+    exit_series = rng.poisson(2.0, (15, 40)).astype(float)
+    exit_series[3] = np.roll(entry_series[4], 3) + rng.normal(0, 0.1, 40)
+    exit_series[7] = 1.0  # Flat: never matched
+    groups = np.arange(27)
+    groups[12 + 9] = groups[2]
+    best_exit, best_score, best_lag = best_lag_matches(entry_series, exit_series, 5, groups[:12], groups[12:],
+                                                       memory_budget=memory_budget)
+    reference = direct_best_lag(entry_series, exit_series, 5, groups[:12], groups[12:])
+    assert sorted(reference) == list(range(12))
+    for i, (j, score, lag) in reference.items():
+        assert (best_exit[i], best_lag[i]) == (j, lag)
+        assert best_score[i] == pytest.approx(score, abs=1e-9)
+    assert (best_exit[4], best_lag[4]) == (3, 3)
+
+
+def test_parallel_lag_matches_equal_serial():
+    rng = np.random.default_rng(12)
+    entry_series = rng.poisson(2.0, (30, 50)).astype(float)
+    exit_series = rng.poisson(2.0, (45, 50)).astype(float)
+    exit_series[::4] = np.roll(entry_series[:12], 2, axis=1) + rng.normal(0, 0.2, (12, 50))
+    groups = np.arange(75)
+    serial = best_lag_matches(entry_series, exit_series, 6, groups[:30], groups[30:])
+    tiles = grid_tiles(30, 45, 8, 10)
+    parallel = parallel_best_lag_matches(entry_series, exit_series, 6, groups[:30], groups[30:], blocks=tiles,
+                                         workers=2)
+    np.testing.assert_array_equal(parallel[0], serial[0])
+    np.testing.assert_array_equal(parallel[2], serial[2])
+    np.testing.assert_allclose(parallel[1], serial[1], rtol=0, atol=1e-12)
+
+
+def test_xcorr_survives_a_dropped_packet():
+    rng = np.random.default_rng(5)
+    patterns = []
+    for k in range(8):
+        # Bursty flows: a packet rate that changes every few seconds
+        rates = rng.choice([0.5, 8.0], 30)
+        times = np.sort(np.concatenate([s + rng.random(rng.poisson(r)) for s, r in enumerate(rates)]))
+        patterns.append(times)
+    entry = patterns[0]
+    # Same traffic 3 s later behind a stray first packet, with one packet lost
+    exit_times = np.concatenate(([0.0], np.delete(entry - entry[0], 10) + 3.0 + 0.01))
+
+    def pattern(flow_id, times):
+        return {'flow_id': flow_id, 'inter_packet_times': np.diff(times).tolist()}
+    entries = [pattern('entry', entry)]
+    exits = [pattern('exit', exit_times)] + [pattern(f'other{k}', t) for k, t in enumerate(patterns[1:])]
+    matches = TimingCorrelator().find_matches(entries, exits, method='xcorr', prune=False)
+    assert len(matches) == 1
+    _, exit_pattern, score, details = matches[0]
+    assert exit_pattern['flow_id'] == 'exit'
+    assert score > 0.9
+    assert details['lag'] == 3.0
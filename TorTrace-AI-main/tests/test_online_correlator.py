@@ -0,0 +1,93 @@
+"""
+Online correlator: incremental coefficients against np.corrcoef over the
+window, detection of correlated flows, and eviction of ended flows.
+"""
+
+import numpy as np
+import pytest
+
+from online_correlator import OnlineCorrelator
+
+
+def circuit_packets(circuits=30, noise_flows=30, seed=3):
+    """(timestamp, flow id, is_exit) of entry flows, their exit copies 1.3 s later and unrelated exits."""
+    rng = np.random.default_rng(seed)
+    packets = []
+    for i in range(circuits):
+        start = rng.uniform(0, 200)
+        gaps = np.where(rng.random(300) < 0.2, rng.exponential(3.0, 300), rng.exponential(0.2, 300))
+        times = start + np.cumsum(gaps)
+        times = times[times < start + 120]
+        packets += [(t, f'entry{i}', False) for t in times]
+        # The exit copy loses its first packet and jitters
+        packets += [(t, f'exit{i}', True) for t in np.delete(times + 1.3 + rng.normal(0, 0.05, len(times)), 0)]
+    for i in range(noise_flows):
+        packets += [(t, f'other{i}', True) for t in rng.uniform(0, 200) + np.cumsum(rng.exponential(0.5, 200))]
+    packets.sort()
+    return packets
+
+
+@pytest.mark.parametrize('window, cut', [(300.0, 100.0), (25.0, 180.0), (22.0, 130.0)])
+def test_pair_coefficients_equal_corrcoef_over_the_window(window, cut):
+    packets = [p for p in circuit_packets(circuits=12, noise_flows=8) if p[0] < cut]
+    online = OnlineCorrelator(threshold=2.0, window=window, flow_timeout=1e9)
+    for timestamp, flow_id, is_exit in packets:
+        online.add_packet(flow_id, timestamp, 60, is_exit)
+    now = online.current_bin
+    bins = {}
+    for timestamp, flow_id, _ in packets:
+        bins.setdefault(flow_id, []).append(int(np.floor(timestamp)))
+    compared = 0
+    for entry, row in online.entries.slot_of.items():
+        for exit_flow, col in online.exits.slot_of.items():
+            entry_bins, exit_bins = np.array(bins[entry]), np.array(bins[exit_flow])
+            for lag in range(online.lags):
+                # Entry bin b - lag against exit bin b, over the window both flows cover
+                span = np.arange(max(entry_bins[0] + lag, exit_bins[0], now - int(window)), now)
+                r, n = online.pair_correlations(np.array([row]), np.array([col]), lag)
+                assert n[0, 0] == len(span)
+                if len(span) < 3:
+                    assert np.isnan(r[0, 0])
+                    continue
+                x = np.array([np.sum(entry_bins == b - lag) for b in span])
+                y = np.array([np.sum(exit_bins == b) for b in span])
+                if x.std() == 0 or y.std() == 0:
+                    assert np.isnan(r[0, 0])
+                    continue
+                assert r[0, 0] == pytest.approx(np.corrcoef(x, y)[0, 1], abs=1e-9)
+                compared += 1
+    assert compared > 100
+
+
+def test_correlated_exits_are_reported_within_seconds():
+    packets = circuit_packets()
+    starts = {}
+    for timestamp, flow_id, _ in packets:
+        starts.setdefault(flow_id, timestamp)
+    online = OnlineCorrelator()
+    first_reports, last_reports = {}, {}
+    for timestamp, flow_id, is_exit in packets:
+        for match in online.add_packet(flow_id, timestamp, 60, is_exit):
+            first_reports.setdefault(match['flow'], match)
+            last_reports[match['flow']] = match
+
+    def correct(reports):
+        return np.mean([match['exit_flow'] == entry.replace('entry', 'exit') for entry, match in reports.items()])
+    assert len(first_reports) >= 27
+    assert correct(first_reports) >= 0.9 and correct(last_reports) >= 0.9
+    # min_bins (20) bins of evidence are needed; most entries are reported soon after
+    delays = [match['time'] - starts[entry] for entry, match in first_reports.items()]
+    assert np.median(delays) < 30
+    assert np.median([match['lag'] for match in first_reports.values()]) == 1.0
+
+
+def test_ended_and_idle_flows_are_evicted():
+    online = OnlineCorrelator(flow_timeout=10.0)
+    online.add_packet('idle', 0.0, 60, True)
+    for t in range(30):
+        online.add_packet('entry', float(t), 60, False)
+        online.add_packet('exit', t + 0.5, 60, True)
+    assert online.active_flows() == (1, 1)
+    online.end_flow('entry')
+    assert online.active_flows() == (0, 1)
+    assert online.flows_evicted == 2
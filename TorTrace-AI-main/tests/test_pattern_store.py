@@ -0,0 +1,99 @@
+"""
+Incremental correlation of a PatternStore against a one-shot run, and the
+store shared by the analyzer and the correlator CLI.
+"""
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from lag_correlation import MAX_BINS
+from pattern_store import PatternStore
+from timing_correlator import TimingCorrelator
+
+CORRELATOR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'correlation',
+                                 'timing_correlator.py')
+
+
+def synthetic_patterns(circuits, seed=1, span=1800.0):
+    """Entry/exit pairs of circuits (the exit copy delayed, jittered and missing a packet) plus unrelated flows."""
+    rng = np.random.default_rng(seed)
+
+    def pattern(flow_id, times, is_exit, relay):
+        sizes = rng.choice([60, 586, 1500], len(times)).tolist()
+        return {
+            'flow_id': flow_id,
+            'start_time': float(times[0]),
+            'end_time': float(times[-1]),
+            'duration': float(times[-1] - times[0]),
+            'total_bytes': int(sum(sizes)),
+            'packet_count': len(times),
+            'inter_packet_times': np.diff(times).tolist(),
+            'packet_sizes': sizes,
+            'tor_relay': relay,
+            'relay_nickname': relay,
+            'is_exit': is_exit,
+        }
+
+    def traffic():
+        gaps = np.where(rng.random(60) < 0.2, rng.exponential(8.0, 60), rng.exponential(0.3, 60))
+        return rng.uniform(0, span) + np.cumsum(gaps)
+
+    patterns = []
+    for i in range(circuits):
+        times = traffic()
+        exit_times = np.delete(times + 0.4 + rng.normal(0, 0.05, len(times)), rng.integers(1, len(times)))
+        patterns.append(pattern(f'10.0.0.{i}:443<->198.51.100.{i % 20}:9001', times, False, f'guard{i % 20}'))
+        patterns.append(pattern(f'203.0.113.{i}:80<->192.0.2.{i % 20}:9001', np.sort(exit_times), True,
+                                f'exit{i % 20}'))
+        patterns.append(pattern(f'10.1.0.{i}:443<->198.51.100.{i % 20}:9001', traffic(), False, f'guard{i % 20}'))
+        patterns.append(pattern(f'203.0.114.{i}:80<->192.0.2.{i % 20}:9001', traffic(), True, f'exit{i % 20}'))
+    return sorted(patterns, key=lambda p: p['start_time'])
+
+
+def normalized(candidates):
+    """Guard candidates with each guard's matches in flow order."""
+    return {relay: {**candidate, 'matches': sorted(candidate['matches'], key=lambda m: m['flow'])}
+            for relay, candidate in candidates.items()}
+
+
+@pytest.mark.parametrize('method', ['pearson', 'xcorr'])
+def test_incremental_store_equals_one_shot(tmp_path, method):
+    patterns = synthetic_patterns(150)
+    correlator = TimingCorrelator()
+    options = {'n_bins': MAX_BINS} if method == 'xcorr' else {}
+    one_shot = correlator.rank_guard_candidates(correlator.find_matches(
+        [p for p in patterns if not p['is_exit']], [p for p in patterns if p['is_exit']], method=method, **options))
+    assert one_shot
+
+    with PatternStore(str(tmp_path / 'all.db')) as store:
+        store.add_patterns(patterns, source='all')
+        stored_once = correlator.correlate_store(store, method=method)
+    assert normalized(stored_once) == normalized(one_shot)
+
+    # Captures arriving in three parts, then one already stored
+    third = len(patterns) // 3
+    with PatternStore(str(tmp_path / 'parts.db')) as store:
+        for part in (patterns[:third], patterns[third:2 * third], patterns[2 * third:]):
+            store.add_patterns(part, source='part')
+            incremental = correlator.correlate_store(store, method=method)
+        assert normalized(incremental) == normalized(one_shot)
+        store.add_patterns(patterns[:10], source='again')
+        assert correlator.correlate_store(store, method=method) == incremental
+        assert correlator.pair_stats['scored_pairs'] == 0
+
+
+def test_analyzer_stores_patterns_the_correlator_reads(analyzer, capture, tmp_path):
+    # As batch_analyzer runs them: the analyzer writes the store, the correlator only reads it
+    store_path = str(tmp_path / 'patterns.db')
+    added = analyzer.save_to_store(analyzer.analyze_pcap(capture), store_path)
+    assert added > 0
+    subprocess.run([sys.executable, CORRELATOR_SCRIPT, '--store', store_path,
+                    '--output', str(tmp_path / 'timing.json'), '--workers', '1'],
+                   check=True, capture_output=True, cwd=str(tmp_path))
+    with PatternStore(store_path) as store:
+        assert len(store.patterns()) == added
+        assert store.watermark('pearson') == store.last_id()
@@ -0,0 +1,50 @@
+"""
+Sharded and checkpointed capture analysis against a single uninterrupted pass.
+"""
+
+import os
+
+import pytest
+
+import pcap_analyzer
+from captures import assert_same_analysis
+from flow_table import FlowTable
+
+
+def test_sharded_analysis_equals_serial(analyzer, capture, monkeypatch):
+    monkeypatch.setattr(pcap_analyzer, 'MIN_SHARD_BYTES', os.path.getsize(capture) // 4)
+    serial = analyzer.analyze_pcap(capture)
+    sharded = analyzer.analyze_pcap(capture, workers=3)
+    assert sharded['ingest_stats']['shards'] == 3
+    assert serial['tor_flows'] > 0
+    assert_same_analysis(sharded, serial)
+
+
+@pytest.mark.parametrize('idle_timeout', [None, 2.0])
+def test_checkpoint_resume_equals_uninterrupted(analyzer, capture, tmp_path, monkeypatch, idle_timeout):
+    monkeypatch.setattr(pcap_analyzer, 'INGEST_BATCH', 500)
+    expected = analyzer.analyze_pcap(capture, idle_timeout=idle_timeout)
+    checkpoint = str(tmp_path / 'analysis.ckpt')
+    consume = FlowTable.consume
+
+    def interrupted_after(batches):
+        calls = [0]
+
+        def failing_consume(self, records, **options):
+            calls[0] += 1
+            if calls[0] > batches:
+                raise KeyboardInterrupt
+            return consume(self, records, **options)
+        return failing_consume
+
+    # Interrupted twice, resuming from the checkpoint each time
+    for batches in (3, 4):
+        monkeypatch.setattr(FlowTable, 'consume', interrupted_after(batches))
+        with pytest.raises(KeyboardInterrupt):
+            analyzer.analyze_pcap(capture, idle_timeout=idle_timeout, checkpoint=checkpoint, checkpoint_interval=0)
+        assert os.path.exists(checkpoint)
+    monkeypatch.setattr(FlowTable, 'consume', consume)
+    resumed = analyzer.analyze_pcap(capture, idle_timeout=idle_timeout, checkpoint=checkpoint,
+                                    checkpoint_interval=0)
+    assert_same_analysis(resumed, expected)
+    assert not os.path.exists(checkpoint)
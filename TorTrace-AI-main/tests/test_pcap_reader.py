@@ -0,0 +1,56 @@
+"""
+The fast and columnar decoders against Scapy, and pcapng and compressed
+captures against classic pcap: every capture must give the same flows.
+"""
+
+import gzip
+import importlib.util
+import lzma
+
+import pytest
+
+from captures import assert_same_analysis, capture_records, write_capture, write_pcapng
+
+
+@pytest.fixture
+def mixed_capture(tmp_path):
+    path = str(tmp_path / 'mixed.pcap')
+    write_capture(path, capture_records(packets=3000, seed=5, ipv6=True))
+    return path
+
+
+@pytest.mark.parametrize('idle_timeout', [None, 2.0])
+def test_fast_decoder_equals_scapy(analyzer, mixed_capture, idle_timeout):
+    expected = analyzer.analyze_pcap(mixed_capture, decoder='scapy', idle_timeout=idle_timeout)
+    assert expected['tor_flows'] > 0
+    assert any(':' in flow['src_ip'] for flow in expected['flows'])
+    assert_same_analysis(analyzer.analyze_pcap(mixed_capture, idle_timeout=idle_timeout), expected)
+
+
+def test_columnar_decoder_equals_fast(analyzer, mixed_capture):
+    expected = analyzer.analyze_pcap(mixed_capture)
+    result = analyzer.analyze_pcap(mixed_capture, decoder='columnar')
+    assert 'flow_grouping' in result['metrics']['stages']
+    assert_same_analysis(result, expected)
+
+
+def _zstd_open(path, mode):
+    import zstandard
+    return zstandard.open(path, mode)
+
+
+@pytest.mark.parametrize('writer, opener', [
+    (write_pcapng, open),
+    (write_capture, gzip.open),
+    (write_pcapng, gzip.open),
+    (write_capture, lzma.open),
+    (write_pcapng, lzma.open),
+    pytest.param(write_capture, _zstd_open, marks=pytest.mark.skipif(
+        importlib.util.find_spec('zstandard') is None, reason='zstandard not installed')),
+])
+@pytest.mark.parametrize('decoder', ['fast', 'scapy'])
+def test_capture_formats_equal_classic_pcap(analyzer, mixed_capture, tmp_path, writer, opener, decoder):
+    path = str(tmp_path / 'converted')
+    writer(path, capture_records(packets=3000, seed=5, ipv6=True), opener=opener)
+    expected = analyzer.analyze_pcap(mixed_capture)
+    assert_same_analysis(analyzer.analyze_pcap(path, decoder=decoder), expected)
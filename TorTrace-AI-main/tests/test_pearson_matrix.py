@@ -0,0 +1,117 @@
+"""
+Batched Pearson matching against the per-pair scipy.stats.pearsonr scan.
+"""
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from pearson_matrix import pack_sequences, best_matches, critical_correlation, SIGNIFICANCE_LEVEL
+from parallel_correlation import grid_tiles, parallel_best_matches
+from timing_correlator import TimingCorrelator
+
+
+def pairwise_best(entries, exits, entry_groups, exit_groups):
+    """Best significant positive exit of each entry, scanning pairs with pearsonr (first exit wins ties)."""
+    best = {}
+    for i, a in enumerate(entries):
+        best_r, best_j = 0, None
+        for j, b in enumerate(exits):
+            n = min(len(a), len(b))
+            if entry_groups[i] == exit_groups[j] or n < 3:
+                continue
+            x, y = np.asarray(a[:n], dtype=float), np.asarray(b[:n], dtype=float)
+            if (x == x[0]).all() or (y == y[0]).all():
+                continue
+            r, p = stats.pearsonr(x, y)
+            if r > best_r and p < SIGNIFICANCE_LEVEL:
+                best_r, best_j = r, j
+        if best_j is not None:
+            best[i] = (best_j, best_r)
+    return best
+
+
+def with_correlation(x, r, rng):
+    """A sequence whose sample correlation with x is r (to rounding)."""
+    xc = x - x.mean()
+    z = rng.standard_normal(len(x))
+    z -= z.mean()
+    z -= z @ xc / (xc @ xc) * xc
+    return 5.0 + r * xc / np.linalg.norm(xc) + np.sqrt(1 - r * r) * z / np.linalg.norm(z)
+
+
+@pytest.fixture
+def sequences():
+    rng = np.random.default_rng(7)
+    entries = [rng.exponential(1.0, rng.integers(2, 40)) for _ in range(40)]
+    exits = [rng.exponential(1.0, rng.integers(2, 40)) for _ in range(60)]
+    # Delayed noisy copies, exact duplicates (ties) and flat sequences
+    for i in range(0, 40, 3):
+        exits[i] = entries[i] * 1.01 + rng.normal(0, 0.05, len(entries[i]))
+    exits[50] = exits[51] = entries[5].copy()
+    exits[52] = entries[6] * 2.0 + 1.0
+    exits[53] = entries[6].copy()
+    exits[54] = np.full(10, 0.3)
+    entries[7] = np.full(12, 0.1)
+    # Coefficients straddling the critical value of their length
+    for i, (length, offset) in zip(range(20, 30), [(8, 1e-9), (8, -1e-9), (12, 1e-7), (12, -1e-7), (25, 1e-9),
+                                                  (25, -1e-9), (5, 1e-8), (5, -1e-8), (40, 1e-6), (40, -1e-6)]):
+        entries[i] = rng.exponential(1.0, length)
+        exits[i] = with_correlation(entries[i], critical_correlation(length) + offset, rng)
+    groups = np.arange(100)
+    groups[40 + 59] = groups[39]  # The last exit belongs to the same flow as the last entry
+    exits[59] = entries[39].copy()
+    return entries, exits, groups[:40], groups[40:]
+
+
+def test_best_matches_cover_pairwise_best(sequences):
+    entries, exits, entry_groups, exit_groups = sequences
+    reference = pairwise_best(entries, exits, entry_groups, exit_groups)
+    rows, cols, values = best_matches(pack_sequences(entries), pack_sequences(exits), entry_groups, exit_groups)
+
+    assert set(rows.tolist()) == set(reference)
+    for i, (j, r) in reference.items():
+        candidates = cols[rows == i]
+        assert j in candidates
+        assert values[(rows == i) & (cols == j)][0] == pytest.approx(r, abs=1e-9)
+    # Exact duplicates are both returned as candidates
+    assert {50, 51} <= set(cols[rows == 5].tolist())
+    assert {52, 53} <= set(cols[rows == 6].tolist())
+
+
+def test_significance_near_critical_value(sequences):
+    entries, exits, entry_groups, exit_groups = sequences
+    # Only the constructed pairs are scored
+    blocks = [(np.array([k]), np.array([k]), None) for k in range(10)]
+    rows, cols, _ = best_matches(pack_sequences(entries[20:30]), pack_sequences(exits[20:30]),
+                                 entry_groups[20:30], exit_groups[20:30], blocks=blocks)
+    found = set(zip(rows.tolist(), cols.tolist()))
+    for k in range(10):
+        _, p = stats.pearsonr(entries[20 + k], exits[20 + k])
+        assert ((k, k) in found) == (p < SIGNIFICANCE_LEVEL)
+
+
+def test_find_matches_equal_pairwise_scan(sequences):
+    entries, exits, entry_groups, exit_groups = sequences
+    reference = pairwise_best(entries, exits, entry_groups, exit_groups)
+    entry_patterns = [{'flow_id': f'f{g}', 'inter_packet_times': list(s)} for g, s in zip(entry_groups, entries)]
+    exit_patterns = [{'flow_id': f'f{g}', 'inter_packet_times': list(s)} for g, s in zip(exit_groups, exits)]
+    correlator = TimingCorrelator()
+    for workers in (1, 2):
+        matches = correlator.find_matches(entry_patterns, exit_patterns, prune=False, workers=workers)
+        found = {entry_patterns.index(entry): (exit_patterns.index(exit_p), r) for entry, exit_p, r, _ in matches}
+        assert found == reference
+
+
+@pytest.mark.parametrize('tile_entries, tile_exits', [(256, 4096), (7, 11)])
+def test_parallel_best_matches_equal_serial(sequences, tile_entries, tile_exits):
+    entries, exits, entry_groups, exit_groups = sequences
+    entries, exits = pack_sequences(entries), pack_sequences(exits)
+    serial = best_matches(entries, exits, entry_groups, exit_groups)
+    # Small tiles split every entry's exits across tasks, so the top-k merge decides the best pair
+    tiles = grid_tiles(len(entries[1]), len(exits[1]), tile_entries, tile_exits)
+    parallel = parallel_best_matches(entries, exits, entry_groups, exit_groups, blocks=tiles, workers=2)
+    np.testing.assert_array_equal(parallel[0], serial[0])
+    np.testing.assert_array_equal(parallel[1], serial[1])
+    np.testing.assert_allclose(parallel[2], serial[2], rtol=0, atol=1e-12)
+
@@ -0,0 +1,92 @@
+"""
+Permutation significance against per-pair shuffles scored with
+np.corrcoef, and the permutation mode of find_matches.
+"""
+
+import numpy as np
+import pytest
+
+from pearson_matrix import pack_sequences, pearson_pvalues
+from permutation_test import permutation_pvalues
+from timing_correlator import TimingCorrelator
+
+
+def heavy_tailed(rng, length):
+    return rng.pareto(1.5, length) + 0.001
+
+
+@pytest.fixture
+def pairs():
+    rng = np.random.default_rng(9)
+    entries = [heavy_tailed(rng, rng.integers(5, 30)) for _ in range(25)]
+    exits = [heavy_tailed(rng, rng.integers(5, 30)) for _ in range(25)]
+    for i in range(0, 25, 4):
+        exits[i] = entries[i] * 1.5 + rng.normal(0, 0.01, len(entries[i]))
+    rows = np.repeat(np.arange(25), 3)
+    cols = (rows + np.tile([0, 1, 7], 25)) % 25
+    return pack_sequences(entries), pack_sequences(exits), entries, exits, rows, cols
+
+
+def shuffled_pvalue(x, y, permutations, seed):
+    """p-value of one pair from the same shuffles, each scored with np.corrcoef."""
+    length = min(len(x), len(y))
+    x, y = x[:length], y[:length]
+    rng = np.random.default_rng([seed, length])
+    shuffles = rng.permuted(np.tile(np.arange(length), (permutations, 1)), axis=1)
+    r = np.corrcoef(x, y)[0, 1]
+    null = np.array([np.corrcoef(x, y[order])[0, 1] for order in shuffles])
+    return (1 + np.sum(np.abs(null) >= abs(r) - 1e-12)) / (1 + permutations)
+
+
+def test_pvalues_equal_per_pair_shuffles(pairs):
+    entries, exits, entry_list, exit_list, rows, cols = pairs
+    pvalues, used = permutation_pvalues(entries, exits, rows, cols, permutations=199, seed=4,
+                                        memory_budget=1 << 16)
+    assert used == 199
+    for p, i, j in zip(pvalues, rows.tolist(), cols.tolist()):
+        assert p == pytest.approx(shuffled_pvalue(entry_list[i], exit_list[j], 199, 4), abs=1e-12)
+    # Linked pairs reach the smallest p-value the permutations resolve
+    assert (pvalues[(rows % 4 == 0) & (rows == cols)] == 1 / 200).all()
+
+
+def test_pvalues_depend_only_on_the_pair_and_seed(pairs):
+    entries, exits, _, _, rows, cols = pairs
+    together, _ = permutation_pvalues(entries, exits, rows, cols, permutations=99)
+    alone = [permutation_pvalues(entries, exits, rows[k:k + 1], cols[k:k + 1], permutations=99)[0][0]
+             for k in range(0, len(rows), 5)]
+    np.testing.assert_array_equal(together[::5], alone)
+    reseeded, _ = permutation_pvalues(entries, exits, rows, cols, permutations=99, seed=1)
+    assert not np.array_equal(reseeded, together)
+
+
+def test_budget_lowers_permutations_then_falls_back_to_parametric(pairs):
+    entries, exits, _, _, rows, cols = pairs
+    work = int(np.minimum(entries[1][rows], exits[1][cols]).sum())
+    _, used = permutation_pvalues(entries, exits, rows, cols, permutations=999, budget=work * 100)
+    assert used == 100
+    pvalues, used = permutation_pvalues(entries, exits, rows, cols, permutations=999, budget=work * 10)
+    assert used == 0
+    lengths = np.minimum(entries[1][rows], exits[1][cols])
+    for k in range(0, len(rows), 7):
+        z = [np.asarray(s[:lengths[k]]) for s in (entries[0][rows[k]], exits[0][cols[k]])]
+        r = np.corrcoef(*z)[0, 1]
+        assert pvalues[k] == pytest.approx(pearson_pvalues(np.array([r]), int(lengths[k]))[0], rel=1e-6)
+
+
+def test_permutation_mode_finds_linked_flows():
+    rng = np.random.default_rng(13)
+    entries, exits = [], []
+    for k in range(40):
+        ipt = heavy_tailed(rng, 80)
+        entries.append({'flow_id': f'entry{k}', 'inter_packet_times': ipt.tolist()})
+        linked = ipt * 1.02 + rng.normal(0, 0.02, 80) if k % 2 == 0 else heavy_tailed(rng, 80)
+        exits.append({'flow_id': f'exit{k}', 'inter_packet_times': linked.tolist()})
+    correlator = TimingCorrelator()
+    runs = [correlator.find_matches(entries, exits, prune=False, significance='permutation', permutations=199,
+                                    workers=workers) for workers in (1, 2)]
+    found = {(entry['flow_id'], exit_pattern['flow_id']): details['p_value']
+             for entry, exit_pattern, _, details in runs[0]}
+    assert {(f'entry{k}', f'exit{k}') for k in range(0, 40, 2)} <= set(found)
+    assert all(found[(f'entry{k}', f'exit{k}')] == 0.005 for k in range(0, 40, 2))
+    assert [(e['flow_id'], x['flow_id'], d) for e, x, _, d in runs[1]] == \
+        [(e['flow_id'], x['flow_id'], d) for e, x, _, d in runs[0]]
@@ -0,0 +1,77 @@
+"""
+SimHash sketch retrieval: the query against a brute-force ranking of
+colliding exits, and recall of correlated flows.
+"""
+
+import numpy as np
+import pytest
+
+from sketch_index import SketchIndex, SKETCH_TOP_K
+from timing_correlator import TimingCorrelator
+
+
+def brute_force_query(index, series, k):
+    sketches, keys = index.sketch(series)
+    hamming = np.unpackbits(sketches[:, None, :] ^ index.sketches[None, :, :], axis=2).sum(axis=2)
+    pairs = set()
+    for i in range(len(series)):
+        if np.ptp(series[i]) == 0:
+            continue
+        colliding = [j for j in np.flatnonzero(index.valid) if (keys[i] == index.keys[j]).any()]
+        ranked = sorted(colliding, key=lambda j: (hamming[i, j], j))
+        pairs.update((i, j) for j in ranked[:k])
+    return pairs
+
+
+def correlated_series(rng, exits, count, noise):
+    picks = rng.choice(len(exits), count, replace=False)
+    return picks, exits[picks] + rng.normal(0, noise, (count, exits.shape[1]))
+
+
+def test_query_equals_brute_force_ranking():
+    rng = np.random.default_rng(1)
+    exits = rng.poisson(3.0, (300, 64)).astype(float)
+    exits[5] = 2.0  # Flat exits are never indexed
+    picks, entries = correlated_series(rng, exits, 40, 1.0)
+    entries[3] = 1.0
+    index = SketchIndex(exits, tables=8, bits_per_table=6)
+    rows, cols = index.query(entries, k=5)
+    assert set(zip(rows.tolist(), cols.tolist())) == brute_force_query(index, entries, 5)
+    assert 3 not in rows and 5 not in cols
+    assert (np.bincount(rows) <= 5).all()
+
+
+def test_correlated_exits_are_retrieved():
+    rng = np.random.default_rng(3)
+    exits = rng.poisson(3.0, (2000, 128)).astype(float)
+    # Correlation about 0.9 with their exit, found 99.6% of the time with the default tables
+    picks, entries = correlated_series(rng, exits, 200, np.sqrt(3.0 * (1 / 0.81 - 1)))
+    index = SketchIndex(exits)
+    found = set(zip(*(a.tolist() for a in index.query(entries))))
+    recall = np.mean([(i, j) in found for i, j in enumerate(picks.tolist())])
+    assert recall > 0.97
+    excluded = index.query(entries, exclude=lambda rows, cols: cols == picks[rows])
+    assert not (excluded[1] == picks[excluded[0]]).any()
+    blocks = list(index.blocks(entries))
+    assert index.scored_pairs == sum(int(mask.sum()) for _, _, mask in blocks) <= 200 * SKETCH_TOP_K
+
+
+@pytest.mark.parametrize('method', ['pearson', 'xcorr'])
+def test_sketch_matching_finds_the_exact_matches(method):
+    rng = np.random.default_rng(6)
+    entries, exits = [], []
+    for k in range(300):
+        ipt = rng.exponential(1.0, 100) * rng.choice([0.05, 1.0], 100)
+        exits.append({'flow_id': f'exit{k}', 'inter_packet_times': ipt.tolist()})
+        if k % 10 == 0:
+            noisy = np.clip(ipt + rng.normal(0, 0.01, 100), 0, None)
+            entries.append({'flow_id': f'entry{k}', 'inter_packet_times': noisy.tolist()})
+    correlator = TimingCorrelator()
+    exact = correlator.find_matches(entries, exits, method=method, prune=False)
+    approximate = correlator.find_matches(entries, exits, method=method, prune=False, sketch=True)
+    assert correlator.pair_stats['prune_ratio'] > 0.5
+
+    def pairs(matches):
+        return {(entry['flow_id'], exit_pattern['flow_id']) for entry, exit_pattern, _, _ in matches}
+    assert pairs(exact) == {(f'entry{k}', f'exit{k}') for k in range(0, 300, 10)}
+    assert pairs(approximate) == pairs(exact)
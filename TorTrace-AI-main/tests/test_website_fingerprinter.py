@@ -0,0 +1,48 @@
+"""
+Batched website fingerprinting inference against one flow at a time.
+"""
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from website_fingerprinter import WebsiteFingerprinter  # noqa: E402
+
+
+@pytest.fixture
+def fingerprinter():
+    torch.manual_seed(0)
+    return WebsiteFingerprinter()
+
+
+@pytest.fixture
+def patterns(fingerprinter):
+    rng = np.random.default_rng(0)
+    flows = []
+    for i in range(37):
+        length = int(rng.integers(1, 2 * fingerprinter.sequence_length))
+        flows.append({'flow_id': f'flow_{i}', 'directions': rng.choice([-1, 1], length).tolist(),
+                      'packet_sizes': rng.integers(40, 1500, length).tolist()})
+    flows.append({'flow_id': 'empty', 'directions': [], 'packet_sizes': []})
+    return flows
+
+
+def test_batch_size_does_not_change_predictions(fingerprinter, patterns):
+    single = fingerprinter.predict_batch(patterns, batch_size=1, top_k=1)
+    for batch_size in (8, len(patterns)):
+        batched = fingerprinter.predict_batch(patterns, batch_size=batch_size, top_k=1)
+        assert [p[0][0] for p in batched] == [p[0][0] for p in single]
+        np.testing.assert_allclose([p[0][1] for p in batched], [p[0][1] for p in single], rtol=1e-5)
+    assert fingerprinter.predict_website(patterns[3]) == pytest.approx(single[3][0], rel=1e-5)
+
+
+@pytest.mark.parametrize('top_k', [1, 3, 100])
+def test_top_k_tuples_per_flow(fingerprinter, patterns, top_k):
+    predictions = fingerprinter.predict_batch(patterns, batch_size=16, top_k=top_k)
+    assert len(predictions) == len(patterns)
+    for prediction in predictions:
+        assert len(prediction) == min(top_k, fingerprinter.model.fc2.out_features)
+        assert all(isinstance(website, str) and 0 <= score <= 1 for website, score in prediction)
+        scores = [score for _, score in prediction]
+        assert scores == sorted(scores, reverse=True)
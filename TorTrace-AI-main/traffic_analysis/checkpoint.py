@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Analysis Checkpoints
+
+Periodic checkpoints for long streaming pcap analyses. A checkpoint holds
+the resume point in the capture (the byte offset of the next record for an
+uncompressed classic pcap, otherwise the number of records consumed), the
+serialized flow table and the flows finalized so far, so a restarted
+analysis continues from the last checkpoint and produces the same flows as
+an uninterrupted run.
+
+Files:
+    <path>          pickled state, replaced atomically at every checkpoint
+    <path>.flows    finalized flows as a stream of pickles, appended at each
+                    checkpoint; the state records how much of it is valid
+"""
+
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+DEFAULT_CHECKPOINT_INTERVAL = 60.0  # Seconds of wall-clock time between checkpoints
+
+
+class AnalysisCheckpoint:
+    """
+    Checkpoint file pair for one capture and set of analysis settings.
+
+    A checkpoint is only resumed from if the capture (path, size and
+    modification time) and the settings match the run that wrote it.
+    """
+
+    def __init__(self, path, pcap_file, settings, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        Args:
+            path: Checkpoint state file
+            pcap_file: Capture being analyzed
+            settings: Picklable dict of everything that changes the flows
+                (decoder, timeouts, analyzer options)
+            interval: Minimum seconds between checkpoints
+        """
+        self.path = path
+        self.flows_path = path + '.flows'
+        self.interval = interval
+        stat = os.stat(pcap_file)
+        self.identity = {
+            'pcap_file': os.path.abspath(pcap_file),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'settings': settings,
+        }
+        self.flows_saved = 0
+        self.saves = 0
+        self._last_save = time.monotonic()
+
+    def load(self):
+        """
+        Read the last checkpoint.
+
+        The finalized-flow file is cut back to the length recorded in the
+        state, dropping flows appended by an interrupted checkpoint.
+
+        Returns:
+            dict: 'packets' (records consumed), 'offset' (byte offset of
+            the next record, or None), 'table' (FlowTable.state()) and
+            'flows' (finalized flows in emit order); None if there is no
+            usable checkpoint
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        if state.get('version') != CHECKPOINT_VERSION or state.get('identity') != self.identity:
+            logger.warning(f"Ignoring checkpoint {self.path}: written for a different capture or settings")
+            return None
+        flows_bytes = state['flows_bytes']
+        size = os.path.getsize(self.flows_path) if os.path.exists(self.flows_path) else 0
+        if size < flows_bytes:
+            logger.warning(f"Ignoring checkpoint {self.path}: {self.flows_path} is incomplete")
+            return None
+        flows = []
+        if size:
+            with open(self.flows_path, 'r+b') as f:
+                f.truncate(flows_bytes)
+                while f.tell() < flows_bytes:
+                    flows.append(pickle.load(f))
+        self.flows_saved = len(flows)
+        state['flows'] = flows
+        self._last_save = time.monotonic()
+        return state
+
+    def due(self):
+        """True once interval seconds have passed since the last save or load."""
+        return time.monotonic() - self._last_save >= self.interval
+
+    def save(self, table, flows, offset=None):
+        """
+        Write a checkpoint.
+
+        Args:
+            table: FlowTable to snapshot
+            flows: Finalized flows so far (only the ones not yet saved are
+                written)
+            offset: Byte offset of the next record, if the capture is
+                seekable
+        """
+        with open(self.flows_path, 'ab') as f:
+            for flow in flows[self.flows_saved:]:
+                pickle.dump(flow, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+            flows_bytes = f.tell()
+        self.flows_saved = len(flows)
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'identity': self.identity,
+            'packets': table.total_packets,
+            'offset': offset,
+            'table': table.state(),
+            'flows_bytes': flows_bytes,
+        }
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.path)
+        self.saves += 1
+        self._last_save = time.monotonic()
+        logger.info(f"Checkpoint at packet {table.total_packets} "
+                    f"({len(table)} active flows, {len(flows)} finalized) saved to {self.path}")
+
+    def remove(self):
+        """Delete the checkpoint files (after a completed run, or a stale checkpoint)."""
+        for path in (self.path, self.flows_path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Payload Entropy
+
+Shannon entropy of packet payloads from 256-bin byte histograms. The
+entropy of n bytes with byte counts c is log2(n) - sum(c * log2(c)) / n;
+both log terms come from lookup tables, so a histogram costs one
+np.bincount and one gather, and a whole batch of payloads in a shared
+buffer needs a single bincount. Payloads can be sampled to their first K
+bytes to bound the cost on bulk transfers.
+"""
+
+import numpy as np
+
+BATCH_BYTES = 1 << 22  # Payload bytes histogrammed per bincount in buffer_entropies
+
+_log2_table = np.zeros(1)
+_clog2_table = np.zeros(1)
+
+
+def _tables(max_count):
+    """log2(c) and c * log2(c) for c = 0..max_count (log2(0) taken as 0)."""
+    global _log2_table, _clog2_table
+    if max_count >= len(_log2_table):
+        size = 1 << max(16, int(max_count).bit_length())
+        counts = np.arange(size, dtype=np.float64)
+        _log2_table = np.log2(np.maximum(counts, 1))
+        _clog2_table = counts * _log2_table
+    return _log2_table, _clog2_table
+
+
+def entropy_from_counts(counts, lengths):
+    """
+    Entropy in bits per byte for a batch of byte histograms.
+
+    Args:
+        counts: (n, 256) integer byte counts
+        lengths: Bytes in each histogram
+
+    Returns:
+        np.ndarray: float64 entropy per row (0 for empty rows)
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if len(lengths) == 0:
+        return np.zeros(0)
+    log2_table, clog2_table = _tables(int(lengths.max()))
+    total = np.maximum(lengths, 1)
+    return log2_table[total] - clog2_table[counts].sum(axis=1) / total
+
+
+def payload_entropy(payload, sample_bytes=None):
+    """
+    Entropy of one payload.
+
+    Args:
+        payload: bytes-like object (read in place, not copied)
+        sample_bytes: Only use the first this many bytes
+
+    Returns:
+        float: Bits per byte (0 for an empty payload)
+    """
+    data = np.frombuffer(payload, dtype=np.uint8)
+    if sample_bytes:
+        data = data[:sample_bytes]
+    if len(data) == 0:
+        return 0.0
+    counts = np.bincount(data, minlength=256)
+    return float(entropy_from_counts(counts[np.newaxis, :], [len(data)])[0])
+
+
+def buffer_entropies(buffer, offsets, lengths, sample_bytes=None):
+    """
+    Entropies of many payloads that live in one buffer (e.g. a mapped pcap).
+
+    Payload bytes are gathered straight from the buffer and histogrammed in
+    batches of about BATCH_BYTES with one bincount each.
+
+    Args:
+        buffer: bytes-like object holding the payloads
+        offsets: Start of each payload in the buffer
+        lengths: Length of each payload
+        sample_bytes: Only use the first this many bytes of each payload
+
+    Returns:
+        np.ndarray: float64 entropy per payload
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if sample_bytes:
+        lengths = np.minimum(lengths, sample_bytes)
+    entropies = np.zeros(len(offsets))
+    ends = np.cumsum(lengths)
+    start = 0
+    while start < len(offsets):
+        base = ends[start] - lengths[start]
+        stop = max(start + 1, int(np.searchsorted(ends, base + BATCH_BYTES, side='right')))
+        chunk_lengths = lengths[start:stop]
+        n = stop - start
+        firsts = ends[start:stop] - chunk_lengths - base
+        positions = (np.arange(int(chunk_lengths.sum()), dtype=np.int64)
+                     + np.repeat(offsets[start:stop] - firsts, chunk_lengths))
+        bins = np.repeat(np.arange(n, dtype=np.int64) * 256, chunk_lengths) + data[positions]
+        counts = np.bincount(bins, minlength=n * 256).reshape(n, 256)
+        entropies[start:stop] = entropy_from_counts(counts, chunk_lengths)
+        start = stop
+    return entropies
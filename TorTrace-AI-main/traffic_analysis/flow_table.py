@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Tor Flow Table
+
+Tracks the Tor flows of a packet stream and finalizes each flow as soon as
+it expires, so memory is bounded by the number of concurrent flows instead
+of the length of the capture. Used for offline pcap analysis and for live
+capture streams.
+"""
+
+import logging
+import time
+from array import array
+from contextlib import nullcontext
+from itertools import islice
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVERY = 1000000  # Log ingestion progress every N packets
+CLASSIFY_BATCH = 4096  # Packets classified against the relay index at once
+
+
+def flow_key(src_ip, src_port, dst_ip, dst_port):
+    """
+    Canonical flow id of a TCP connection.
+
+    Both directions of a connection map to the same id: the two endpoints
+    are written in sorted order, as "a:port<->b:port".
+    """
+    if (src_ip, src_port) <= (dst_ip, dst_port):
+        return f"{src_ip}:{src_port}<->{dst_ip}:{dst_port}"
+    return f"{dst_ip}:{dst_port}<->{src_ip}:{src_port}"
+
+
+class PacketSeries:
+    """
+    Compact per-flow packet storage.
+
+    Timestamps, sizes and directions live in growable typed arrays (13
+    bytes per packet) instead of one dict per packet. Indexing or iterating
+    still yields {'timestamp', 'size', 'direction'} dicts for callers that
+    want them, and the arrays can be viewed as NumPy arrays without copying.
+    """
+
+    __slots__ = ('timestamps', 'sizes', 'directions')
+
+    def __init__(self):
+        self.timestamps = array('d')
+        self.sizes = array('i')
+        self.directions = array('b')
+
+    @classmethod
+    def from_arrays(cls, timestamps, sizes, directions):
+        """Build a series from NumPy arrays (copied into the typed buffers)."""
+        series = cls()
+        series.timestamps.frombytes(np.ascontiguousarray(timestamps, dtype=np.float64).tobytes())
+        series.sizes.frombytes(np.ascontiguousarray(sizes, dtype=np.int32).tobytes())
+        series.directions.frombytes(np.ascontiguousarray(directions, dtype=np.int8).tobytes())
+        return series
+
+    def append(self, timestamp, size, direction):
+        self.timestamps.append(timestamp)
+        self.sizes.append(size)
+        self.directions.append(direction)
+
+    def extend(self, other):
+        """Append every packet of another series (in place)."""
+        self.timestamps.extend(other.timestamps)
+        self.sizes.extend(other.sizes)
+        self.directions.extend(other.directions)
+
+    def flip_directions(self):
+        """Negate every packet direction (in place)."""
+        self.directions = array('b', [-d for d in self.directions])
+
+    def timestamp_array(self):
+        """Zero-copy float64 NumPy view of the timestamps."""
+        return np.frombuffer(self.timestamps, dtype=np.float64) if self.timestamps else np.zeros(0)
+
+    def size_array(self):
+        """Zero-copy int32 NumPy view of the packet sizes."""
+        return np.frombuffer(self.sizes, dtype=np.int32) if self.sizes else np.zeros(0, dtype=np.int32)
+
+    def direction_array(self):
+        """Zero-copy int8 NumPy view of the packet directions."""
+        return np.frombuffer(self.directions, dtype=np.int8) if self.directions else np.zeros(0, dtype=np.int8)
+
+    def nbytes(self):
+        """Bytes held by the packet buffers."""
+        return sum(buf.buffer_info()[1] * buf.itemsize
+                   for buf in (self.timestamps, self.sizes, self.directions))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __bool__(self):
+        return len(self.timestamps) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            series = PacketSeries()
+            series.timestamps = self.timestamps[index]
+            series.sizes = self.sizes[index]
+            series.directions = self.directions[index]
+            return series
+        return {'timestamp': self.timestamps[index], 'size': self.sizes[index],
+                'direction': self.directions[index]}
+
+    def __iter__(self):
+        for timestamp, size, direction in zip(self.timestamps, self.sizes, self.directions):
+            yield {'timestamp': timestamp, 'size': size, 'direction': direction}
+
+    def __eq__(self, other):
+        if not isinstance(other, PacketSeries):
+            return NotImplemented
+        return (self.timestamps == other.timestamps and self.sizes == other.sizes and
+                self.directions == other.directions)
+
+    def __repr__(self):
+        return f"PacketSeries({len(self)} packets)"
+
+
+class FlowTable:
+    """
+    Active Tor flows keyed by flow id, with idle and active timeouts.
+
+    Flows are bidirectional: both directions of a connection share one
+    flow, oriented by its first packet. Packet directions are relative to
+    the flow's relay side, so outgoing_* and incoming_* counters hold the
+    two halves of the conversation.
+
+    Timeouts are measured in capture time. A flow expires when no packet
+    arrived for idle_timeout seconds, or when it has been open for
+    active_timeout seconds; the next packet with the same 5-tuple starts a
+    new flow. Expired flows are finalized and handed to on_flow(flow_id,
+    flow). Without timeouts flows are only emitted by flush(), in order of
+    their first packet.
+    """
+
+    def __init__(self, analyzer, idle_timeout=None, active_timeout=None, on_flow=None,
+                 metrics=None, on_packet=None):
+        """
+        Args:
+            analyzer: TorTrafficAnalyzer providing relay lookup and flow
+                accumulator methods
+            idle_timeout: Seconds without packets before a flow expires
+            active_timeout: Maximum seconds a flow stays open
+            on_flow: Callback receiving (flow_id, finalized flow)
+            metrics: Optional StageMetrics; relay classification, payload
+                entropy and flow finalization are timed as its
+                'relay_match', 'entropy' and 'finalize' stages
+            on_packet: Optional callback receiving (flow_id, flow,
+                timestamp, size) for every Tor packet, after it is folded
+                into its flow (e.g. for online correlation)
+        """
+        self.analyzer = analyzer
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.on_flow = on_flow
+        self.on_packet = on_packet
+        self.flows = {}
+        self.metrics = metrics
+        self.total_packets = 0
+        self.tor_packets = 0
+        self.non_tor_packets = 0
+        self.flows_emitted = 0
+        self.peak_active_flows = 0
+        timeouts = [t for t in (idle_timeout, active_timeout) if t is not None]
+        # Quiet flows are swept periodically (on the timestamps of all
+        # packets, not only Tor ones); flows that see another packet are
+        # checked exactly on arrival
+        self._sweep_interval = min(timeouts) / 2 if timeouts else None
+        self._next_sweep = None
+        self._start = time.perf_counter()
+
+    def __len__(self):
+        return len(self.flows)
+
+    def add(self, record):
+        """Fold one PacketRecord (None for a non-TCP/IP packet) into the table."""
+        self.consume((record,))
+
+    def consume(self, records, keep_entropies=False, batch_size=CLASSIFY_BATCH):
+        """
+        Fold a stream of PacketRecords into the table.
+
+        Records are taken batch_size at a time and each batch is classified
+        against the relay index in bulk before its packets are folded in.
+
+        Args:
+            records: Iterable of PacketRecord/None
+            keep_entropies: Also keep each payload's entropy on the flow
+                (used when partial flows are merged later)
+            batch_size: Records classified at once (a batch is only folded
+                in once it is full, so live streams should use small ones)
+        """
+        records = iter(records)
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                return
+            self._consume_batch(batch, keep_entropies)
+
+    def _relay_sides(self, records):
+        """
+        Classify PacketRecords (None excluded) in bulk.
+
+        Returns:
+            list: 1 where the destination is a Tor relay (outgoing), -1
+                where only the source is (incoming), 0 for non-Tor packets
+        """
+        if not records:
+            return []
+        index = self.analyzer.relay_index
+        _, _, src_ips, dst_ips, src_ports, dst_ports, _, _ = zip(*records)
+        dst_relay = index.match_addresses(dst_ips, dst_ports)
+        src_relay = index.match_addresses(src_ips, src_ports)
+        return np.where(dst_relay, 1, np.where(src_relay, -1, 0)).tolist()
+
+    def _consume_batch(self, records, keep_entropies):
+        analyzer = self.analyzer
+        flows = self.flows
+        sweep_interval = self._sweep_interval
+        on_packet = self.on_packet
+        present = [record for record in records if record is not None]
+        with self._stage('relay_match'):
+            sides = self._relay_sides(present)
+        # Payload entropies of the batch's Tor packets, in one call
+        with self._stage('entropy'):
+            entropies = iter(analyzer._payload_entropies(
+                [record.payload for record, side in zip(present, sides) if side and record.payload]))
+        sides = iter(sides)
+        for record in records:
+            self.total_packets += 1
+            if self.total_packets % PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - self._start
+                logger.info(f"Read {self.total_packets} packets "
+                            f"({self.total_packets / elapsed:.0f} pkt/s, "
+                            f"{len(flows)} active Tor flows)")
+            if record is None:
+                continue
+            timestamp = record.timestamp
+            if sweep_interval is not None:
+                # Every packet advances the sweep clock, Tor or not
+                if self._next_sweep is None:
+                    self._next_sweep = timestamp + sweep_interval
+                elif timestamp >= self._next_sweep:
+                    self.expire(timestamp)
+                    self._next_sweep = timestamp + sweep_interval
+            src_ip = record.src_ip
+            dst_ip = record.dst_ip
+            side = next(sides)
+            if side == 1:
+                tor_ip = dst_ip
+                direction = 'outgoing'
+            elif side == -1:
+                tor_ip = src_ip
+                direction = 'incoming'
+            else:
+                self.non_tor_packets += 1
+                continue
+            self.tor_packets += 1
+            flow_id = flow_key(src_ip, record.src_port, dst_ip, record.dst_port)
+            flow = flows.get(flow_id)
+            if sweep_interval is not None and flow is not None and self._expired(flow, timestamp):
+                self._emit([(flow_id, flows.pop(flow_id))])
+                flow = None
+            if flow is None:
+                flow = flows[flow_id] = analyzer._new_flow(
+                    src_ip, dst_ip, record.src_port, record.dst_port, tor_ip, direction)
+                if keep_entropies:
+                    flow['payload_entropies'] = []
+                if len(flows) > self.peak_active_flows:
+                    self.peak_active_flows = len(flows)
+            elif src_ip == flow['src_ip'] and record.src_port == flow['src_port']:
+                direction = flow['direction']
+            else:
+                # Reply to the flow's first packet: heads the opposite way
+                direction = 'incoming' if flow['direction'] == 'outgoing' else 'outgoing'
+            analyzer._update_flow(
+                flow,
+                timestamp=timestamp,
+                packet_size=record.length,
+                direction=1 if direction == 'outgoing' else -1,
+                tcp_flags=record.tcp_flags,
+                entropy=next(entropies) if record.payload else None
+            )
+            if on_packet is not None:
+                on_packet(flow_id, flow, timestamp, record.length)
+
+    def expire(self, now):
+        """
+        Finalize and emit every flow that has expired at capture time now.
+
+        Returns:
+            int: Number of flows emitted
+        """
+        expired = [flow_id for flow_id, flow in self.flows.items() if self._expired(flow, now)]
+        self._emit([(flow_id, self.flows.pop(flow_id)) for flow_id in expired])
+        return len(expired)
+
+    def flush(self):
+        """Finalize and emit all remaining flows (end of capture)."""
+        flows = self.flows
+        self.flows = {}
+        self._emit(list(flows.items()))
+
+    def state(self):
+        """
+        Snapshot of the table for a checkpoint: the active flow
+        accumulators (in arrival order) and the packet/flow counters. The
+        analyzer, on_flow and metrics are not included.
+
+        Returns:
+            dict: Picklable state for restore()
+        """
+        return {
+            'flows': self.flows,
+            'total_packets': self.total_packets,
+            'tor_packets': self.tor_packets,
+            'non_tor_packets': self.non_tor_packets,
+            'flows_emitted': self.flows_emitted,
+            'peak_active_flows': self.peak_active_flows,
+            'next_sweep': self._next_sweep,
+        }
+
+    def restore(self, state):
+        """Continue from a state() snapshot taken with the same timeouts."""
+        self.flows = state['flows']
+        self.total_packets = state['total_packets']
+        self.tor_packets = state['tor_packets']
+        self.non_tor_packets = state['non_tor_packets']
+        self.flows_emitted = state['flows_emitted']
+        self.peak_active_flows = state['peak_active_flows']
+        self._next_sweep = state['next_sweep']
+
+    def _stage(self, name):
+        """Time a block as a stage of the table's metrics (if any)."""
+        return self.metrics.stage(name) if self.metrics is not None else nullcontext()
+
+    def _expired(self, flow, now):
+        if self.idle_timeout is not None and now - flow['end_time'] > self.idle_timeout:
+            return True
+        return self.active_timeout is not None and now - flow['start_time'] > self.active_timeout
+
+    def _emit(self, items):
+        """Finalize (flow_id, flow) pairs as one batch and hand them to on_flow."""
+        if not items:
+            return
+        with self._stage('finalize'):
+            self.analyzer._finalize_flows([flow for _, flow in items])
+        self.flows_emitted += len(items)
+        if self.on_flow is not None:
+            for flow_id, flow in items:
+                self.on_flow(flow_id, flow)
@@ -6,23 +6,107 @@ Identifies and analyzes Tor traffic patterns from packet capture files.
 Correlates packets with known Tor relay database and extracts timing patterns.
 """
 
-from scapy.all import rdpcap, TCP, IP, wrpcap
-from scapy.packet import Raw
-import sqlite3
 from datetime import datetime
 import json
 import os
+import sys
+import time
 import logging
 import argparse
-import math
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+from flow_table import FlowTable, PacketSeries, flow_key
+from pcap_reader import (iter_packets, iter_raw_records, decode_records, read_pcap_columns, find_record_boundary, capture_compression,
+                         capture_format, capture_errors, PcapFormatError)
+from checkpoint import AnalysisCheckpoint, DEFAULT_CHECKPOINT_INTERVAL
+from entropy import payload_entropy, buffer_entropies
+from timing_features import (DEFAULT_BURST_THRESHOLD_MS, concat_flow_timestamps, burst_features,
+                             sweep_burst_thresholds, ipt_features, segment_sums)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from relay_index import load_relay_index
+from flow_columns import write_flow_columns, PATTERN_SEQUENCE_LENGTH
+from perf_metrics import StageMetrics, write_prometheus
+from pattern_store import PatternStore
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+TCP_FLAG_BITS = {'F': 0x01, 'S': 0x02, 'R': 0x04, 'P': 0x08, 'A': 0x10, 'U': 0x20}
+FLAG_COUNTERS = (('S', 'syn_count'), ('A', 'ack_count'), ('F', 'fin_count'), ('R', 'rst_count'))
+
+MIN_SHARD_BYTES = 8 * 1024 * 1024  # Smallest byte range worth a worker process
+INGEST_BATCH = 4096  # Packets decoded per timed batch when streaming a capture
+# Additive flow counters combined when stitching shards
+SHARD_SUMMED_FIELDS = ('total_bytes', 'packet_count', 'outgoing_packet_count', 'incoming_packet_count',
+                       'outgoing_bytes', 'incoming_bytes', 'syn_count', 'ack_count', 'fin_count',
+                       'rst_count', 'payload_packet_count')
+
+# Per-flow feature columns, in the order the ML pipeline expects them
+FEATURE_KEYS = [
+    'src_ip', 'dst_ip', 'src_port', 'dst_port', 'direction',
+    'packet_count', 'total_bytes', 'start_time', 'end_time',
+    'burst_count', 'avg_burst_duration', 'max_burst_len',
+    'outgoing_packet_count', 'incoming_packet_count',
+    'outgoing_bytes', 'incoming_bytes',
+    'avg_payload_entropy', 'syn_count', 'ack_count', 'fin_count', 'rst_count',
+    'packet_size_entropy'
+]
+
+# Features added by _finalize_flow, in the order it adds them
+FINALIZED_FIELDS = ('burst_count', 'avg_burst_duration', 'max_burst_len',
+                    'avg_payload_entropy', 'packet_size_entropy')
+
+# Columnar output: FEATURE_KEYS plus relay attributes; dtypes not listed are int64
+RELAY_COLUMNS = ('tor_relay_ip', 'relay_nickname', 'is_guard', 'is_exit')
+COLUMN_DTYPES = {
+    'src_ip': 'U', 'dst_ip': 'U', 'direction': 'U', 'tor_relay_ip': 'U', 'relay_nickname': 'U',
+    'src_port': 'u2', 'dst_port': 'u2', 'start_time': 'f8', 'end_time': 'f8',
+    'avg_burst_duration': 'f8', 'avg_payload_entropy': 'f8', 'packet_size_entropy': 'f8',
+    'is_guard': '?', 'is_exit': '?',
+}
+
+RELAY_FIELDS = ('fingerprint', 'nickname', 'is_guard', 'is_exit')
+# Relay attributes for addresses matched only through a --tor-subnet range
+SUBNET_RELAY = {'fingerprint': None, 'nickname': 'Unknown', 'is_guard': False, 'is_exit': False}
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB (None if unknown)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+        mem = psutil.Process().memory_info()
+        return getattr(mem, 'peak_wset', mem.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+_shard_analyzer = None
+
+
+def _init_shard_worker(db_path, options):
+    """ProcessPoolExecutor initializer: build one analyzer per worker process."""
+    global _shard_analyzer
+    _shard_analyzer = TorTrafficAnalyzer(db_path, **options)
+
+
+def _analyze_shard(pcap_file, start, stop):
+    return _shard_analyzer._analyze_shard(pcap_file, start, stop)
+
+
 class TorTrafficAnalyzer:
     """
     PCAP traffic analyzer for Tor network connections.
@@ -31,228 +115,717 @@ class TorTrafficAnalyzer:
     and flow characteristics for downstream correlation analysis.
     """
 
-    def __init__(self, db_path='data/tor_relays.db'):
+    def __init__(self, db_path='data/tor_relays.db', subnets=None, match_or_port=False,
+                 burst_threshold_ms=DEFAULT_BURST_THRESHOLD_MS, payload_sample_bytes=None):
+        """
+        Args:
+            db_path: Path to Tor relay database
+            subnets: Optional CIDR strings whose addresses count as Tor relays
+            match_or_port: Only match relay addresses on their OR port
+            burst_threshold_ms: Inter-packet gap that ends a burst
+            payload_sample_bytes: Compute payload entropy over at most this
+                many leading bytes per packet (None for whole payloads)
+        """
         self.db_path = db_path
-        self.tor_relays = self.load_tor_relays()
+        self.subnets = subnets
+        self.match_or_port = match_or_port
+        self.burst_threshold_ms = burst_threshold_ms
+        self.payload_sample_bytes = payload_sample_bytes
+        self.relay_index = load_relay_index(db_path, subnets=subnets, match_or_port=match_or_port)
+        self.tor_relays = {
+            address: {field: record[field] for field in RELAY_FIELDS}
+            for address, record in self.relay_index.relays.items()
+        }
         logger.info(f"Loaded {len(self.tor_relays)} Tor relays from database")
 
-    def load_tor_relays(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT address, fingerprint, nickname, is_guard, is_exit FROM relays')
-        relays = {}
-        for row in cursor.fetchall():
-            relays[row[0]] = {
-                'fingerprint': row[1],
-                'nickname': row[2],
-                'is_guard': bool(row[3]),
-                'is_exit': bool(row[4])
-            }
-        conn.close()
-        return relays
-
-    def analyze_pcap(self, pcap_file):
+    def _options(self):
+        """Constructor options, for building identical analyzers in workers."""
+        return {
+            'subnets': self.subnets,
+            'match_or_port': self.match_or_port,
+            'burst_threshold_ms': self.burst_threshold_ms,
+            'payload_sample_bytes': self.payload_sample_bytes,
+        }
+
+    def analyze_pcap(self, pcap_file, decoder='fast', workers=1,
+                     idle_timeout=None, active_timeout=None, on_flow=None,
+                     checkpoint=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        Analyze a capture and build Tor flow records.
+
+        With the 'fast' and 'scapy' decoders packets are streamed one at a
+        time through a FlowTable, so memory holds per-flow state instead of
+        the whole capture, and every per-flow counter is updated as its
+        packet arrives. The 'columnar' decoder memory-maps a classic pcap,
+        decodes all headers into arrays and derives the same flows with
+        array operations. Ingestion throughput and peak RSS are returned
+        under 'ingest_stats', and per-stage wall/CPU times, counters and
+        rates (see perf_metrics.StageMetrics) under 'metrics'.
+
+        With idle/active timeouts, flows are finalized as soon as they
+        expire (a later packet on the same connection starts a new flow).
+        If on_flow is given, each finalized flow is passed to it instead of
+        being kept in the results, so memory stays bounded by the number of
+        concurrent flows.
+
+        With a checkpoint path, the streaming analysis saves its position,
+        flow table and finalized flows every checkpoint_interval seconds and
+        resumes from a matching checkpoint left by an interrupted run; the
+        flows are identical to an uninterrupted run. The checkpoint is
+        removed once the analysis completes. Flows already passed to on_flow
+        after the last checkpoint are passed again on resume.
+
+        Args:
+            pcap_file: Path to the capture file
+            decoder: 'fast' to decode headers directly from the record bytes
+                (Scapy is still used for unusual link types),
+                'scapy' for full Scapy dissection of every packet, or
+                'columnar' for vectorized batch analysis of classic pcap
+            workers: Worker processes for the fast decoder; large classic
+                pcaps are split into byte-range shards analyzed in parallel
+            idle_timeout: Seconds of capture time without packets after
+                which a flow is finalized
+            active_timeout: Maximum seconds of capture time a flow stays open
+            on_flow: Callback receiving (flow_id, flow) for each finalized flow
+            checkpoint: Checkpoint file path (enables checkpoint/resume)
+            checkpoint_interval: Seconds between checkpoints
+        """
         logger.info(f"Analyzing PCAP file: {pcap_file}")
         if not os.path.exists(pcap_file):
             logger.error(f"File not found: {pcap_file}")
             return None
+        ingest_start = time.perf_counter()
+        metrics = StageMetrics()
+
+        streaming = (idle_timeout is not None or active_timeout is not None or on_flow is not None or
+                     checkpoint is not None)
+        if streaming and (workers > 1 or decoder == 'columnar'):
+            logger.info("Flow timeouts, on_flow and checkpoints use the streaming analyzer in a single process")
+            decoder = 'fast' if decoder == 'columnar' else decoder
+            workers = 1
+
         try:
-            packets = rdpcap(pcap_file)
-            logger.info(f"Loaded {len(packets)} packets")
-        except Exception as e:
+            analyzed = None
+            shards = 1
+            peak_active_flows = None
+            if workers > 1 and decoder == 'fast':
+                sharded = self._analyze_sharded(pcap_file, workers, metrics)
+                if sharded is not None:
+                    analyzed, shards = sharded[:3], sharded[3]
+            elif workers > 1:
+                logger.info(f"The {decoder} decoder runs in a single process")
+            if decoder == 'columnar':
+                try:
+                    analyzed = self._analyze_columns(pcap_file, metrics)
+                except PcapFormatError as e:
+                    logger.info(f"Columnar decoder unavailable ({e}), using the fast decoder")
+                    decoder = 'fast'
+            if analyzed is None:
+                flows = []
+                table = FlowTable(self, idle_timeout=idle_timeout, active_timeout=active_timeout,
+                                  on_flow=on_flow or (lambda flow_id, flow: flows.append(flow)),
+                                  metrics=metrics)
+                checkpointer = cursor = None
+                start = None
+                skip = 0
+                if checkpoint is not None:
+                    checkpointer = AnalysisCheckpoint(
+                        checkpoint, pcap_file, interval=checkpoint_interval,
+                        settings={'decoder': decoder, 'idle_timeout': idle_timeout,
+                                  'active_timeout': active_timeout, 'options': self._options()})
+                    if decoder == 'fast' and self._seekable(pcap_file):
+                        cursor = [None]
+                    resumed = checkpointer.load()
+                    if resumed is None:
+                        checkpointer.remove()
+                    else:
+                        table.restore(resumed['table'])
+                        flows.extend(resumed['flows'])
+                        if resumed['offset'] is not None and cursor is not None:
+                            start = cursor[0] = resumed['offset']
+                        else:
+                            skip = resumed['packets']
+                        logger.info(f"Resuming from checkpoint at packet {resumed['packets']} "
+                                    f"({len(table)} active flows, {len(flows)} finalized)")
+                batches = self._packet_batches(pcap_file, decoder, metrics, start=start, skip=skip, cursor=cursor)
+                for batch in batches:
+                    with metrics.stage('flow_table'):
+                        table.consume(batch)
+                    if checkpointer is not None and checkpointer.due():
+                        with metrics.stage('checkpoint'):
+                            checkpointer.save(table, flows, cursor[0] if cursor is not None else None)
+                table.flush()
+                if checkpointer is not None:
+                    checkpointer.remove()
+                flow_count, total_packets, non_tor_packets = \
+                    table.flows_emitted, table.total_packets, table.non_tor_packets
+                tor_packets = table.tor_packets
+                peak_active_flows = table.peak_active_flows
+            else:
+                tor_flows, total_packets, non_tor_packets = analyzed
+                flows = list(tor_flows.values())
+                flow_count = len(flows)
+                tor_packets = sum(flow['packet_count'] for flow in flows)
+        except capture_errors() as e:
+            # Unreadable or malformed captures only; analysis errors propagate
             logger.error(f"Error reading PCAP: {e}")
             return None
-        tor_flows = {}
-        non_tor_packets = 0
-
-        for pkt in packets:
-            if IP in pkt and TCP in pkt:
-                src_ip = pkt[IP].src
-                dst_ip = pkt[IP].dst
-                src_port = pkt[TCP].sport
-                dst_port = pkt[TCP].dport
-                timestamp = float(pkt.time)
-                packet_size = len(pkt)
-                tor_ip = None
-                direction = None
-                if dst_ip in self.tor_relays:
-                    tor_ip = dst_ip
-                    direction = 'outgoing'
-                elif src_ip in self.tor_relays:
-                    tor_ip = src_ip
-                    direction = 'incoming'
-                else:
-                    non_tor_packets += 1
-                    continue
-                flow_id = f"{src_ip}:{src_port}->{dst_ip}:{dst_port}"
-                if flow_id not in tor_flows:
-                    tor_flows[flow_id] = {
-                        'src_ip': src_ip,
-                        'dst_ip': dst_ip,
-                        'src_port': src_port,
-                        'dst_port': dst_port,
-                        'tor_relay': self.tor_relays[tor_ip],
-                        'tor_relay_ip': tor_ip,
-                        'direction': direction,
-                        'packets': [],
-                        'packet_sizes': [],
-                        'start_time': timestamp,
-                        'end_time': timestamp,
-                        'total_bytes': 0,
-                        'packet_count': 0
-                    }
-                tor_flows[flow_id]['packets'].append({
-                    'timestamp': timestamp,
-                    'size': packet_size,
-                    'direction': 1 if direction == 'outgoing' else -1
-                })
-                tor_flows[flow_id]['packet_sizes'].append(packet_size)
-                tor_flows[flow_id]['end_time'] = timestamp
-                tor_flows[flow_id]['total_bytes'] += packet_size
-                tor_flows[flow_id]['packet_count'] += 1
-
-        for flow_id, flow in tor_flows.items():
-            packets_in_flow = flow['packets']
-            bursts = self._detect_bursts(packets_in_flow)
-            flow['burst_count'] = len(bursts)
-            flow['avg_burst_duration'] = sum(b['duration'] for b in bursts) / len(bursts) if bursts else 0
-            flow['max_burst_len'] = max(b['length'] for b in bursts) if bursts else 0
-            out_pkts = [p for p in packets_in_flow if p['direction'] == 1]
-            in_pkts = [p for p in packets_in_flow if p['direction'] == -1]
-            flow['outgoing_packet_count'] = len(out_pkts)
-            flow['incoming_packet_count'] = len(in_pkts)
-            flow['outgoing_bytes'] = sum(p['size'] for p in out_pkts)
-            flow['incoming_bytes'] = sum(p['size'] for p in in_pkts)
-            entropies = []
-            for pkt in packets:
-                if IP in pkt and TCP in pkt:
-                    raw_payload = self._get_raw_payload(pkt)
-                    if raw_payload:
-                        entropies.append(self._shannon_entropy(raw_payload))
-            flow['avg_payload_entropy'] = sum(entropies) / len(entropies) if entropies else 0
-            syn_count = 0
-            ack_count = 0
-            fin_count = 0
-            rst_count = 0
-            for pkt in packets:
-                if IP in pkt and TCP in pkt:
-                    if self._has_flag(pkt, 'S'):
-                        syn_count += 1
-                    if self._has_flag(pkt, 'A'):
-                        ack_count += 1
-                    if self._has_flag(pkt, 'F'):
-                        fin_count += 1
-                    if self._has_flag(pkt, 'R'):
-                        rst_count += 1
-            flow['syn_count'] = syn_count
-            flow['ack_count'] = ack_count
-            flow['fin_count'] = fin_count
-            flow['rst_count'] = rst_count
 
-            # PACKET SIZE ENTROPY FEATURE (NEW)
-            flow['packet_size_entropy'] = self._packet_size_entropy(flow['packet_sizes'])
+        ingest_seconds = time.perf_counter() - ingest_start
 
+        rss = peak_rss_mb()
+        metrics.count('packets', total_packets)
+        metrics.count('tor_packets', tor_packets)
+        metrics.count('non_tor_packets', non_tor_packets)
+        metrics.count('flows', flow_count)
+        metrics.count('bytes_read', os.path.getsize(pcap_file))
+        metrics.gauge('peak_flow_table_size', peak_active_flows)
+        metrics.gauge('peak_rss_mb', round(rss, 1) if rss is not None else None)
+        metrics.gauge('shards', shards)
         results = {
             'pcap_file': pcap_file,
-            'total_packets': len(packets),
-            'tor_flows': len(tor_flows),
+            'total_packets': total_packets,
+            'tor_flows': flow_count,
             'non_tor_packets': non_tor_packets,
-            'flows': list(tor_flows.values())
+            'flows': flows,
+            'ingest_stats': {
+                'ingest_seconds': round(ingest_seconds, 3),
+                'packets_per_sec': round(total_packets / ingest_seconds, 1) if ingest_seconds > 0 else 0.0,
+                'peak_rss_mb': round(rss, 1) if rss is not None else None,
+                'shards': shards,
+                'peak_active_flows': peak_active_flows
+            },
+            'metrics': metrics.to_dict()
         }
 
-        logger.info(f"Analysis complete: {len(tor_flows)} Tor flows detected")
-        self._print_summary(results, tor_flows)
+        logger.info(f"Analysis complete: {flow_count} Tor flows detected")
+        self._print_summary(results)
         return results
 
+    def _packet_batches(self, pcap_file, decoder, metrics, start=None, skip=0, cursor=None):
+        """
+        Read and decode a capture in batches of INGEST_BATCH PacketRecords.
+
+        With the fast decoder, reading records (file I/O and decompression)
+        is timed as the 'read' stage and header decoding as 'decode'. Scapy
+        does both at once, so its batches are timed as 'decode' alone.
+
+        Yields:
+            list: PacketRecord/None per packet
+        """
+        records = iter_raw_records(pcap_file, start=start, skip=skip, cursor=cursor) if decoder == 'fast' else None
+        if records is None:
+            packets = iter_packets(pcap_file, decoder='scapy', skip=skip)
+            yield from metrics.timed_batches('decode', packets, INGEST_BATCH)
+            return
+        l2_classes = {}
+        for raw in metrics.timed_batches('read', records, INGEST_BATCH):
+            with metrics.stage('decode'):
+                batch = decode_records(raw, l2_classes)
+            yield batch
+
+    def _analyze_sharded(self, pcap_file, workers, metrics):
+        """
+        Analyze a classic pcap in parallel byte-range shards.
+
+        The file is cut into record-aligned ranges, each worker process
+        builds partial flow accumulators for its range, and the partials are
+        stitched in file order before features (including bursts across the
+        seams) are computed, so the output is identical to serial analysis.
+
+        Args:
+            pcap_file: Path to the capture file
+            workers: Maximum number of worker processes
+            metrics: StageMetrics receiving the 'shards' (worker CPU
+                included) and 'merge' stage times
+
+        Returns:
+            tuple: (flows by flow id, total packets, non-Tor packets, shards), or
+            None when the capture can't be sharded (pcapng, compressed, too small, or a shard boundary guess was wrong)
+        """
+        size = os.path.getsize(pcap_file)
+        shards = min(workers, (size - 24) // MIN_SHARD_BYTES)
+        if shards < 2:
+            return None
+        try:
+            cuts = [24]
+            for i in range(1, shards):
+                boundary = find_record_boundary(pcap_file, 24 + (size - 24) * i // shards)
+                if cuts[-1] < boundary < size:
+                    cuts.append(boundary)
+            ranges = list(zip(cuts, cuts[1:] + [None]))
+            if len(ranges) < 2:
+                return None
+            with metrics.stage('shards', children=True), \
+                    ProcessPoolExecutor(max_workers=len(ranges), initializer=_init_shard_worker,
+                                        initargs=(self.db_path, self._options())) as pool:
+                futures = [pool.submit(_analyze_shard, pcap_file, start, stop)
+                           for start, stop in ranges]
+                partials = [future.result() for future in futures]
+        except PcapFormatError as e:
+            logger.info(f"Capture can't be sharded ({e}), analyzing serially")
+            return None
+        logger.info(f"Analyzed {len(ranges)} shards in parallel")
+
+        with metrics.stage('merge'):
+            tor_flows = self._merge_shard_flows(part[0] for part in partials)
+        total_packets = sum(part[1] for part in partials)
+        non_tor_packets = sum(part[2] for part in partials)
+        return tor_flows, total_packets, non_tor_packets, len(ranges)
+
+    def _analyze_shard(self, pcap_file, start, stop):
+        """
+        Build partial flows for one byte range (runs in a worker process).
+
+        Each flow also carries the features computed from this shard alone,
+        which are final unless the flow continues into another shard.
+
+        Returns:
+            tuple: (partial flows by flow id, total packets, non-Tor packets)
+        """
+        table = FlowTable(self)
+        table.consume(iter_packets(pcap_file, start=start, stop=stop), keep_entropies=True)
+        tor_flows = table.flows
+        finalized = self._finalize_flows([dict(flow) for flow in tor_flows.values()])
+        for flow, features in zip(tor_flows.values(), finalized):
+            flow['shard_features'] = {key: features[key] for key in FINALIZED_FIELDS}
+        return tor_flows, table.total_packets, table.non_tor_packets
+
+    def _merge_shard_flows(self, shard_flows):
+        """
+        Stitch partial flows from consecutive shards and finalize them.
+
+        Flows keep the order of their first packet in the file. Features of
+        flows seen in a single shard are taken from the worker; flows that
+        cross a seam are finalized again over their joined packets, with
+        payload entropies re-summed in packet order so every float matches
+        the serial result bit for bit.
+
+        Args:
+            shard_flows: Partial flow dicts from _analyze_shard, in file order
+
+        Returns:
+            dict: Finalized flows by flow id
+        """
+        merged = {}
+        for partial_flows in shard_flows:
+            for flow_id, part in partial_flows.items():
+                flow = merged.get(flow_id)
+                if flow is None:
+                    merged[flow_id] = part
+                    continue
+                flow['shard_features'] = None
+                if self._relay_endpoint(part) != self._relay_endpoint(flow):
+                    # Relay-to-relay connection whose shard part started from the other end
+                    part['packets'].flip_directions()
+                    for a, b in (('outgoing_packet_count', 'incoming_packet_count'),
+                                 ('outgoing_bytes', 'incoming_bytes')):
+                        part[a], part[b] = part[b], part[a]
+                flow['packets'].extend(part['packets'])
+                flow['payload_entropies'].extend(part['payload_entropies'])
+                flow['end_time'] = part['end_time']
+                for key in SHARD_SUMMED_FIELDS:
+                    flow[key] += part[key]
+
+        tor_flows = {}
+        stitched = []
+        for flow_id, part in merged.items():
+            flow = self._new_flow(part['src_ip'], part['dst_ip'], part['src_port'], part['dst_port'],
+                                  part['tor_relay_ip'], part['direction'])
+            flow['packets'] = part['packets']
+            flow['packet_sizes'] = part['packets'].sizes
+            flow['start_time'] = part['start_time']
+            flow['end_time'] = part['end_time']
+            for key in SHARD_SUMMED_FIELDS:
+                flow[key] = part[key]
+            if part['shard_features'] is not None:
+                del flow['payload_entropy_sum'], flow['payload_packet_count']
+                flow.update(part['shard_features'])
+            else:
+                entropy_sum = 0.0
+                for entropy in part['payload_entropies']:
+                    entropy_sum += entropy
+                flow['payload_entropy_sum'] = entropy_sum
+                stitched.append(flow)
+            tor_flows[flow_id] = flow
+        self._finalize_flows(stitched)
+        return tor_flows
+
+    @staticmethod
+    def _seekable(pcap_file):
+        """True if analysis can resume at a byte offset (uncompressed classic pcap)."""
+        try:
+            return capture_compression(pcap_file) is None and capture_format(pcap_file) == 'pcap'
+        except (OSError, PcapFormatError):
+            return False
+
+    @staticmethod
+    def _relay_endpoint(flow):
+        """(address, port) of the side of a flow that is the Tor relay."""
+        if flow['direction'] == 'outgoing':
+            return flow['dst_ip'], flow['dst_port']
+        return flow['src_ip'], flow['src_port']
+
+    def _analyze_columns(self, pcap_file, metrics):
+        """
+        Vectorized flow analysis over a memory-mapped classic pcap.
+
+        Packets are classified in bulk against the relay index,
+        grouped by flow key with a stable sort, and burst, byte and flag
+        statistics come from np.diff / np.add.reduceat over flow segments.
+        The flows are identical to those of the streaming decoders.
+
+        Args:
+            pcap_file: Path to a classic pcap
+            metrics: StageMetrics receiving one stage per step (decode,
+                relay_match, flow_grouping, bursts, entropy, flow_build)
+
+        Returns:
+            tuple: (finalized flows by flow id, total packets, non-Tor packets)
+        """
+        with metrics.stage('decode'):
+            cols = read_pcap_columns(pcap_file)
+        with cols:
+            packets = cols.packets
+            total_packets = len(packets)
+            with metrics.stage('relay_match'):
+                tcp_rows = np.flatnonzero(packets['ip_version'] != 0)
+                tcp = packets[tcp_rows]
+
+                is_v4 = tcp['ip_version'] == 4
+                index = self.relay_index
+                dst_relay = is_v4 & index.match_ipv4(tcp['dst'], tcp['dport'])
+                src_relay = is_v4 & index.match_ipv4(tcp['src'], tcp['sport'])
+                v6 = np.flatnonzero(~is_v4)
+                if len(v6):
+                    # Each distinct IPv6 endpoint is looked up once, by address table index and port
+                    ends = np.concatenate((tcp['dst'][v6].astype(np.uint64) << np.uint64(16) | tcp['dport'][v6],
+                                           tcp['src'][v6].astype(np.uint64) << np.uint64(16) | tcp['sport'][v6]))
+                    unique_ends, inverse = np.unique(ends, return_inverse=True)
+                    addresses = [cols.address(value, 6) for value in (unique_ends >> np.uint64(16)).tolist()]
+                    hit = index.match_addresses(addresses, (unique_ends & np.uint64(0xFFFF)).tolist())
+                    dst_relay[v6], src_relay[v6] = hit[inverse.ravel()].reshape(2, -1)
+                is_tor = dst_relay | src_relay
+                non_tor_packets = int(np.count_nonzero(~is_tor))
+                rows = tcp_rows[is_tor]
+                tor = tcp[is_tor]
+                outgoing = dst_relay[is_tor]
+                if len(tor) == 0:
+                    return {}, total_packets, non_tor_packets
+
+            with metrics.stage('flow_grouping'):
+                # Group packets by connection (endpoints in either order), flows in
+                # order of first packet
+                src_end = (tor['src'].astype(np.uint64) << np.uint64(16)) | tor['sport']
+                dst_end = (tor['dst'].astype(np.uint64) << np.uint64(16)) | tor['dport']
+                key = np.zeros(len(tor), dtype=[('v', 'u1'), ('lo', 'u8'), ('hi', 'u8')])
+                key['v'] = tor['ip_version']
+                key['lo'] = np.minimum(src_end, dst_end)
+                key['hi'] = np.maximum(src_end, dst_end)
+                _, first_index, inverse = np.unique(key, return_index=True, return_inverse=True)
+                rank = np.empty(len(first_index), dtype=np.int64)
+                rank[np.argsort(first_index, kind='stable')] = np.arange(len(first_index))
+                flow_of_packet = rank[inverse.ravel()]
+                order = np.argsort(flow_of_packet, kind='stable')
+                flow_sorted = flow_of_packet[order]
+                starts = np.flatnonzero(np.r_[True, flow_sorted[1:] != flow_sorted[:-1]])
+                ends = np.r_[starts[1:], len(order)]
+
+                ts = tor['ts'][order]
+                sizes = tor['caplen'][order].astype(np.int64)
+                # Directions are relative to the relay side of each flow's first packet
+                src_sorted = src_end[order]
+                same_way = src_sorted == src_sorted[starts][flow_sorted]
+                out = same_way == outgoing[order][starts][flow_sorted]
+                flags = tor['flags'][order]
+                out_counts = np.add.reduceat(out.astype(np.int64), starts)
+                out_bytes = np.add.reduceat(np.where(out, sizes, 0), starts)
+                total_bytes = np.add.reduceat(sizes, starts)
+                flag_totals = {
+                    key_name: np.add.reduceat(((flags & TCP_FLAG_BITS[flag_char]) != 0).astype(np.int64), starts)
+                    for flag_char, key_name in FLAG_COUNTERS
+                }
+
+            with metrics.stage('bursts'):
+                bursts = burst_features(ts, starts, self.burst_threshold_ms)
+                burst_counts = bursts['burst_count'].tolist()
+                avg_burst_durations = bursts['avg_burst_duration'].tolist()
+                max_bursts = bursts['max_burst_len'].tolist()
+
+            with metrics.stage('entropy'):
+                # Payload entropy: mapped payloads histogrammed in bulk, then
+                # summed per flow in packet order
+                payload_len = tor['payload_len'][order]
+                scalar_payload = np.array([r in cols.payloads for r in rows[order].tolist()], dtype=bool) \
+                    if cols.payloads else np.zeros(len(order), dtype=bool)
+                has_payload = (payload_len > 0) | scalar_payload
+                mapped = has_payload & ~scalar_payload
+                entropies = np.zeros(len(order))
+                entropies[mapped] = buffer_entropies(cols.buffer, tor['payload_offset'][order][mapped],
+                                                     payload_len[mapped], self.payload_sample_bytes)
+                for i in np.flatnonzero(scalar_payload).tolist():
+                    entropies[i] = self._shannon_entropy(cols.payload(int(rows[order[i]])))
+                entropy_counts = np.bincount(flow_sorted[has_payload], minlength=len(starts))
+                entropy_offsets = np.r_[0, np.cumsum(entropy_counts)[:-1]]
+                entropy_sums = segment_sums(entropies[has_payload], entropy_offsets, entropy_counts).tolist()
+                entropy_counts = entropy_counts.tolist()
+
+            with metrics.stage('flow_build'):
+                ts_list = ts.tolist()
+                directions = np.where(out, 1, -1)
+                tor_flows = {}
+                for f in range(len(starts)):
+                    a, b = int(starts[f]), int(ends[f])
+                    head = tor[order[a]]
+                    src_ip = cols.address(head['src'], int(head['ip_version']))
+                    dst_ip = cols.address(head['dst'], int(head['ip_version']))
+                    src_port, dst_port = int(head['sport']), int(head['dport'])
+                    is_out = bool(out[a])
+                    flow = self._new_flow(src_ip, dst_ip, src_port, dst_port,
+                                          dst_ip if is_out else src_ip,
+                                          'outgoing' if is_out else 'incoming')
+                    flow['packets'] = PacketSeries.from_arrays(ts[a:b], sizes[a:b], directions[a:b])
+                    flow['packet_sizes'] = flow['packets'].sizes
+                    flow['start_time'] = ts_list[a]
+                    flow['end_time'] = ts_list[b - 1]
+                    flow['total_bytes'] = int(total_bytes[f])
+                    flow['packet_count'] = b - a
+                    flow['outgoing_packet_count'] = int(out_counts[f])
+                    flow['incoming_packet_count'] = b - a - int(out_counts[f])
+                    flow['outgoing_bytes'] = int(out_bytes[f])
+                    flow['incoming_bytes'] = int(total_bytes[f] - out_bytes[f])
+                    for _, key_name in FLAG_COUNTERS:
+                        flow[key_name] = int(flag_totals[key_name][f])
+                    del flow['payload_entropy_sum'], flow['payload_packet_count']
+                    flow['burst_count'] = burst_counts[f]
+                    flow['avg_burst_duration'] = avg_burst_durations[f]
+                    flow['max_burst_len'] = max_bursts[f]
+                    flow['avg_payload_entropy'] = entropy_sums[f] / entropy_counts[f] if entropy_counts[f] else 0
+                    flow['packet_size_entropy'] = self._packet_size_entropy(flow['packet_sizes'])
+                    tor_flows[flow_key(src_ip, src_port, dst_ip, dst_port)] = flow
+            del head
+        return tor_flows, total_packets, non_tor_packets
+
+    def _new_flow(self, src_ip, dst_ip, src_port, dst_port, tor_ip, direction):
+        """
+        Create the per-flow accumulator for a newly seen connection.
+
+        The flow is oriented by its first packet: src/dst and 'direction'
+        describe that packet, and tor_ip is the relay side of the
+        connection. Packets are kept in a PacketSeries; 'packet_sizes' is
+        the same buffer as its sizes, not a second copy.
+        """
+        packets = PacketSeries()
+        return {
+            'src_ip': src_ip,
+            'dst_ip': dst_ip,
+            'src_port': src_port,
+            'dst_port': dst_port,
+            'tor_relay': self.tor_relays.get(tor_ip, SUBNET_RELAY),
+            'tor_relay_ip': tor_ip,
+            'direction': direction,
+            'packets': packets,
+            'packet_sizes': packets.sizes,
+            'start_time': None,
+            'end_time': None,
+            'total_bytes': 0,
+            'packet_count': 0,
+            'outgoing_packet_count': 0,
+            'incoming_packet_count': 0,
+            'outgoing_bytes': 0,
+            'incoming_bytes': 0,
+            'syn_count': 0,
+            'ack_count': 0,
+            'fin_count': 0,
+            'rst_count': 0,
+            'payload_entropy_sum': 0.0,
+            'payload_packet_count': 0
+        }
+
+    def _update_flow(self, flow, timestamp, packet_size, direction, tcp_flags, entropy):
+        """
+        Fold one packet into its flow's running counters.
+
+        Args:
+            flow: Flow accumulator from _new_flow
+            timestamp: Packet capture time (epoch seconds)
+            packet_size: Captured packet length in bytes
+            direction: 1 for packets sent to the relay, -1 for packets from it
+            tcp_flags: TCP flags field as an integer
+            entropy: Entropy of the TCP payload (None for an empty payload;
+                see _payload_entropies)
+        """
+        flow['packets'].append(timestamp, packet_size, direction)
+        if flow['start_time'] is None:
+            flow['start_time'] = timestamp
+        flow['end_time'] = timestamp
+        flow['total_bytes'] += packet_size
+        flow['packet_count'] += 1
+        if direction == 1:
+            flow['outgoing_packet_count'] += 1
+            flow['outgoing_bytes'] += packet_size
+        else:
+            flow['incoming_packet_count'] += 1
+            flow['incoming_bytes'] += packet_size
+        for flag_char, key in FLAG_COUNTERS:
+            if tcp_flags & TCP_FLAG_BITS[flag_char]:
+                flow[key] += 1
+        if entropy is not None:
+            flow['payload_entropy_sum'] += entropy
+            flow['payload_packet_count'] += 1
+            if 'payload_entropies' in flow:
+                flow['payload_entropies'].append(entropy)
+
+    def _finalize_flow(self, flow):
+        """Derive the per-flow features that need the complete packet list."""
+        self._finalize_flows([flow])
+        return flow
+
+    def _finalize_flows(self, flows):
+        """
+        Finalize a batch of flows, with burst features from one vectorized call.
+
+        Args:
+            flows: Flow dicts with their complete packet series
+
+        Returns:
+            list: The same flow dicts
+        """
+        timestamps, starts = concat_flow_timestamps([flow['packets'] for flow in flows])
+        bursts = burst_features(timestamps, starts, self.burst_threshold_ms)
+        for flow, count, duration, max_len in zip(flows, bursts['burst_count'].tolist(),
+                                                  bursts['avg_burst_duration'].tolist(),
+                                                  bursts['max_burst_len'].tolist()):
+            flow['burst_count'] = count
+            flow['avg_burst_duration'] = duration
+            flow['max_burst_len'] = max_len
+            entropy_sum = flow.pop('payload_entropy_sum')
+            payload_packets = flow.pop('payload_packet_count')
+            flow['avg_payload_entropy'] = entropy_sum / payload_packets if payload_packets else 0
+
+            # PACKET SIZE ENTROPY FEATURE (NEW)
+            flow['packet_size_entropy'] = self._packet_size_entropy(flow['packet_sizes'])
+        return flows
+
+    def timing_features(self, flows, thresholds_ms=None):
+        """
+        Batched timing features for feature research.
+
+        Computes inter-packet time statistics and burst statistics for
+        every burst threshold in one pass over the flows' packets.
+
+        Args:
+            flows: Flow dicts (e.g. results['flows'])
+            thresholds_ms: Burst thresholds to evaluate (default: the
+                analyzer's burst_threshold_ms)
+
+        Returns:
+            dict: 'ipt_mean', 'ipt_std', 'ipt_min', 'ipt_max' arrays (one
+                entry per flow) and 'bursts', mapping each threshold to
+                'burst_count', 'avg_burst_duration' and 'max_burst_len'
+                arrays
+        """
+        if thresholds_ms is None:
+            thresholds_ms = [self.burst_threshold_ms]
+        timestamps, starts = concat_flow_timestamps([flow['packets'] for flow in flows])
+        features = ipt_features(timestamps, starts)
+        features['bursts'] = sweep_burst_thresholds(timestamps, starts, thresholds_ms)
+        return features
+
     def _packet_size_entropy(self, packet_sizes):
         if len(packet_sizes) == 0:
             return 0.0
-        _, counts = np.unique(packet_sizes, return_counts=True)
+        _, counts = np.unique(np.asarray(packet_sizes), return_counts=True)
         probabilities = counts / len(packet_sizes)
         entropy = -np.sum(probabilities * np.log2(probabilities))
         return float(entropy)
 
-    def _detect_bursts(self, packets, threshold_ms=50):
-        bursts = []
-        if not packets:
-            return bursts
-        burst_start = packets[0]['timestamp']
-        last_pkt_time = burst_start
-        burst_len = 1
-        for pkt in packets[1:]:
-            if (pkt['timestamp'] - last_pkt_time) * 1000 <= threshold_ms:
-                burst_len += 1
-            else:
-                bursts.append({'start': burst_start, 'end': last_pkt_time, 'duration': last_pkt_time - burst_start, 'length': burst_len})
-                burst_start = pkt['timestamp']
-                burst_len = 1
-            last_pkt_time = pkt['timestamp']
-        bursts.append({'start': burst_start, 'end': last_pkt_time, 'duration': last_pkt_time - burst_start, 'length': burst_len})
-        return bursts
-
-    def _get_raw_payload(self, pkt):
-        try:
-            if Raw in pkt:
-                return bytes(pkt[Raw].load)
-        except Exception:
-            return None
-        return None
+    def _payload_entropies(self, payloads):
+        """
+        Entropies of a batch of non-empty payloads.
+
+        The payloads (cut to payload_sample_bytes) are joined into one
+        buffer and histogrammed with a single buffer_entropies call instead
+        of one bincount per packet.
+
+        Returns:
+            list: float entropy per payload
+        """
+        sample_bytes = self.payload_sample_bytes
+        if sample_bytes:
+            payloads = [payload[:sample_bytes] for payload in payloads]
+        lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=len(payloads))
+        offsets = np.cumsum(lengths) - lengths
+        return buffer_entropies(b''.join(payloads), offsets, lengths).tolist()
 
     def _shannon_entropy(self, data):
         if not data:
             return 0
-        from collections import Counter
-        counts = Counter(data)
-        entropy = 0
-        length = len(data)
-        for count in counts.values():
-            p = count / length
-            entropy -= p * math.log2(p)
-        return entropy
-
-    def _has_flag(self, pkt, flag_char):
-        try:
-            if TCP in pkt:
-                flags = pkt[TCP].flags
-                return flag_char.encode() in bytes(flags)
-        except Exception:
-            return False
-        return False
+        return payload_entropy(data, self.payload_sample_bytes)
 
-    def _print_summary(self, results, tor_flows):
+    def _print_summary(self, results):
         print("\nAnalysis Results:")
         print(f"  Total packets: {results['total_packets']}")
         print(f"  Tor flows detected: {results['tor_flows']}")
         print(f"  Non-Tor packets: {results['non_tor_packets']}")
-        if tor_flows:
+        stats = results.get('ingest_stats')
+        if stats:
+            rss = stats['peak_rss_mb']
+            print(f"  Throughput: {stats['packets_per_sec']:.0f} packets/sec "
+                  f"({stats['ingest_seconds']:.2f}s), "
+                  f"Peak RSS: {f'{rss:.1f} MB' if rss is not None else 'n/a'}")
+        metrics = results.get('metrics')
+        if metrics and metrics['stages']:
+            stages = ', '.join(f"{name} {entry['wall_seconds']:.2f}s"
+                               for name, entry in metrics['stages'].items())
+            print(f"  Stages: {stages} | Relay hit ratio: {metrics['relay_hit_ratio']:.2%}")
+        if results['flows']:
             print("\nDetected Tor Connections (showing first 10):")
-            for i, (flow_id, flow) in enumerate(list(tor_flows.items())[:10], 1):
+            for i, flow in enumerate(results['flows'][:10], 1):
                 relay_info = flow['tor_relay']
-                print(f"  {i}. {flow['src_ip']:15s} -> {flow['tor_relay_ip']:15s}")
+                # A flow is oriented by its first packet, which may come from the relay
+                client = flow['dst_ip'] if flow['direction'] == 'incoming' else flow['src_ip']
+                print(f"  {i}. {client:15s} -> {flow['tor_relay_ip']:15s}")
                 print(f"     Relay: {relay_info['nickname'][:20]:20s} | "
                       f"Guard: {relay_info['is_guard']} | Exit: {relay_info['is_exit']}")
                 print(f"     Packets: {flow['packet_count']}, Bytes: {flow['total_bytes']}, "
                       f"Duration: {flow['end_time'] - flow['start_time']:.3f}s")
 
-    def extract_timing_patterns(self, flow):
-        if not flow['packets']:
-            return None
+    def save_metrics(self, results, output_file):
+        """Write the run's metrics in Prometheus text format, labelled with the pcap."""
+        return write_prometheus(results['metrics'], output_file,
+                                labels={'pcap': os.path.basename(results['pcap_file'])})
+
+    def extract_timing_patterns(self, flow, sequence_length=PATTERN_SEQUENCE_LENGTH):
+        """
+        Build the timing pattern of a flow for the correlation and ML stages.
+
+        Args:
+            flow: Finalized flow dict
+            sequence_length: Packets kept in the IPT/size/direction
+                sequences (None for all of them)
+
+        Returns:
+            dict: Pattern, or None for a flow without packets
+        """
         packets = flow['packets']
-        ipt_times = []
-        for i in range(1, len(packets)):
-            ipt = packets[i]['timestamp'] - packets[i-1]['timestamp']
-            ipt_times.append(ipt)
-        sizes = [p['size'] for p in packets]
-        directions = [p['direction'] for p in packets]
+        if not packets:
+            return None
+        if sequence_length is None:
+            sequence_length = len(packets)
+        head = packets[:sequence_length]
+        ipt_times = np.diff(packets[:sequence_length + 1].timestamp_array()).tolist()
         pattern = {
             'flow_id': f"{flow['src_ip']}->{flow['dst_ip']}",
             'packet_count': len(packets),
+            'start_time': flow['start_time'],
+            'end_time': flow['end_time'],
             'duration': flow['end_time'] - flow['start_time'],
             'total_bytes': flow['total_bytes'],
-            'avg_packet_size': sum(sizes) / len(sizes) if sizes else 0,
-            'inter_packet_times': ipt_times[:100],
-            'packet_sizes': sizes[:100],
-            'directions': directions[:100],
+            'avg_packet_size': sum(packets.sizes) / len(packets),
+            'inter_packet_times': ipt_times,
+            'packet_sizes': head.sizes.tolist(),
+            'directions': head.directions.tolist(),
             'tor_relay': flow['tor_relay_ip'],
             'relay_nickname': flow['tor_relay']['nickname'],
             'is_guard': flow['tor_relay']['is_guard'],
@@ -260,10 +833,10 @@ class TorTrafficAnalyzer:
         }
         return pattern
 
-    def save_analysis(self, results, output_file):
+    def save_analysis(self, results, output_file, sequence_length=PATTERN_SEQUENCE_LENGTH):
         patterns = []
         for flow in results['flows']:
-            pattern = self.extract_timing_patterns(flow)
+            pattern = self.extract_timing_patterns(flow, sequence_length)
             if pattern:
                 patterns.append(pattern)
         output_data = {
@@ -271,6 +844,8 @@ class TorTrafficAnalyzer:
             'analysis_time': datetime.now().isoformat(),
             'total_packets': results['total_packets'],
             'tor_flows': results['tor_flows'],
+            'ingest_stats': results.get('ingest_stats'),
+            'metrics': results.get('metrics'),
             'timing_patterns': patterns
         }
         with open(output_file, 'w') as f:
@@ -279,6 +854,20 @@ class TorTrafficAnalyzer:
         print(f"\nResults saved to {output_file}")
         return output_data
     
+    def save_to_store(self, results, store_path, sequence_length=PATTERN_SEQUENCE_LENGTH):
+        """
+        Append the run's timing patterns to a persistent pattern store
+        (see utils/pattern_store.py) for cross-capture correlation.
+
+        Returns:
+            int: Patterns added
+        """
+        patterns = [self.extract_timing_patterns(flow, sequence_length) for flow in results['flows']]
+        with PatternStore(store_path) as store:
+            added = store.add_patterns([p for p in patterns if p], source=results['pcap_file'])
+        print(f"{added} timing patterns added to {store_path}")
+        return added
+    
     def save_features_to_csv(self, results, output_csv):
         """
         Save feature matrix (including packet_size_entropy) for all flows to CSV.
@@ -289,25 +878,86 @@ class TorTrafficAnalyzer:
             print(f"No flows to write in {output_csv}")
             return
 
-        # List ALL your desired feature keys here, matching your ML pipeline order
-        feature_keys = [
-            'src_ip', 'dst_ip', 'src_port', 'dst_port', 'direction',
-            'packet_count', 'total_bytes', 'start_time', 'end_time',
-            'burst_count', 'avg_burst_duration', 'max_burst_len',
-            'outgoing_packet_count', 'incoming_packet_count',
-            'outgoing_bytes', 'incoming_bytes',
-            'avg_payload_entropy', 'syn_count', 'ack_count', 'fin_count', 'rst_count',
-            'packet_size_entropy'
-        ]
-
         with open(output_csv, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=feature_keys)
+            writer = csv.DictWriter(f, fieldnames=FEATURE_KEYS)
             writer.writeheader()
             for flow in flows:
-                row = {k: flow.get(k, 0) for k in feature_keys}
+                row = {k: flow.get(k, 0) for k in FEATURE_KEYS}
                 writer.writerow(row)
         print(f"Features saved to {output_csv}")
 
+    def save_columns(self, results, output_dir):
+        """
+        Save flows as a memory-mappable columnar dataset (see utils/flow_columns.py).
+
+        Per-flow features and relay attributes become one .npy column each;
+        every flow's full packet timestamps, sizes and directions are stored
+        as flat arrays with offsets. The JSON timing patterns can be rebuilt
+        from the dataset with FlowColumns.timing_patterns().
+        """
+        flows = results['flows']
+        relay_values = {
+            'tor_relay_ip': lambda flow: flow['tor_relay_ip'],
+            'relay_nickname': lambda flow: flow['tor_relay']['nickname'],
+            'is_guard': lambda flow: flow['tor_relay']['is_guard'],
+            'is_exit': lambda flow: flow['tor_relay']['is_exit'],
+        }
+        columns = {}
+        for key in FEATURE_KEYS:
+            columns[key] = np.array([flow.get(key, 0) for flow in flows],
+                                    dtype=COLUMN_DTYPES.get(key, 'i8'))
+        for key in RELAY_COLUMNS:
+            columns[key] = np.array([relay_values[key](flow) for flow in flows],
+                                    dtype=COLUMN_DTYPES[key])
+
+        series = [flow['packets'] for flow in flows]
+        offsets = np.zeros(len(series) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in series], out=offsets[1:])
+        sequences = {
+            'timestamps': np.concatenate([s.timestamp_array() for s in series] or [np.zeros(0)]),
+            'sizes': np.concatenate([s.size_array() for s in series] or [np.zeros(0, dtype=np.int32)]),
+            'directions': np.concatenate([s.direction_array() for s in series]
+                                         or [np.zeros(0, dtype=np.int8)]),
+        }
+        meta = {
+            'pcap_file': results['pcap_file'],
+            'analysis_time': datetime.now().isoformat(),
+            'total_packets': results['total_packets'],
+            'tor_flows': results['tor_flows'],
+            'non_tor_packets': results['non_tor_packets'],
+            'ingest_stats': results.get('ingest_stats'),
+            'metrics': results.get('metrics'),
+        }
+        write_flow_columns(output_dir, columns, sequences, offsets, meta)
+        print(f"Columnar flows saved to {output_dir}")
+
+    def save_timing_features(self, results, output_csv, thresholds_ms):
+        """
+        Save IPT statistics and burst features for several thresholds to CSV.
+
+        One row per flow; burst columns are suffixed with their threshold,
+        e.g. burst_count_50ms.
+        """
+        import csv
+        flows = results['flows']
+        if not flows:
+            print(f"No flows to write in {output_csv}")
+            return
+
+        features = self.timing_features(flows, thresholds_ms)
+        ipt_keys = ['ipt_mean', 'ipt_std', 'ipt_min', 'ipt_max']
+        columns = {key: features[key].tolist() for key in ipt_keys}
+        for threshold, bursts in features['bursts'].items():
+            for key, values in bursts.items():
+                columns[f"{key}_{threshold:g}ms"] = values.tolist()
+        id_keys = ['src_ip', 'dst_ip', 'src_port', 'dst_port']
+        with open(output_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(id_keys + list(columns))
+            for i, flow in enumerate(flows):
+                writer.writerow([flow[k] for k in id_keys] + [values[i] for values in columns.values()])
+        print(f"Timing features saved to {output_csv}")
+
 
 def main():
     """Main execution routine."""
@@ -316,19 +966,68 @@ def main():
     print("=" * 70)
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('--pcap', required=True, help='Input PCAP file path')
+    parser.add_argument('--pcap', required=True, help='Input capture (pcap or pcapng, optionally .gz/.xz/.zst compressed)')
     parser.add_argument('--out', required=True, help='Output JSON analysis file path')
     parser.add_argument('--db', default='data/tor_relays.db', help='Path to Tor relay database')
+    parser.add_argument('--decoder', choices=['fast', 'scapy', 'columnar'], default='fast',
+                        help='Packet decoder: struct fast path (default), full Scapy dissection, '
+                             'or memory-mapped columnar batch analysis')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for parallel analysis of large captures (fast decoder)')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='Finalize a flow after this many seconds without packets')
+    parser.add_argument('--active-timeout', type=float, default=None,
+                        help='Finalize a flow once it has been open this many seconds')
+    parser.add_argument('--tor-subnet', action='append', default=[], metavar='CIDR',
+                        help='Treat every address in this subnet as a Tor relay (repeatable)')
+    parser.add_argument('--match-or-port', action='store_true',
+                        help="Only match relay addresses on the relay's OR port")
+    parser.add_argument('--format', choices=['json', 'columnar', 'both'], default='json',
+                        help='Output JSON + CSV (default), a columnar .npy dataset '
+                             '(<out>.flows directory), or both')
+    parser.add_argument('--sequence-length', type=int, default=PATTERN_SEQUENCE_LENGTH,
+                        help='Packets per timing-pattern sequence in the JSON output (0 for all)')
+    parser.add_argument('--entropy-bytes', type=int, default=None, metavar='K',
+                        help='Compute payload entropy from the first K bytes of each packet')
+    parser.add_argument('--burst-threshold', type=float, default=DEFAULT_BURST_THRESHOLD_MS,
+                        help='Inter-packet gap in ms that ends a burst')
+    parser.add_argument('--burst-sweep', type=float, nargs='+', metavar='MS',
+                        help='Also write IPT and burst features for each threshold to <out>_timing.csv')
+    parser.add_argument('--metrics-out', metavar='FILE',
+                        help='Also write per-stage timers and counters in Prometheus text format')
+    parser.add_argument('--store', metavar='DB',
+                        help='Also append the timing patterns to a persistent pattern store')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='Periodically checkpoint the analysis to FILE and resume from it if present')
+    parser.add_argument('--checkpoint-interval', type=float, default=DEFAULT_CHECKPOINT_INTERVAL,
+                        metavar='SEC', help='Seconds between checkpoints')
     args = parser.parse_args()
 
-    analyzer = TorTrafficAnalyzer(db_path=args.db)
+    analyzer = TorTrafficAnalyzer(db_path=args.db, subnets=args.tor_subnet,
+                                  match_or_port=args.match_or_port,
+                                  burst_threshold_ms=args.burst_threshold,
+                                  payload_sample_bytes=args.entropy_bytes)
 
     if os.path.exists(args.pcap):
-        results = analyzer.analyze_pcap(args.pcap)
+        results = analyzer.analyze_pcap(args.pcap, decoder=args.decoder, workers=args.workers,
+                                        idle_timeout=args.idle_timeout,
+                                        active_timeout=args.active_timeout,
+                                        checkpoint=args.checkpoint,
+                                        checkpoint_interval=args.checkpoint_interval)
         if results:
             # CRITICAL FIX: Always save results, even if 0 Tor flows
-            analyzer.save_analysis(results, args.out)
-            analyzer.save_features_to_csv(results, args.out.replace('.json', '.csv'))
+            if args.format in ('json', 'both'):
+                analyzer.save_analysis(results, args.out, args.sequence_length or None)
+                analyzer.save_features_to_csv(results, args.out.replace('.json', '.csv'))
+            if args.format in ('columnar', 'both'):
+                analyzer.save_columns(results, os.path.splitext(args.out)[0] + '.flows')
+            if args.burst_sweep:
+                analyzer.save_timing_features(results, args.out.replace('.json', '_timing.csv'),
+                                              args.burst_sweep)
+            if args.store:
+                analyzer.save_to_store(results, args.store, args.sequence_length or None)
+            if args.metrics_out:
+                analyzer.save_metrics(results, args.metrics_out)
         else:
             print(f"Error: Could not analyze PCAP file {args.pcap}")
     else:
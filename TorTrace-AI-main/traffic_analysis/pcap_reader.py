@@ -0,0 +1,1033 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Fast PCAP Packet Decoder
+
+Decodes the fields the traffic analyzer needs (addresses, TCP ports and
+flags, timestamp, length and payload) straight from pcap record bytes with
+struct, without building layered Scapy packets. Link types and frames the
+fast path does not understand are handed to Scapy so both decoders always
+produce the same records.
+
+Classic pcap and pcapng captures are both read as a stream of blocks, and
+gzip, xz and zstd compressed captures (e.g. archived .pcap.gz files) are
+decompressed on the fly without temporary files.
+"""
+
+from array import array
+from collections import namedtuple
+import contextlib
+from itertools import islice
+import gzip
+import io
+import lzma
+import mmap
+import os
+import socket
+import struct
+import logging
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PacketRecord = namedtuple('PacketRecord', [
+    'timestamp', 'length', 'src_ip', 'dst_ip',
+    'src_port', 'dst_port', 'tcp_flags', 'payload'
+])
+
+READ_CHUNK = 4 * 1024 * 1024  # Bytes read from disk per refill
+# Scapy's PcapReader cuts every record to its MTU; do the same so packet
+# lengths and payloads agree between the two decoders
+SCAPY_MTU = 65535
+# Record timestamps further than this from the first one (seconds) are
+# treated as noise when searching for a record boundary
+MAX_CAPTURE_SPAN = 366 * 24 * 3600
+
+# Classic pcap magic numbers -> (byte order, timestamp fraction units per second)
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1000000),
+    b'\xa1\xb2\xc3\xd4': ('>', 1000000),
+    b'\x4d\x3c\xb2\xa1': ('<', 1000000000),
+    b'\xa1\xb2\x3c\x4d': ('>', 1000000000),
+}
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDERS = {b'\x4d\x3c\x2b\x1a': '<', b'\x1a\x2b\x3c\x4d': '>'}
+# pcapng block types read by iter_pcapng_records (others are skipped)
+PCAPNG_SHB = 0x0A0D0D0A  # Section header
+PCAPNG_IDB = 1  # Interface description
+PCAPNG_OPB = 2  # (Obsolete) packet
+PCAPNG_SPB = 3  # Simple packet
+PCAPNG_EPB = 6  # Enhanced packet
+# Smallest valid total length of each block type read
+PCAPNG_MIN_BLOCK = {PCAPNG_IDB: 20, PCAPNG_OPB: 32, PCAPNG_SPB: 16, PCAPNG_EPB: 32}
+PCAPNG_OPT_TSRESOL = 9
+PCAPNG_OPT_TSOFFSET = 14
+
+# Compressed capture magic numbers -> compression name
+COMPRESSION_MAGICS = {
+    b'\x1f\x8b': 'gzip',
+    b'\xfd7zXZ\x00': 'xz',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+}
+# File name suffixes of captures the batch tools pick up
+CAPTURE_EXTENSIONS = ('.pcap', '.pcapng', '.cap')
+COMPRESSED_EXTENSIONS = ('.gz', '.xz', '.zst')
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+VLAN_ETHERTYPES = (0x8100, 0x88A8)
+# Ethertypes that never carry IP, so they can be rejected without Scapy
+NON_IP_ETHERTYPES = frozenset((0x0806, 0x8035, 0x88CC, 0x888E, 0x88F7))
+IPV6_EXT_HEADERS = (0, 43, 60)  # Hop-by-hop, routing, destination options
+IPV6_FRAGMENT = 44
+IPPROTO_TCP = 6
+
+_u16 = struct.Struct('!H').unpack_from
+_ipv4_hdr = struct.Struct('!BxHxxHxB').unpack_from
+_tcp_hdr = struct.Struct('!HH8xBB').unpack_from
+
+
+# Columnar layout produced by read_pcap_columns(). ip_version is 0 for packets
+# that are not TCP over IP. IPv4 addresses are stored as integers; for IPv6
+# rows src/dst index PacketColumns.ipv6_addresses instead.
+PACKET_COLUMNS_DTYPE = np.dtype([
+    ('ts', 'f8'), ('caplen', 'u4'), ('src', 'u4'), ('dst', 'u4'),
+    ('sport', 'u2'), ('dport', 'u2'), ('flags', 'u2'),
+    ('payload_offset', 'u8'), ('payload_len', 'u4'), ('ip_version', 'u1')
+])
+COLUMNAR_LINKTYPES = (LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL,
+                      LINKTYPE_IPV4, LINKTYPE_IPV6, LINKTYPE_LINUX_SLL2)
+
+
+class PcapFormatError(ValueError):
+    """Raised when a file is not a capture the fast decoder can read."""
+
+
+def capture_errors():
+    """
+    Exceptions raised when a capture can't be read: I/O, decompression
+    and format errors of the decoders (not bugs in the analysis itself).
+    """
+    from scapy.error import Scapy_Exception
+    return (OSError, EOFError, struct.error, zlib.error, lzma.LZMAError, PcapFormatError, Scapy_Exception)
+
+
+def read_pcap_header(f):
+    """
+    Parse the 24-byte global header of a classic pcap file.
+
+    Args:
+        f: Binary file object positioned at the start of the file
+
+    Returns:
+        tuple: (byte_order, ts_units_per_sec, snaplen, linktype)
+    """
+    header = f.read(24)
+    if len(header) < 24:
+        raise PcapFormatError("File too short for a pcap header")
+    magic = header[:4]
+    if magic == PCAPNG_MAGIC:
+        raise PcapFormatError("pcapng capture")
+    if magic not in PCAP_MAGICS:
+        raise PcapFormatError(f"Unknown pcap magic {magic.hex()}")
+    byte_order, ts_units = PCAP_MAGICS[magic]
+    snaplen, linktype = struct.unpack(byte_order + '16xII', header)
+    return byte_order, ts_units, snaplen, linktype & 0x0FFFFFFF
+
+
+def capture_compression(pcap_file):
+    """Compression of a capture file from its magic number ('gzip', 'xz', 'zstd' or None)."""
+    with open(pcap_file, 'rb') as f:
+        head = f.read(6)
+    for magic, name in COMPRESSION_MAGICS.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def _open_zstd(pcap_file):
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.open(pcap_file, 'rb')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(f"{pcap_file} is zstd-compressed; install the 'zstandard' package to read it")
+    reader = zstandard.ZstdDecompressor().stream_reader(open(pcap_file, 'rb'), closefd=True)
+    return io.BufferedReader(reader, READ_CHUNK)
+
+
+def open_capture(pcap_file):
+    """
+    Open a capture file for streaming reads.
+
+    gzip, xz and zstd files (recognized by magic number, not extension)
+    are decompressed incrementally as they are read.
+
+    Returns:
+        Binary file object positioned at the start of the capture data
+    """
+    compression = capture_compression(pcap_file)
+    if compression == 'gzip':
+        return gzip.open(pcap_file, 'rb')
+    if compression == 'xz':
+        return lzma.open(pcap_file, 'rb')
+    if compression == 'zstd':
+        return _open_zstd(pcap_file)
+    return open(pcap_file, 'rb')
+
+
+def capture_format(pcap_file):
+    """
+    Container format of a (possibly compressed) capture file.
+
+    Returns:
+        str: 'pcap' or 'pcapng'
+
+    Raises:
+        PcapFormatError: Neither a classic pcap nor a pcapng capture
+    """
+    with open_capture(pcap_file) as f:
+        magic = f.read(4)
+    if magic == PCAPNG_MAGIC:
+        return 'pcapng'
+    if magic in PCAP_MAGICS:
+        return 'pcap'
+    raise PcapFormatError(f"Unknown capture magic {magic.hex()}")
+
+
+def is_capture_file(file_name):
+    """True if a file name looks like a capture (optionally compressed)."""
+    name = file_name.lower()
+    for suffix in COMPRESSED_EXTENSIONS:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name.endswith(CAPTURE_EXTENSIONS)
+
+
+def capture_stem(file_name):
+    """Base name of a capture without its capture and compression extensions."""
+    name = os.path.basename(file_name)
+    lower = name.lower()
+    for suffix in COMPRESSED_EXTENSIONS:
+        if lower.endswith(suffix):
+            name, lower = name[:-len(suffix)], lower[:-len(suffix)]
+            break
+    for suffix in CAPTURE_EXTENSIONS:
+        if lower.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def iter_pcap_records(pcap_file, start=None, stop=None, cursor=None):
+    """
+    Yield raw records from a classic pcap file.
+
+    The file is read in large chunks and each record's data is returned as a
+    memoryview into the chunk, so packet bytes are never copied. Records
+    longer than SCAPY_MTU are cut to that length.
+
+    A binary file object (e.g. a tcpdump pipe) can be passed instead of a
+    path; it is read with read1() so records are yielded as soon as they
+    arrive.
+
+    Args:
+        pcap_file: Path to a classic (non-pcapng) pcap file, optionally
+            compressed (see open_capture), or a binary file object
+            positioned at its start
+        start: Byte offset of the first record to read (must be a record
+            boundary, e.g. from find_record_boundary)
+        stop: Stop at this offset; the record chain must end exactly on it
+        cursor: Optional one-element list; cursor[0] is set to the offset
+            just past each record before it is yielded (a resume point)
+
+    Yields:
+        tuple: (timestamp, linktype, data)
+    """
+    is_stream = hasattr(pcap_file, 'read')
+    with contextlib.nullcontext(pcap_file) if is_stream else open_capture(pcap_file) as f:
+        byte_order, ts_units, _, linktype = read_pcap_header(f)
+        record_hdr = struct.Struct(byte_order + 'IIII').unpack_from
+        read = getattr(f, 'read1', f.read)
+        if start is not None:
+            f.seek(start)
+        base = start if start is not None else 24  # File offset of buf[0]
+        limit = float('inf') if stop is None else stop
+        buf = b''
+        view = memoryview(buf)
+        pos = 0
+        while base + pos < limit:
+            if len(buf) - pos < 16:
+                more = read(READ_CHUNK)
+                if not more:
+                    break
+                base += pos
+                buf = buf[pos:] + more
+                view = memoryview(buf)
+                pos = 0
+                continue
+            sec, frac, caplen, _ = record_hdr(buf, pos)
+            end = pos + 16 + caplen
+            if base + end > limit:
+                break
+            if end > len(buf):
+                more = read(max(READ_CHUNK, caplen + 16))
+                if not more:
+                    logger.warning(f"Truncated final record in {getattr(f, 'name', pcap_file)}")
+                    break
+                base += pos
+                buf = buf[pos:] + more
+                view = memoryview(buf)
+                pos = 0
+                continue
+            if cursor is not None:
+                cursor[0] = base + end
+            # Integer true division is correctly rounded, matching Scapy's
+            # Decimal-based timestamps once they are converted to float
+            yield ((sec * ts_units + frac) / ts_units, linktype,
+                   view[pos + 16:min(end, pos + 16 + SCAPY_MTU)])
+            pos = end
+        if stop is not None and base + pos != stop:
+            raise PcapFormatError(f"Record chain ends at {base + pos}, not at shard boundary {stop}")
+
+
+def _pcapng_interface(block, endian, start, end):
+    """
+    Parse an Interface Description Block body.
+
+    Returns:
+        tuple: (linktype, snaplen, timestamp units per second, timestamp
+            offset in seconds)
+    """
+    linktype, snaplen = struct.unpack_from(endian + 'HxxI', block, start)
+    ts_units = 1000000
+    ts_offset = 0
+    pos = start + 8
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', block, pos)
+        if code == 0:
+            break
+        value = pos + 4
+        if code == PCAPNG_OPT_TSRESOL and length == 1:
+            # High bit set: negative power of 2, otherwise of 10
+            resolution = block[value]
+            ts_units = (2 if resolution & 0x80 else 10) ** (resolution & 0x7F)
+        elif code == PCAPNG_OPT_TSOFFSET and length == 8:
+            ts_offset = struct.unpack_from(endian + 'q', block, value)[0]
+        pos = value + length + (-length) % 4
+    return linktype, snaplen, ts_units, ts_offset
+
+
+def iter_pcapng_records(pcap_file):
+    """
+    Yield raw packet records from a pcapng capture.
+
+    Blocks are parsed from large chunks like iter_pcap_records, without
+    copying packet bytes. Every section may change byte order and defines
+    its own interfaces; each interface has its own link type, timestamp
+    resolution (if_tsresol) and offset (if_tsoffset). Simple Packet Blocks
+    carry no timestamp and take the previous packet's. Records longer than
+    SCAPY_MTU are cut to that length.
+
+    Args:
+        pcap_file: Path to a pcapng file, optionally compressed (see
+            open_capture), or a binary file object positioned at its start
+
+    Yields:
+        tuple: (timestamp, linktype, data)
+    """
+    is_stream = hasattr(pcap_file, 'read')
+    with contextlib.nullcontext(pcap_file) if is_stream else open_capture(pcap_file) as f:
+        read = getattr(f, 'read1', f.read)
+        buf = b''
+        view = memoryview(buf)
+        pos = 0
+        endian = None
+        interfaces = []
+        timestamp = 0.0
+        while True:
+            if len(buf) - pos < 12:
+                more = read(READ_CHUNK)
+                if not more:
+                    if pos < len(buf):
+                        logger.warning(f"Truncated final block in {getattr(f, 'name', pcap_file)}")
+                    break
+                buf = buf[pos:] + more
+                view = memoryview(buf)
+                pos = 0
+                continue
+            if buf[pos:pos + 4] == PCAPNG_MAGIC:
+                byte_order_magic = bytes(buf[pos + 8:pos + 12])
+                if byte_order_magic not in PCAPNG_BYTE_ORDERS:
+                    raise PcapFormatError("Bad pcapng section header byte-order magic")
+                endian = PCAPNG_BYTE_ORDERS[byte_order_magic]
+            elif endian is None:
+                raise PcapFormatError("pcapng capture does not start with a section header")
+            block_type, block_len = struct.unpack_from(endian + 'II', buf, pos)
+            if block_len < PCAPNG_MIN_BLOCK.get(block_type, 12) or block_len % 4:
+                raise PcapFormatError(f"Invalid pcapng block length {block_len}")
+            end = pos + block_len
+            if end > len(buf):
+                more = read(max(READ_CHUNK, block_len))
+                if not more:
+                    logger.warning(f"Truncated final block in {getattr(f, 'name', pcap_file)}")
+                    break
+                buf = buf[pos:] + more
+                view = memoryview(buf)
+                pos = 0
+                continue
+            body = pos + 8
+            data = None
+            if block_type == PCAPNG_EPB or block_type == PCAPNG_OPB:
+                if block_type == PCAPNG_EPB:
+                    interface, ts_high, ts_low, caplen = struct.unpack_from(endian + '4I', buf, body)
+                else:
+                    interface, ts_high, ts_low, caplen = struct.unpack_from(endian + 'H2x3I', buf, body)
+                if interface >= len(interfaces):
+                    raise PcapFormatError(f"pcapng packet on undeclared interface {interface}")
+                linktype, _, ts_units, ts_offset = interfaces[interface]
+                # Integer true division is correctly rounded, as for classic pcap
+                timestamp = (((ts_high << 32) | ts_low) + ts_offset * ts_units) / ts_units
+                data = view[body + 20:body + 20 + min(caplen, SCAPY_MTU, block_len - 32)]
+            elif block_type == PCAPNG_SPB:
+                if not interfaces:
+                    raise PcapFormatError("pcapng simple packet before any interface")
+                linktype, snaplen = interfaces[0][:2]
+                caplen = struct.unpack_from(endian + 'I', buf, body)[0]
+                if snaplen:
+                    caplen = min(caplen, snaplen)
+                data = view[body + 4:body + 4 + min(caplen, SCAPY_MTU, block_len - 16)]
+            elif block_type == PCAPNG_IDB:
+                interfaces.append(_pcapng_interface(buf, endian, body, end - 4))
+            elif block_type == PCAPNG_SHB:
+                interfaces = []
+            if data is not None:
+                yield timestamp, linktype, data
+            pos = end
+
+
+def find_record_boundary(pcap_file, offset, chain=8):
+    """
+    Find the first record boundary at or after a byte offset.
+
+    Candidate positions are accepted when a chain of consecutive record
+    headers starting there is plausible (timestamp within a year of the
+    first record, fraction below one second, caplen no larger than the
+    original length or the snaplen) and either reaches
+    the end of the file exactly or stays valid for `chain` records. This is
+    a heuristic: callers reading from the boundary should pass it as the
+    previous range's stop so a wrong guess is detected.
+
+    Args:
+        pcap_file: Path to a classic pcap file
+        offset: Byte offset to search from
+        chain: Number of consecutive headers that must validate
+
+    Returns:
+        int: Offset of a record header, or the file size if none is found
+    """
+    with open(pcap_file, 'rb') as f:
+        byte_order, ts_units, snaplen, _ = read_pcap_header(f)
+        size = f.seek(0, 2)
+        offset = max(offset, 24)
+        if offset >= size:
+            return size
+        max_caplen = max(snaplen, 262144)
+        f.seek(24)
+        first = f.read(16)
+        if len(first) < 16:
+            return size
+        first_sec = struct.unpack(byte_order + 'I', first[:4])[0]
+        # Search window: one maximal record plus the chain to validate
+        f.seek(offset)
+        window = f.read((max_caplen + 16) * (chain + 1))
+    record_hdr = struct.Struct(byte_order + 'IIII').unpack_from
+    for candidate in range(min(len(window), max_caplen + 16)):
+        pos = candidate
+        for _ in range(chain):
+            if offset + pos == size:
+                return offset + candidate
+            if pos + 16 > len(window):
+                break
+            sec, frac, caplen, origlen = record_hdr(window, pos)
+            if (abs(sec - first_sec) > MAX_CAPTURE_SPAN or frac >= ts_units or
+                    caplen > origlen or caplen > max_caplen):
+                break
+            pos += 16 + caplen
+            if offset + pos > size:
+                break
+        else:
+            return offset + candidate
+    return size
+
+
+def decode_ip(data, offset, version=None):
+    """
+    Decode an IPv4/IPv6 header and the TCP header carried directly inside it.
+
+    Args:
+        data: Packet bytes (bytes or memoryview)
+        offset: Offset of the IP header within data
+        version: Expected IP version, or None to read it from the header
+
+    Returns:
+        tuple: (src_ip, dst_ip, src_port, dst_port, tcp_flags, payload),
+            or None if the packet is not TCP over IP
+    """
+    end = len(data)
+    if end - offset < 1:
+        return None
+    if version is None:
+        version = data[offset] >> 4
+    if version == 4:
+        if end - offset < 20:
+            return None
+        ver_ihl, total_len, frag, proto = _ipv4_hdr(data, offset)
+        ihl = (ver_ihl & 0x0F) * 4
+        if proto != IPPROTO_TCP or frag & 0x1FFF or ihl < 20:
+            return None
+        if total_len >= ihl:
+            end = min(end, offset + total_len)
+        src_ip = socket.inet_ntoa(data[offset + 12:offset + 16])
+        dst_ip = socket.inet_ntoa(data[offset + 16:offset + 20])
+        tcp = offset + ihl
+    elif version == 6:
+        if end - offset < 40:
+            return None
+        payload_len = _u16(data, offset + 4)[0]
+        next_header = data[offset + 6]
+        end = min(end, offset + 40 + payload_len)
+        src_ip = socket.inet_ntop(socket.AF_INET6, data[offset + 8:offset + 24])
+        dst_ip = socket.inet_ntop(socket.AF_INET6, data[offset + 24:offset + 40])
+        tcp = offset + 40
+        while next_header != IPPROTO_TCP:
+            if end - tcp < 8:
+                return None
+            if next_header in IPV6_EXT_HEADERS:
+                next_header, ext_len = data[tcp], (data[tcp + 1] + 1) * 8
+            elif next_header == IPV6_FRAGMENT:
+                if _u16(data, tcp + 2)[0] & 0xFFF8:
+                    return None
+                next_header, ext_len = data[tcp], 8
+            else:
+                return None
+            tcp += ext_len
+    else:
+        return None
+    if end - tcp < 20:
+        return None
+    src_port, dst_port, data_off, flags = _tcp_hdr(data, tcp)
+    tcp_flags = ((data_off & 0x01) << 8) | flags
+    payload_start = tcp + (data_off >> 4) * 4
+    payload = data[payload_start:end] if payload_start < end else None
+    return src_ip, dst_ip, src_port, dst_port, tcp_flags, payload
+
+
+def decode_packet(data, linktype):
+    """
+    Decode a link-layer frame into IP/TCP fields.
+
+    Args:
+        data: Frame bytes
+        linktype: pcap LINKTYPE_* value of the frame
+
+    Returns:
+        tuple or None: decode_ip() result, or None if the frame is not TCP/IP.
+            NotImplemented means the frame needs Scapy to be decoded.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return NotImplemented
+        ethertype = _u16(data, 12)[0]
+        offset = 14
+        while ethertype in VLAN_ETHERTYPES and len(data) >= offset + 4:
+            ethertype = _u16(data, offset + 2)[0]
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if len(data) < 20:
+            return NotImplemented
+        ethertype = _u16(data, 0)[0]
+        offset = 20
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return NotImplemented
+        ethertype = _u16(data, 14)[0]
+        offset = 16
+    elif linktype == LINKTYPE_RAW:
+        return decode_ip(data, 0)
+    elif linktype == LINKTYPE_IPV4:
+        return decode_ip(data, 0, version=4)
+    elif linktype == LINKTYPE_IPV6:
+        return decode_ip(data, 0, version=6)
+    else:
+        return NotImplemented
+
+    if ethertype == ETH_P_IP:
+        return decode_ip(data, offset, version=4)
+    if ethertype == ETH_P_IPV6:
+        return decode_ip(data, offset, version=6)
+    if ethertype in NON_IP_ETHERTYPES:
+        return None
+    return NotImplemented
+
+
+def scapy_packet_record(pkt, timestamp=None):
+    """
+    Build a PacketRecord from a dissected Scapy packet.
+
+    TCP is only taken from directly inside the first IP/IPv6 header (IPv6
+    extension headers allowed) and must have a complete header. The payload
+    is the TCP segment data bounded by the IP length, exactly as the fast
+    decoder reads it.
+
+    Args:
+        pkt: Scapy packet
+        timestamp: Capture time override (defaults to pkt.time)
+
+    Returns:
+        PacketRecord or None if the packet is not TCP over IP
+    """
+    from scapy.packet import NoPayload
+    from scapy.layers.inet import IP, TCP
+    from scapy.layers.inet6 import (IPv6, IPv6ExtHdrHopByHop, IPv6ExtHdrRouting,
+                                    IPv6ExtHdrDestOpt, IPv6ExtHdrFragment)
+
+    layer = pkt
+    while not isinstance(layer, (IP, IPv6, NoPayload)):
+        layer = layer.payload
+    if isinstance(layer, NoPayload):
+        return None
+    upper = layer.payload
+    if isinstance(layer, IPv6):
+        while isinstance(upper, (IPv6ExtHdrHopByHop, IPv6ExtHdrRouting,
+                                 IPv6ExtHdrDestOpt, IPv6ExtHdrFragment)):
+            upper = upper.payload
+    if not isinstance(upper, TCP):
+        return None
+    decoded = decode_ip(bytes(layer), 0, version=4 if isinstance(layer, IP) else 6)
+    if decoded is None:
+        # Scapy fills in defaults for a truncated TCP header; skip it instead
+        return None
+    payload = decoded[5]
+    return PacketRecord(
+        float(pkt.time) if timestamp is None else timestamp, len(pkt),
+        layer.src, layer.dst, upper.sport, upper.dport, int(upper.flags),
+        bytes(payload) if payload else None
+    )
+
+
+def _scapy_records(pcap_file):
+    """Yield PacketRecord/None for every packet using Scapy's PcapReader."""
+    from scapy.all import PcapReader  # Loads every layer binding, not just the reader
+
+    with PcapReader(pcap_file) as reader:
+        for pkt in reader:
+            yield scapy_packet_record(pkt)
+
+
+def decode_record(timestamp, linktype, data, l2_classes):
+    """
+    Decode one pcap record, falling back to Scapy when the fast path can't.
+
+    Args:
+        timestamp: Record capture time
+        linktype: pcap LINKTYPE_* value of the record
+        data: Record bytes
+        l2_classes: Cache dict of Scapy link-layer classes by link type
+
+    Returns:
+        PacketRecord or None if the packet is not TCP over IP
+    """
+    decoded = decode_packet(data, linktype)
+    if decoded is None:
+        return None
+    if decoded is not NotImplemented:
+        return PacketRecord(timestamp, len(data), *decoded)
+    if linktype not in l2_classes:
+        from scapy.all import conf
+        l2_classes[linktype] = conf.l2types.num2layer.get(linktype, conf.raw_layer)
+    try:
+        pkt = l2_classes[linktype](bytes(data))
+    except Exception:
+        # PcapReader keeps frames its dissector rejects as Raw
+        return None
+    return scapy_packet_record(pkt, timestamp)
+
+
+def iter_capture_records(pcap_file, cursor=None):
+    """
+    Yield raw records of a classic pcap or pcapng capture, optionally
+    compressed with gzip, xz or zstd.
+
+    Args:
+        pcap_file: Capture file path
+        cursor: See iter_pcap_records (only updated for classic pcap)
+
+    Yields:
+        tuple: (timestamp, linktype, data)
+    """
+    if capture_format(pcap_file) == 'pcapng':
+        yield from iter_pcapng_records(pcap_file)
+    else:
+        yield from iter_pcap_records(pcap_file, cursor=cursor)
+
+
+def _fast_records(records):
+    """Yield PacketRecord/None for every raw (timestamp, linktype, data) record."""
+    l2_classes = {}
+    for timestamp, linktype, data in records:
+        yield decode_record(timestamp, linktype, data, l2_classes)
+
+
+def decode_records(records, l2_classes):
+    """
+    Decode a batch of raw records with the fast decoder.
+
+    Args:
+        records: List of (timestamp, linktype, data) records
+        l2_classes: Scapy link-layer class cache shared across batches
+
+    Returns:
+        list: PacketRecord/None per record
+    """
+    return [decode_record(timestamp, linktype, data, l2_classes) for timestamp, linktype, data in records]
+
+
+def iter_raw_records(pcap_file, start=None, stop=None, skip=0, cursor=None):
+    """
+    Raw records of a capture for the fast decoder (see iter_packets for
+    the arguments), without decoding them.
+
+    Returns:
+        iterator: (timestamp, linktype, data) records, or None when the
+            capture is not a format the fast reader understands and Scapy
+            has to read it
+    """
+    if start is not None or stop is not None or hasattr(pcap_file, 'read'):
+        records = iter_pcap_records(pcap_file, start, stop, cursor)
+    else:
+        try:
+            capture_format(pcap_file)
+        except PcapFormatError as e:
+            logger.info(f"Fast decoder unavailable ({e}), falling back to Scapy")
+            return None
+        records = iter_capture_records(pcap_file, cursor)
+    return islice(records, skip, None)
+
+
+def iter_packets(pcap_file, decoder='fast', start=None, stop=None, skip=0, cursor=None):
+    """
+    Iterate over every packet in a capture as a PacketRecord.
+
+    Packets that are not TCP over IPv4/IPv6 are yielded as None so callers
+    can still count them.
+
+    Args:
+        pcap_file: Capture file path (classic pcap or pcapng, optionally
+            gzip/xz/zstd compressed), or a binary stream of classic pcap
+            data
+        decoder: 'fast' for the struct decoder, 'scapy' for full dissection
+        start: Byte offset of the first record (fast decoder, classic pcap only)
+        stop: Byte offset where the record range ends (see iter_pcap_records)
+        skip: Pass over this many records first without decoding them
+            (fast decoder; Scapy still dissects them)
+        cursor: Optional one-element list receiving the byte offset past the
+            last record yielded (fast decoder, classic pcap only)
+
+    Yields:
+        PacketRecord or None
+    """
+    if decoder == 'scapy':
+        if start is not None or stop is not None:
+            raise ValueError("Byte ranges are only supported by the fast decoder")
+        if hasattr(pcap_file, 'read'):
+            yield from islice(_scapy_records(pcap_file), skip, None)
+            return
+        with open_capture(pcap_file) as f:
+            yield from islice(_scapy_records(f), skip, None)
+        return
+    if decoder != 'fast':
+        raise ValueError(f"Unknown decoder: {decoder}")
+    records = iter_raw_records(pcap_file, start, stop, skip, cursor)
+    if records is None:
+        with open_capture(pcap_file) as f:
+            yield from islice(_scapy_records(f), skip, None)
+        return
+    yield from _fast_records(records)
+
+
+class PacketColumns:
+    """
+    Columnar view of a memory-mapped pcap file.
+
+    packets is a PACKET_COLUMNS_DTYPE structured array with one row per
+    record. Payloads are never copied: payload_offset/payload_len point into
+    the mapped file. Rows that had to be decoded by Scapy keep their payload
+    in a small side table instead.
+    """
+
+    def __init__(self, packets, buffer, ipv6_addresses, payloads, closer=None):
+        self.packets = packets
+        self.buffer = buffer
+        self.ipv6_addresses = ipv6_addresses
+        self.payloads = payloads
+        self._closer = closer
+
+    def __len__(self):
+        return len(self.packets)
+
+    def payload(self, row):
+        """Return the TCP payload of a row as a zero-copy view (or None)."""
+        if row in self.payloads:
+            return self.payloads[row]
+        length = int(self.packets['payload_len'][row])
+        if not length:
+            return None
+        offset = int(self.packets['payload_offset'][row])
+        return self.buffer[offset:offset + length]
+
+    def address(self, value, ip_version):
+        """Convert a src/dst column value back to its string form."""
+        if ip_version == 6:
+            return self.ipv6_addresses[value]
+        return socket.inet_ntoa(int(value).to_bytes(4, 'big'))
+
+    def close(self):
+        self.buffer = None
+        if self._closer is not None:
+            self._closer()
+            self._closer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def scan_record_offsets(mm, byte_order, start=24, stop=None):
+    """
+    Walk the record headers of a classic pcap and return each record offset.
+
+    Record boundaries form a chain (each header gives the next offset), so
+    this is the one sequential step; everything after it is vectorized.
+
+    Args:
+        mm: Buffer holding the whole file (mmap or bytes)
+        byte_order: '<' or '>' from read_pcap_header
+        start: Offset of the first record to visit
+        stop: Only records starting before this offset are returned
+
+    Returns:
+        np.ndarray: int64 record offsets
+    """
+    unpack_caplen = struct.Struct(byte_order + 'I').unpack_from
+    size = len(mm)
+    stop = size if stop is None else min(stop, size)
+    offsets = array('q')
+    append = offsets.append
+    pos = start
+    while pos < stop and pos + 16 <= size:
+        end = pos + 16 + unpack_caplen(mm, pos + 8)[0]
+        if end > size:
+            logger.warning("Truncated final record in capture")
+            break
+        append(pos)
+        pos = end
+    return np.frombuffer(offsets, dtype=np.int64) if offsets else np.zeros(0, dtype=np.int64)
+
+
+def _gather_u16(buf, idx):
+    return (buf[idx].astype(np.uint16) << 8) | buf[idx + 1]
+
+
+def _gather_u32(buf, idx, byte_order):
+    b = [buf[idx + i].astype(np.uint32) for i in range(4)]
+    if byte_order == '<':
+        b.reverse()
+    return (b[0] << 24) | (b[1] << 16) | (b[2] << 8) | b[3]
+
+
+def decode_columns(buf, offsets, byte_order, ts_units, linktype):
+    """
+    Vectorized decode of the records at the given offsets.
+
+    IPv4/TCP frames on the common link types are decoded with array
+    operations. Anything else (IPv6, unknown ethertypes, short frames) is
+    reported back so it can be decoded one record at a time.
+
+    Args:
+        buf: uint8 array over the whole capture
+        offsets: int64 record offsets from scan_record_offsets
+        byte_order: '<' or '>' from read_pcap_header
+        ts_units: Timestamp fraction units per second
+        linktype: Capture link type
+
+    Returns:
+        tuple: (packets structured array, int64 indices of rows that need
+            per-record decoding)
+    """
+    n = len(offsets)
+    packets = np.zeros(n, dtype=PACKET_COLUMNS_DTYPE)
+    if n == 0:
+        return packets, np.zeros(0, dtype=np.int64)
+    # Leave room for the widest (4-byte) gather
+    last = len(buf) - 4
+
+    def at(idx):
+        # Clamp so short frames never index past the buffer; they are masked out
+        return np.minimum(idx, last)
+
+    sec = _gather_u32(buf, offsets, byte_order)
+    frac = _gather_u32(buf, offsets + 4, byte_order)
+    caplen = np.minimum(_gather_u32(buf, offsets + 8, byte_order), SCAPY_MTU).astype(np.int64)
+    if ts_units == 1000000:
+        # sec * 1e6 + frac is exact in float64, so the division is correctly rounded
+        packets['ts'] = (sec.astype(np.float64) * ts_units + frac) / ts_units
+    else:
+        total = sec.astype(np.int64) * ts_units + frac
+        packets['ts'] = (total.astype(np.longdouble) / ts_units).astype(np.float64)
+    packets['caplen'] = caplen
+
+    data = offsets + 16
+    data_end = data + caplen
+    scalar = np.zeros(n, dtype=bool)
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        l3 = data
+        if linktype == LINKTYPE_IPV4:
+            is_ipv4 = caplen >= 1
+        else:
+            version = buf[at(l3)] >> 4
+            is_ipv4 = (caplen >= 1) & (version == 4) & (linktype == LINKTYPE_RAW)
+            scalar = (caplen >= 1) & ~is_ipv4
+    else:
+        if linktype == LINKTYPE_ETHERNET:
+            hdr_len, type_at = 14, 12
+        elif linktype == LINKTYPE_LINUX_SLL:
+            hdr_len, type_at = 16, 14
+        else:
+            hdr_len, type_at = 20, 0
+        long_enough = caplen >= hdr_len
+        ethertype = _gather_u16(buf, at(data + type_at))
+        l3 = data + hdr_len
+        if linktype == LINKTYPE_ETHERNET:
+            for _ in range(2):
+                tagged = long_enough & np.isin(ethertype, VLAN_ETHERTYPES) & (data_end >= l3 + 4)
+                ethertype = np.where(tagged, _gather_u16(buf, at(l3 + 2)), ethertype)
+                l3 = np.where(tagged, l3 + 4, l3)
+            # Deeper VLAN stacks are left to the per-record decoder
+            scalar |= long_enough & np.isin(ethertype, VLAN_ETHERTYPES)
+        is_ipv4 = long_enough & (ethertype == ETH_P_IP)
+        known = is_ipv4 | np.isin(ethertype, list(NON_IP_ETHERTYPES))
+        scalar |= ~long_enough | ~known
+
+    # IPv4 header
+    ip_ok = is_ipv4 & (data_end - l3 >= 20)
+    l3c = at(l3)
+    ihl = (buf[l3c] & 0x0F).astype(np.int64) * 4
+    total_len = _gather_u16(buf, at(l3 + 2)).astype(np.int64)
+    frag = _gather_u16(buf, at(l3 + 6)) & 0x1FFF
+    proto = buf[at(l3 + 9)]
+    ip_ok &= (proto == IPPROTO_TCP) & (frag == 0) & (ihl >= 20)
+    end = np.where(total_len >= ihl, np.minimum(data_end, l3 + total_len), data_end)
+
+    # TCP header
+    tcp = l3 + ihl
+    tcp_ok = ip_ok & (end - tcp >= 20)
+    tcpc = at(tcp)
+    data_off = buf[at(tcp + 12)]
+    payload_start = tcp + (data_off >> 4).astype(np.int64) * 4
+
+    rows = np.flatnonzero(tcp_ok)
+    packets['ip_version'][rows] = 4
+    packets['src'][rows] = _gather_u32(buf, l3c[rows] + 12, '>')
+    packets['dst'][rows] = _gather_u32(buf, l3c[rows] + 16, '>')
+    packets['sport'][rows] = _gather_u16(buf, tcpc[rows])
+    packets['dport'][rows] = _gather_u16(buf, tcpc[rows] + 2)
+    packets['flags'][rows] = ((data_off[rows].astype(np.uint16) & 0x01) << 8) | buf[tcpc[rows] + 13]
+    packets['payload_offset'][rows] = payload_start[rows]
+    packets['payload_len'][rows] = np.maximum(end[rows] - payload_start[rows], 0)
+    return packets, np.flatnonzero(scalar)
+
+
+def read_pcap_columns(pcap_file, start=24, stop=None):
+    """
+    Memory-map a classic pcap and decode its records into columns.
+
+    Args:
+        pcap_file: Path to a classic (non-pcapng) pcap file
+        start: Offset of the first record to decode
+        stop: Decode only records that start before this offset
+
+    Returns:
+        PacketColumns (use as a context manager to release the mapping)
+    """
+    f = open(pcap_file, 'rb')
+    try:
+        byte_order, ts_units, _, linktype = read_pcap_header(f)
+        if linktype not in COLUMNAR_LINKTYPES:
+            raise PcapFormatError(f"Link type {linktype} not supported by the columnar decoder")
+        size = f.seek(0, 2)
+        if size <= 24:
+            f.close()
+            return PacketColumns(np.zeros(0, dtype=PACKET_COLUMNS_DTYPE), b'', [], {})
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+        f.close()
+        raise
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    offsets = scan_record_offsets(mm, byte_order, start, stop)
+    packets, scalar_rows = decode_columns(buf, offsets, byte_order, ts_units, linktype)
+
+    ipv6_addresses = []
+    ipv6_ids = {}
+    payloads = {}
+    l2_classes = {}
+    view = memoryview(mm)
+    for row in scalar_rows.tolist():
+        data_start = int(offsets[row]) + 16
+        record = decode_record(packets['ts'][row], linktype,
+                               view[data_start:data_start + int(packets['caplen'][row])],
+                               l2_classes)
+        if record is None:
+            continue
+        if ':' in record.src_ip:
+            packets['ip_version'][row] = 6
+            src = ipv6_ids.setdefault(record.src_ip, len(ipv6_ids))
+            dst = ipv6_ids.setdefault(record.dst_ip, len(ipv6_ids))
+        else:
+            packets['ip_version'][row] = 4
+            src = int.from_bytes(socket.inet_aton(record.src_ip), 'big')
+            dst = int.from_bytes(socket.inet_aton(record.dst_ip), 'big')
+        packets[row] = (packets['ts'][row], record.length, src, dst, record.src_port,
+                        record.dst_port, record.tcp_flags, 0, 0, packets['ip_version'][row])
+        if record.payload:
+            # Copied so no view into the mapping outlives close()
+            payloads[row] = bytes(record.payload)
+    ipv6_addresses = [None] * len(ipv6_ids)
+    for address, index in ipv6_ids.items():
+        ipv6_addresses[index] = address
+
+    def closer():
+        view.release()
+        try:
+            mm.close()
+        except BufferError:
+            # A caller still holds a payload view; the mapping is freed with it
+            pass
+        f.close()
+
+    # A memoryview (not the numpy array) is handed out for payload slices so
+    # the mapping can be closed once the caller releases its views
+    return PacketColumns(packets, view, ipv6_addresses, payloads, closer)
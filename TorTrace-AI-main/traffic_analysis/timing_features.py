@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Batched Timing Features
+
+Vectorized burst and inter-packet time (IPT) statistics for many flows at
+once. Flows are passed as one concatenated timestamp array plus the index
+where each flow starts; burst boundaries come from a boolean mask over
+np.diff and per-flow values from ufunc.reduceat, so there is no per-packet
+Python loop. Several burst thresholds can be evaluated from a single diff.
+"""
+
+import numpy as np
+
+DEFAULT_BURST_THRESHOLD_MS = 50
+
+# Below this many remaining segments, segment_sums finishes each one alone
+LONG_SEGMENT_ROWS = 16
+
+
+def concat_flow_timestamps(series):
+    """
+    Concatenate the timestamps of several PacketSeries.
+
+    Args:
+        series: Sequence of PacketSeries (one per flow, each non-empty)
+
+    Returns:
+        tuple: (float64 timestamps, int64 start index of every flow)
+    """
+    if not series:
+        return np.zeros(0), np.zeros(0, dtype=np.int64)
+    lengths = np.fromiter((len(s) for s in series), dtype=np.int64, count=len(series))
+    starts = np.zeros(len(series), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    timestamps = np.concatenate([s.timestamp_array() for s in series])
+    return timestamps, starts
+
+
+def segment_sums(values, starts, counts):
+    """
+    Sum each segment values[start:start + count], left to right.
+
+    np.add.reduceat sums long segments pairwise, which rounds differently
+    from the running sums used everywhere else for flow features. Here the
+    k-th element of every segment that is still open is added in one
+    vectorized step; the few longest segments are finished with np.cumsum,
+    which is sequential too.
+
+    Args:
+        values: 1-D float array
+        starts: Start index of each segment
+        counts: Length of each segment
+
+    Returns:
+        np.ndarray: float64 sum per segment
+    """
+    sums = np.zeros(len(starts))
+    if len(starts) == 0:
+        return sums
+    order = np.argsort(counts, kind='stable')
+    sorted_counts = counts[order]
+    for k in range(int(sorted_counts[-1])):
+        rows = order[np.searchsorted(sorted_counts, k, side='right'):]
+        if len(rows) <= LONG_SEGMENT_ROWS:
+            for row in rows.tolist():
+                tail = values[starts[row] + k:starts[row] + counts[row]]
+                sums[row] = np.cumsum(np.r_[sums[row], tail])[-1]
+            break
+        sums[rows] += values[starts[rows] + k]
+    return sums
+
+
+def burst_features(timestamps, starts, threshold_ms=DEFAULT_BURST_THRESHOLD_MS, gaps_ms=None):
+    """
+    Burst statistics for every flow.
+
+    A burst ends where the gap to the next packet of the flow exceeds
+    threshold_ms; every flow starts a new burst.
+
+    Args:
+        timestamps: Concatenated packet timestamps (seconds), flow by flow
+        starts: Start index of each flow in timestamps
+        threshold_ms: Maximum inter-packet gap inside a burst
+        gaps_ms: Precomputed np.diff(timestamps) * 1000, to share between
+            thresholds
+
+    Returns:
+        dict: 'burst_count', 'avg_burst_duration', 'max_burst_len' arrays
+    """
+    n = len(timestamps)
+    if n == 0:
+        return {'burst_count': np.zeros(0, dtype=np.int64),
+                'avg_burst_duration': np.zeros(0),
+                'max_burst_len': np.zeros(0, dtype=np.int64)}
+    if gaps_ms is None:
+        gaps_ms = np.diff(timestamps) * 1000
+    boundary = np.ones(n, dtype=bool)
+    boundary[1:] = gaps_ms > threshold_ms
+    boundary[starts] = True
+    first = np.flatnonzero(boundary)
+    last = np.r_[first[1:], n] - 1
+    lengths = last - first + 1
+    durations = timestamps[last] - timestamps[first]
+    flow_bursts = np.searchsorted(first, starts)
+    counts = np.diff(np.r_[flow_bursts, len(first)])
+    return {
+        'burst_count': counts,
+        'avg_burst_duration': segment_sums(durations, flow_bursts, counts) / counts,
+        'max_burst_len': np.maximum.reduceat(lengths, flow_bursts),
+    }
+
+
+def sweep_burst_thresholds(timestamps, starts, thresholds_ms):
+    """
+    Burst statistics for several thresholds from one pass over the gaps.
+
+    Returns:
+        dict: threshold_ms -> burst_features() result
+    """
+    gaps_ms = np.diff(timestamps) * 1000
+    return {threshold: burst_features(timestamps, starts, threshold, gaps_ms=gaps_ms)
+            for threshold in thresholds_ms}
+
+
+def ipt_features(timestamps, starts):
+    """
+    Inter-packet time statistics for every flow.
+
+    Single-packet flows have no inter-packet times and get 0 for every
+    statistic.
+
+    Returns:
+        dict: 'ipt_mean', 'ipt_std', 'ipt_min', 'ipt_max' arrays (seconds)
+    """
+    n_flows = len(starts)
+    stats = {key: np.zeros(n_flows) for key in ('ipt_mean', 'ipt_std', 'ipt_min', 'ipt_max')}
+    if n_flows == 0:
+        return stats
+    ends = np.r_[starts[1:], len(timestamps)]
+    has_ipt = ends - starts > 1
+    if not has_ipt.any():
+        return stats
+    ipt = np.diff(timestamps)
+    # The gap leading into each flow start belongs to no flow
+    within = np.ones(len(ipt), dtype=bool)
+    within[starts[1:] - 1] = False
+    ipt = ipt[within]
+    counts = (ends - starts - 1)[has_ipt]
+    offsets = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=offsets[1:])
+    mean = np.add.reduceat(ipt, offsets) / counts
+    deviation = ipt - np.repeat(mean, counts)
+    stats['ipt_mean'][has_ipt] = mean
+    stats['ipt_std'][has_ipt] = np.sqrt(np.add.reduceat(deviation * deviation, offsets) / counts)
+    stats['ipt_min'][has_ipt] = np.minimum.reduceat(ipt, offsets)
+    stats['ipt_max'][has_ipt] = np.maximum.reduceat(ipt, offsets)
+    return stats
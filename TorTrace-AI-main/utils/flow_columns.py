@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Columnar Flow Store
+
+Binary output format for analyzed Tor flows. A dataset is a directory with
+one .npy file per per-flow column, the ragged packet sequences of every flow
+stored as flat arrays plus an offsets array, and a meta.json describing
+both. Readers memory-map only the columns they touch instead of re-parsing
+a whole JSON report.
+
+Layout:
+    meta.json             format, version, flow count, column names, run info
+    <column>.npy          one value per flow (strings as fixed-width unicode)
+    seq_offsets.npy       int64, flow i owns packets offsets[i]:offsets[i+1]
+    seq_<name>.npy        flat per-packet arrays (timestamps, sizes, directions)
+
+Sequences are kept whole; consumers pick their own length through lazy
+views (first N, sliding windows, downsampled) over the memory map.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_NAME = 'bimbo-flow-columns'
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+OFFSETS_FILE = 'seq_offsets.npy'
+
+# Per-flow columns a dataset needs to rebuild the JSON timing patterns
+PATTERN_COLUMNS = ('src_ip', 'dst_ip', 'packet_count', 'start_time', 'end_time', 'total_bytes',
+                   'tor_relay_ip', 'relay_nickname', 'is_guard', 'is_exit')
+PATTERN_SEQUENCE_LENGTH = 100  # Default per-pattern sequence length (None keeps all)
+PATTERN_SEQUENCES = ('inter_packet_times', 'packet_sizes', 'directions')
+
+
+def write_flow_columns(path, columns, sequences, offsets, meta=None):
+    """
+    Write a columnar flow dataset.
+
+    meta.json is written last, so a dataset without it is incomplete.
+
+    Args:
+        path: Output directory (created if missing)
+        columns: Dict of column name -> array with one entry per flow
+        sequences: Dict of sequence name -> flat per-packet array
+        offsets: int64 array of length n_flows + 1 into the sequences
+        meta: Optional extra JSON-serializable run information
+
+    Returns:
+        str: The dataset directory
+    """
+    os.makedirs(path, exist_ok=True)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_flows = len(offsets) - 1
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if len(values) != n_flows:
+            raise ValueError(f"Column {name} has {len(values)} values for {n_flows} flows")
+        np.save(os.path.join(path, f'{name}.npy'), values)
+    for name, values in sequences.items():
+        values = np.asarray(values)
+        if len(values) != offsets[-1]:
+            raise ValueError(f"Sequence {name} has {len(values)} values, offsets need {offsets[-1]}")
+        np.save(os.path.join(path, f'seq_{name}.npy'), values)
+    np.save(os.path.join(path, OFFSETS_FILE), offsets)
+
+    info = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'flows': n_flows,
+        'columns': list(columns),
+        'sequences': list(sequences),
+    }
+    info.update(meta or {})
+    tmp_file = os.path.join(path, META_FILE + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp_file, os.path.join(path, META_FILE))
+    logger.info(f"Wrote {n_flows} flows to {path}")
+    return path
+
+
+class FlowColumns:
+    """
+    Reader for a columnar flow dataset.
+
+    Columns are loaded on first access (memory-mapped by default) and
+    cached, so only the columns a consumer asks for are read.
+    """
+
+    def __init__(self, path, mmap=True):
+        """
+        Args:
+            path: Dataset directory
+            mmap: Memory-map the .npy files instead of reading them
+        """
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != FORMAT_NAME:
+            raise ValueError(f"{path} is not a {FORMAT_NAME} dataset")
+        if self.meta.get('version', 0) > FORMAT_VERSION:
+            raise ValueError(f"{path} uses format version {self.meta['version']}, "
+                             f"newest supported is {FORMAT_VERSION}")
+        self.columns = list(self.meta['columns'])
+        self.sequences = list(self.meta['sequences'])
+        self._mmap_mode = 'r' if mmap else None
+        self._cache = {}
+
+    def __len__(self):
+        return self.meta['flows']
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def _load(self, file_name):
+        array = self._cache.get(file_name)
+        if array is None:
+            array = self._cache[file_name] = np.load(os.path.join(self.path, file_name),
+                                                     mmap_mode=self._mmap_mode)
+        return array
+
+    def column(self, name):
+        """Per-flow column as a NumPy array."""
+        if name not in self.columns:
+            raise KeyError(name)
+        return self._load(f'{name}.npy')
+
+    @property
+    def offsets(self):
+        """int64 array; flow i owns packets offsets[i]:offsets[i + 1]."""
+        return self._load(OFFSETS_FILE)
+
+    def sequence(self, name, flow=None, limit=None):
+        """
+        Packet sequence data.
+
+        'ipt' (inter-packet times) is derived from the timestamps of one
+        flow on request; the stored sequences are views into the memory map.
+
+        Args:
+            name: 'timestamps', 'sizes', 'directions' or 'ipt'
+            flow: Flow index, or None for the flat array of every flow
+            limit: Return at most this many leading values of the flow
+
+        Returns:
+            np.ndarray
+        """
+        if name == 'ipt':
+            if flow is None:
+                raise ValueError("'ipt' is only available per flow")
+            timestamps = self.sequence('timestamps', flow, None if limit is None else limit + 1)
+            return np.diff(timestamps)
+        if name not in self.sequences:
+            raise KeyError(name)
+        values = self._load(f'seq_{name}.npy')
+        if flow is None:
+            return values
+        offsets = self.offsets
+        start, stop = int(offsets[flow]), int(offsets[flow + 1])
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return values[start:stop]
+
+    def head(self, name, flow, n):
+        """First n values of a flow's sequence."""
+        return self.sequence(name, flow, limit=n)
+
+    def windows(self, name, flow, size, step=None):
+        """
+        Sliding windows over a flow's sequence, without copying.
+
+        Args:
+            name: Sequence name (see sequence())
+            flow: Flow index
+            size: Values per window
+            step: Offset between window starts (default size: tiled)
+
+        Returns:
+            np.ndarray: Read-only (n_windows, size) strided view; empty
+                when the sequence is shorter than one window
+        """
+        values = self.sequence(name, flow)
+        if len(values) < size:
+            return np.zeros((0, size), dtype=values.dtype)
+        return np.lib.stride_tricks.sliding_window_view(values, size)[::step or size]
+
+    def downsample(self, name, flow, length):
+        """
+        length evenly spaced values of a flow's sequence (the whole
+        sequence if it is not longer than that).
+        """
+        values = self.sequence(name, flow)
+        if len(values) <= length:
+            return values
+        return values[np.linspace(0, len(values) - 1, length).round().astype(np.int64)]
+
+    def timing_patterns(self, sequence_length=PATTERN_SEQUENCE_LENGTH):
+        """
+        Rebuild the 'timing_patterns' list of the JSON analysis report.
+
+        Args:
+            sequence_length: Packets kept per pattern sequence (None for
+                the full sequences)
+
+        Returns:
+            list: Pattern dicts, one per flow
+        """
+        cols = {name: self.column(name).tolist() for name in PATTERN_COLUMNS}
+        offsets = self.offsets.tolist()
+        timestamps = self.sequence('timestamps')
+        sizes = self.sequence('sizes')
+        directions = self.sequence('directions')
+        patterns = []
+        for i in range(len(self)):
+            start, stop = offsets[i], offsets[i + 1]
+            if stop == start:
+                continue
+            head = stop if sequence_length is None else min(stop, start + sequence_length)
+            patterns.append({
+                'flow_id': f"{cols['src_ip'][i]}->{cols['dst_ip'][i]}",
+                'packet_count': cols['packet_count'][i],
+                'start_time': cols['start_time'][i],
+                'end_time': cols['end_time'][i],
+                'duration': cols['end_time'][i] - cols['start_time'][i],
+                'total_bytes': cols['total_bytes'][i],
+                'avg_packet_size': int(sizes[start:stop].sum()) / (stop - start),
+                'inter_packet_times': np.diff(timestamps[start:min(stop, head + 1)]).tolist(),
+                'packet_sizes': sizes[start:head].tolist(),
+                'directions': directions[start:head].tolist(),
+                'tor_relay': cols['tor_relay_ip'][i],
+                'relay_nickname': cols['relay_nickname'][i],
+                'is_guard': cols['is_guard'][i],
+                'is_exit': cols['is_exit'][i]
+            })
+        return patterns
+
+
+def load_flow_columns(path, mmap=True):
+    """Open a columnar flow dataset (see FlowColumns)."""
+    return FlowColumns(path, mmap=mmap)
+
+
+def is_flow_dataset(path):
+    """True if path is a columnar flow dataset directory."""
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def load_timing_patterns(path, sequence_length=PATTERN_SEQUENCE_LENGTH):
+    """
+    Load timing patterns from a JSON analysis report or a columnar dataset.
+
+    Args:
+        path: Analysis JSON file or dataset directory
+        sequence_length: Values kept per pattern sequence (None keeps
+            everything stored). A JSON report cannot supply more than it
+            was written with.
+
+    Returns:
+        list: Traffic pattern dictionaries
+    """
+    if is_flow_dataset(path):
+        return FlowColumns(path).timing_patterns(sequence_length)
+    with open(path, 'r') as f:
+        data = json.load(f)
+    patterns = data.get('timing_patterns', [])
+    if sequence_length is not None:
+        for pattern in patterns:
+            for key in PATTERN_SEQUENCES:
+                if key in pattern:
+                    pattern[key] = pattern[key][:sequence_length]
+    return patterns
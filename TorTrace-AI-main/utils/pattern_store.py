@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Pattern Store
+
+Persistent, time-indexed store of timing patterns from every capture, so
+entry traffic seen at one vantage point can be correlated against exit
+traffic from another. Analyzers append patterns as they finish; the
+correlator reads back only what it has not processed yet.
+
+The store is one SQLite file:
+    patterns     one row per pattern, in arrival order (id), with the
+                 fields the correlator filters on as indexed columns and
+                 the whole pattern as JSON
+    watermarks   per correlation method, the last pattern id processed
+    matches      per correlation method, the best exit found so far for
+                 each entry pattern
+
+A flow is identified by (flow_id, start_time, end_time), so writing the
+same analysis twice adds nothing. Patterns without start_time/end_time
+(reports written before patterns carried them) cannot be placed in time
+and are skipped.
+"""
+
+import json
+import logging
+import sqlite3
+
+from flow_columns import PATTERN_SEQUENCES, PATTERN_SEQUENCE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = 'data/pattern_store.db'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patterns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT,
+    flow_id TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    is_exit INTEGER NOT NULL,
+    pattern TEXT NOT NULL,
+    UNIQUE (flow_id, start_time, end_time)
+);
+CREATE INDEX IF NOT EXISTS patterns_end_time ON patterns (end_time);
+CREATE TABLE IF NOT EXISTS watermarks (
+    method TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS matches (
+    method TEXT NOT NULL,
+    entry_id INTEGER NOT NULL,
+    exit_id INTEGER NOT NULL,
+    correlation REAL NOT NULL,
+    details TEXT NOT NULL,
+    PRIMARY KEY (method, entry_id)
+);
+"""
+
+
+class PatternStore:
+    """
+    SQLite store of timing patterns and incremental correlation state.
+
+    Patterns read back from the store carry their row id as 'pattern_id'.
+
+    Usage:
+        with PatternStore('data/pattern_store.db') as store:
+            store.add_patterns(patterns, source='capture.pcap')
+    """
+
+    def __init__(self, path=STORE_PATH):
+        """
+        Args:
+            path: SQLite file (created if missing)
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_patterns(self, patterns, source=None):
+        """
+        Append timing patterns.
+
+        Args:
+            patterns: Pattern dicts with 'flow_id', 'start_time', 'end_time'
+            source: Optional capture name recorded with each pattern
+
+        Returns:
+            int: Patterns added (already stored and untimed ones are not)
+        """
+        rows = []
+        skipped = 0
+        for pattern in patterns:
+            if pattern.get('start_time') is None or pattern.get('end_time') is None:
+                skipped += 1
+                continue
+            pattern = {key: value for key, value in pattern.items() if key != 'pattern_id'}
+            rows.append((source, pattern['flow_id'], float(pattern['start_time']), float(pattern['end_time']),
+                         int(bool(pattern.get('is_exit', False))), json.dumps(pattern)))
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO patterns (source, flow_id, start_time, end_time, is_exit, pattern) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            added = self.conn.total_changes - before
+        if skipped:
+            logger.warning(f"Skipped {skipped} patterns without start_time/end_time")
+        logger.debug(f"Stored {added} new patterns ({len(rows) - added} already stored)")
+        return added
+
+    def last_id(self):
+        """Id of the newest pattern (0 for an empty store)."""
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM patterns").fetchone()[0]
+
+    def patterns(self, since=None, start=None, end=None, sequence_length=PATTERN_SEQUENCE_LENGTH):
+        """
+        Stored patterns in arrival order.
+
+        Args:
+            since: Only patterns added after this id
+            start, end: Only patterns active at some time in [start, end]
+            sequence_length: Values kept per pattern sequence (None keeps
+                everything stored)
+
+        Returns:
+            list: Pattern dicts with 'pattern_id'
+        """
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("id > ?")
+            params.append(since)
+        if start is not None:
+            clauses.append("end_time >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("start_time <= ?")
+            params.append(end)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.conn.execute(f"SELECT id, pattern FROM patterns{where} ORDER BY id", params)
+        return [self._load(pattern_id, pattern, sequence_length) for pattern_id, pattern in rows]
+
+    @staticmethod
+    def _load(pattern_id, text, sequence_length=None):
+        pattern = json.loads(text)
+        if sequence_length is not None:
+            for key in PATTERN_SEQUENCES:
+                if key in pattern:
+                    pattern[key] = pattern[key][:sequence_length]
+        pattern['pattern_id'] = pattern_id
+        return pattern
+
+    def watermark(self, method):
+        """Last pattern id correlated with method (0 if never)."""
+        row = self.conn.execute("SELECT last_id FROM watermarks WHERE method = ?", (method,)).fetchone()
+        return row[0] if row else 0
+
+    def set_watermark(self, method, last_id):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO watermarks (method, last_id) VALUES (?, ?)",
+                              (method, last_id))
+
+    def update_matches(self, method, matches):
+        """
+        Merge newly scored best matches into the stored ones.
+
+        A stored match is only replaced by a strictly higher correlation,
+        so on ties the earlier exit stays, as in a scan over the exits in
+        arrival order.
+
+        Args:
+            method: Correlation method
+            matches: (entry, exit, correlation, details) tuples of stored
+                patterns
+
+        Returns:
+            int: Entries whose best match was added or replaced
+        """
+        rows = [(method, entry['pattern_id'], best['pattern_id'], float(correlation), json.dumps(details))
+                for entry, best, correlation, details in matches]
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT INTO matches (method, entry_id, exit_id, correlation, details) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (method, entry_id) DO UPDATE SET exit_id = excluded.exit_id, "
+                "correlation = excluded.correlation, details = excluded.details "
+                "WHERE excluded.correlation > matches.correlation", rows)
+            return self.conn.total_changes - before
+
+    def matches(self, method):
+        """
+        Best match of every entry correlated with method.
+
+        Returns:
+            list: (entry pattern, exit pattern, correlation, details) tuples
+                in entry arrival order
+        """
+        rows = self.conn.execute(
+            "SELECT e.id, e.pattern, x.id, x.pattern, m.correlation, m.details FROM matches m "
+            "JOIN patterns e ON e.id = m.entry_id JOIN patterns x ON x.id = m.exit_id "
+            "WHERE m.method = ? ORDER BY m.entry_id", (method,))
+        return [(self._load(entry_id, entry), self._load(exit_id, best), correlation, json.loads(details))
+                for entry_id, entry, exit_id, best, correlation, details in rows]
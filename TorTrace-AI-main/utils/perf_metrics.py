@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Performance Metrics
+
+Per-stage timers and counters for the analysis pipeline. A StageMetrics
+object accumulates wall-clock and CPU time for named stages (decode,
+relay matching, flow table updates, feature finalization, ...) plus
+plain counters, and exports them as a JSON-serializable dict or in the
+Prometheus text exposition format (for a node_exporter textfile
+collector or a push gateway).
+
+Stages may nest; each stage records only its own (exclusive) time, so
+the stage times of a run add up to the time spent inside stages.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'bimbo_analyzer'
+
+# Counters combined by aggregate_metrics (and exported as Prometheus counters)
+SUMMED_COUNTERS = ('packets', 'tor_packets', 'non_tor_packets', 'flows', 'bytes_read')
+
+
+def _cpu_seconds(children=False):
+    """CPU time of this process, plus reaped child processes if children."""
+    cpu = time.process_time()
+    if children and resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += usage.ru_utime + usage.ru_stime
+    return cpu
+
+
+def _ratio(numerator, denominator, digits=1):
+    return round(numerator / denominator, digits) if denominator > 0 else 0.0
+
+
+class StageMetrics:
+    """
+    Timers and counters for one analysis run.
+
+    Usage:
+        metrics = StageMetrics()
+        with metrics.stage('decode'):
+            ...
+        metrics.count('packets', n)
+        results['metrics'] = metrics.to_dict()
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self._stack = []
+        self._start_wall = time.perf_counter()
+        self._start_cpu = _cpu_seconds()
+
+    @contextmanager
+    def stage(self, name, children=False):
+        """
+        Time a block as stage name.
+
+        Args:
+            name: Stage name; repeated blocks with the same name accumulate
+            children: Also count CPU time of child processes that exit
+                inside the block (e.g. a worker pool shut down by it)
+        """
+        frame = [0.0, 0.0]  # Wall and CPU time of nested stages
+        self._stack.append(frame)
+        start_wall = time.perf_counter()
+        start_cpu = _cpu_seconds(children)
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = _cpu_seconds(children) - start_cpu
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+            entry = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0})
+            entry['wall_seconds'] += wall - frame[0]
+            entry['cpu_seconds'] += cpu - frame[1]
+            entry['calls'] += 1
+
+    def timed_batches(self, name, iterable, batch_size):
+        """
+        Pull items from iterable in lists of batch_size, timing each pull as
+        stage name (the time spent producing the items, e.g. reading and
+        decoding packets).
+
+        Yields:
+            list: Up to batch_size items
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                batch = list(islice(iterator, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def count(self, name, value=1):
+        """Add value to counter name."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """Record the current value of gauge name (None is ignored)."""
+        if value is not None:
+            self.gauges[name] = value
+
+    def to_dict(self):
+        """
+        Snapshot of the run as a JSON-serializable dict.
+
+        Returns:
+            dict: 'wall_seconds' and 'cpu_seconds' since the object was
+            created, 'stages' (per-stage wall/CPU seconds and calls),
+            'counters', 'gauges', and the derived rates 'packets_per_sec',
+            'flows_per_sec', 'bytes_per_sec' and 'relay_hit_ratio'
+        """
+        metrics = {
+            'wall_seconds': round(time.perf_counter() - self._start_wall, 6),
+            'cpu_seconds': round(_cpu_seconds() - self._start_cpu, 6),
+            'stages': {name: {'wall_seconds': round(entry['wall_seconds'], 6),
+                              'cpu_seconds': round(entry['cpu_seconds'], 6),
+                              'calls': entry['calls']}
+                       for name, entry in self.stages.items()},
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+        }
+        metrics.update(derived_rates(metrics))
+        return metrics
+
+
+def derived_rates(metrics):
+    """
+    Throughput and relay-hit ratio from a metrics dict's totals.
+
+    relay_hit_ratio is the fraction of TCP/IP packets that matched a Tor
+    relay.
+    """
+    counters = metrics.get('counters', {})
+    wall = metrics.get('wall_seconds', 0)
+    classified = counters.get('tor_packets', 0) + counters.get('non_tor_packets', 0)
+    return {
+        'packets_per_sec': _ratio(counters.get('packets', 0), wall),
+        'flows_per_sec': _ratio(counters.get('flows', 0), wall),
+        'bytes_per_sec': _ratio(counters.get('bytes_read', 0), wall),
+        'relay_hit_ratio': _ratio(counters.get('tor_packets', 0), classified, 4),
+    }
+
+
+def aggregate_metrics(runs):
+    """
+    Combine the metrics dicts of several runs (e.g. one per pcap).
+
+    Times and SUMMED_COUNTERS are added up, gauges keep their maximum, and
+    the rates are recomputed from the totals.
+
+    Args:
+        runs: Iterable of StageMetrics.to_dict() results (None entries skipped)
+
+    Returns:
+        dict: Combined metrics in the same layout, plus 'runs'
+    """
+    total = {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'stages': {}, 'counters': {}, 'gauges': {}, 'runs': 0}
+    for run in runs:
+        if not run:
+            continue
+        total['runs'] += 1
+        total['wall_seconds'] += run.get('wall_seconds', 0)
+        total['cpu_seconds'] += run.get('cpu_seconds', 0)
+        for name, entry in run.get('stages', {}).items():
+            stage = total['stages'].setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0})
+            for key in stage:
+                stage[key] += entry.get(key, 0)
+        for name, value in run.get('counters', {}).items():
+            if name in SUMMED_COUNTERS:
+                total['counters'][name] = total['counters'].get(name, 0) + value
+        for name, value in run.get('gauges', {}).items():
+            total['gauges'][name] = max(value, total['gauges'].get(name, value))
+    total['wall_seconds'] = round(total['wall_seconds'], 6)
+    total['cpu_seconds'] = round(total['cpu_seconds'], 6)
+    for stage in total['stages'].values():
+        stage['wall_seconds'] = round(stage['wall_seconds'], 6)
+        stage['cpu_seconds'] = round(stage['cpu_seconds'], 6)
+    total.update(derived_rates(total))
+    return total
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_prometheus(metrics, labels=None, prefix=METRIC_PREFIX):
+    """
+    Render a metrics dict in the Prometheus text exposition format.
+
+    Args:
+        metrics: StageMetrics.to_dict() (or aggregate_metrics()) result
+        labels: Optional dict of labels added to every sample (e.g. the pcap)
+        prefix: Metric name prefix
+
+    Returns:
+        str: Exposition text
+    """
+    labels = dict(labels or {})
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f'# HELP {prefix}_{name} {help_text}')
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+        for extra, value in samples:
+            lines.append(f'{prefix}_{name}{_format_labels({**labels, **extra})} {value}')
+
+    stages = metrics.get('stages', {})
+    family('stage_wall_seconds', 'gauge', 'Wall-clock seconds spent in each analysis stage',
+           [({'stage': name}, entry['wall_seconds']) for name, entry in stages.items()])
+    family('stage_cpu_seconds', 'gauge', 'CPU seconds spent in each analysis stage',
+           [({'stage': name}, entry['cpu_seconds']) for name, entry in stages.items()])
+    family('stage_calls', 'gauge', 'Times each analysis stage was entered',
+           [({'stage': name}, entry['calls']) for name, entry in stages.items()])
+    family('wall_seconds', 'gauge', 'Wall-clock seconds of the analysis run', [({}, metrics.get('wall_seconds', 0))])
+    family('cpu_seconds', 'gauge', 'CPU seconds of the analysis run', [({}, metrics.get('cpu_seconds', 0))])
+    for name, value in metrics.get('counters', {}).items():
+        family(f'{name}_total', 'counter', f'Total {name.replace("_", " ")}', [({}, value)])
+    for name, value in metrics.get('gauges', {}).items():
+        family(name, 'gauge', name.replace('_', ' ').capitalize(), [({}, value)])
+    for name in ('packets_per_sec', 'flows_per_sec', 'bytes_per_sec', 'relay_hit_ratio'):
+        if name in metrics:
+            family(name, 'gauge', name.replace('_', ' ').capitalize(), [({}, metrics[name])])
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(metrics, output_file, labels=None, prefix=METRIC_PREFIX):
+    """
+    Write a metrics dict as a Prometheus text file.
+
+    The file is replaced atomically so a textfile collector never reads a
+    partial write.
+    """
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(format_prometheus(metrics, labels, prefix))
+    os.replace(tmp_file, output_file)
+    logger.info(f"Metrics written to: {output_file}")
+    return output_file
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+BIMBO: Tor Relay Index
+
+Integer-keyed lookup index over the Tor relay database. IPv4 relay
+addresses are kept as a sorted uint32 array (and address/OR-port pairs as a
+sorted uint64 array) so whole batches of packets can be classified with
+np.searchsorted. Single addresses are checked against hashed sets, and
+optional CIDR subnets are matched as merged address ranges.
+"""
+
+import ipaddress
+import logging
+import os
+import socket
+import sqlite3
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RELAY_COLUMNS = ('fingerprint', 'nickname', 'address', 'or_port', 'bandwidth',
+                 'is_guard', 'is_exit', 'is_fast', 'is_stable')
+
+_shared_indexes = {}
+
+
+def ipv4_to_int(address):
+    """Pack a dotted-quad address into an int (raises OSError if invalid)."""
+    return int.from_bytes(socket.inet_aton(address), 'big')
+
+
+def _sorted_contains(sorted_keys, values):
+    """Vectorized membership test of values against a sorted unique array."""
+    if len(sorted_keys) == 0:
+        return np.zeros(len(values), dtype=bool)
+    idx = np.searchsorted(sorted_keys, values)
+    idx[idx == len(sorted_keys)] = 0
+    return sorted_keys[idx] == values
+
+
+def _merge_ranges(ranges):
+    """Merge (start, end) inclusive integer ranges into sorted disjoint arrays."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    starts = np.array([r[0] for r in merged], dtype=np.uint32)
+    ends = np.array([r[1] for r in merged], dtype=np.uint32)
+    return starts, ends
+
+
+class RelayIndex:
+    """
+    Lookup index of Tor relay addresses.
+
+    relays maps each address to the attributes of its relay (the last row
+    wins when several relays share an address) and records keeps every row
+    in database order.
+
+    An endpoint matches when its address is a relay address (or, with
+    match_or_port, when address and port are a relay's OR port) or when the
+    address falls inside one of the configured subnets.
+    """
+
+    def __init__(self, records, subnets=None, match_or_port=False):
+        """
+        Build the index.
+
+        Args:
+            records: Relay dicts with at least 'address' and 'or_port'
+            subnets: Optional CIDR strings treated as Tor address space
+            match_or_port: Require the port to be the relay's OR port
+        """
+        self.records = list(records)
+        self.match_or_port = match_or_port
+        self.relays = {}
+        self._endpoints = set()
+        ipv4 = set()
+        ipv4_endpoints = set()
+        for record in self.records:
+            address = record['address']
+            self.relays[address] = record
+            self._endpoints.add((address, record['or_port']))
+            try:
+                value = ipv4_to_int(address)
+            except OSError:
+                continue
+            ipv4.add(value)
+            ipv4_endpoints.add((value << 16) | (record['or_port'] or 0))
+        self.ipv4 = np.array(sorted(ipv4), dtype=np.uint32)
+        self.ipv4_endpoints = np.array(sorted(ipv4_endpoints), dtype=np.uint64)
+
+        self.subnets = [ipaddress.ip_network(s, strict=False) for s in (subnets or [])]
+        self._ipv6_subnets = [n for n in self.subnets if n.version == 6]
+        self._ipv4_starts, self._ipv4_ends = _merge_ranges(
+            (int(n.network_address), int(n.broadcast_address))
+            for n in self.subnets if n.version == 4
+        )
+
+    @classmethod
+    def from_db(cls, db_path, subnets=None, match_or_port=False):
+        """
+        Load every relay from the relay database.
+
+        Args:
+            db_path: Path to Tor relay database
+            subnets: Optional CIDR strings treated as Tor address space
+            match_or_port: Require the port to be the relay's OR port
+
+        Returns:
+            RelayIndex
+        """
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(RELAY_COLUMNS)} FROM relays")
+        records = []
+        for row in cursor.fetchall():
+            record = dict(zip(RELAY_COLUMNS, row))
+            for flag in ('is_guard', 'is_exit', 'is_fast', 'is_stable'):
+                record[flag] = bool(record[flag])
+            records.append(record)
+        conn.close()
+        return cls(records, subnets=subnets, match_or_port=match_or_port)
+
+    def __len__(self):
+        return len(self.relays)
+
+    def __contains__(self, address):
+        return self.contains(address)
+
+    def contains(self, address, port=None):
+        """
+        Check a single endpoint.
+
+        Args:
+            address: IPv4/IPv6 address string
+            port: TCP port (only used with match_or_port)
+
+        Returns:
+            bool
+        """
+        if self.match_or_port and port is not None:
+            if (address, port) in self._endpoints:
+                return True
+        elif address in self.relays:
+            return True
+        if self.subnets:
+            try:
+                ip = ipaddress.ip_address(address)
+            except ValueError:
+                return False
+            if ip.version == 4:
+                return bool(self._in_ipv4_subnets(np.array([int(ip)], dtype=np.uint32))[0])
+            return any(ip in net for net in self._ipv6_subnets)
+        return False
+
+    def match_ipv4(self, addresses, ports=None):
+        """
+        Vectorized membership test for packed IPv4 addresses.
+
+        Args:
+            addresses: Array of uint32 addresses (network order values)
+            ports: Matching array of ports (only used with match_or_port)
+
+        Returns:
+            np.ndarray: bool mask, True where the endpoint is a Tor relay
+        """
+        addresses = np.asarray(addresses, dtype=np.uint32)
+        if self.match_or_port and ports is not None:
+            keys = (addresses.astype(np.uint64) << np.uint64(16)) | np.asarray(ports, dtype=np.uint64)
+            hit = _sorted_contains(self.ipv4_endpoints, keys)
+        else:
+            hit = _sorted_contains(self.ipv4, addresses)
+        if len(self._ipv4_starts):
+            hit |= self._in_ipv4_subnets(addresses)
+        return hit
+
+    def match_addresses(self, addresses, ports=None):
+        """
+        Membership test for a batch of address strings.
+
+        IPv4 addresses are packed and tested in bulk; anything else is
+        checked one at a time.
+
+        Args:
+            addresses: Sequence of address strings
+            ports: Optional matching sequence of ports
+
+        Returns:
+            np.ndarray: bool mask
+        """
+        try:
+            # All IPv4 (the common case): pack the whole batch at once
+            packed = np.frombuffer(b''.join(map(socket.inet_aton, addresses)), dtype='>u4')
+            return self.match_ipv4(packed, ports)
+        except (OSError, TypeError):
+            pass
+        n = len(addresses)
+        packed = np.zeros(n, dtype=np.uint32)
+        is_ipv4 = np.zeros(n, dtype=bool)
+        for i, address in enumerate(addresses):
+            try:
+                packed[i] = ipv4_to_int(address)
+                is_ipv4[i] = True
+            except (OSError, TypeError):
+                continue
+        port_array = None if ports is None else np.asarray(ports, dtype=np.uint16)
+        hit = np.zeros(n, dtype=bool)
+        rows = np.flatnonzero(is_ipv4)
+        hit[rows] = self.match_ipv4(packed[rows], None if port_array is None else port_array[rows])
+        for i in np.flatnonzero(~is_ipv4).tolist():
+            hit[i] = self.contains(addresses[i], None if ports is None else ports[i])
+        return hit
+
+    def _in_ipv4_subnets(self, addresses):
+        idx = np.searchsorted(self._ipv4_starts, addresses, side='right') - 1
+        inside = idx >= 0
+        idx[~inside] = 0
+        return inside & (addresses <= self._ipv4_ends[idx])
+
+
+def load_relay_index(db_path, subnets=None, match_or_port=False):
+    """
+    Return a RelayIndex for db_path, shared by every caller in the process.
+
+    The index is rebuilt when the database file changes.
+
+    Args:
+        db_path: Path to Tor relay database
+        subnets: Optional CIDR strings treated as Tor address space
+        match_or_port: Require the port to be the relay's OR port
+
+    Returns:
+        RelayIndex
+    """
+    key = (os.path.abspath(db_path), tuple(subnets or ()), match_or_port)
+    mtime = os.path.getmtime(db_path)
+    cached = _shared_indexes.get(key)
+    if cached is None or cached[0] != mtime:
+        index = RelayIndex.from_db(db_path, subnets=subnets, match_or_port=match_or_port)
+        logger.info(f"Indexed {len(index)} relay addresses from {db_path}")
+        cached = _shared_indexes[key] = (mtime, index)
+    return cached[1]